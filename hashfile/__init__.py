@@ -7,22 +7,37 @@ Simple utility to calculate different types of hashes from given files/data
 
 from __future__ import print_function, unicode_literals
 
-import argparse
-import fileinput
+import binascii
+import collections
+import errno
 import hashlib
+import itertools
 import os
 import sys
+import threading
+import time
 import zlib
+from stat import S_ISREG
 
 try:
-    from io import StringIO
+    from os import scandir
 except ImportError:
-    from StringIO import StringIO
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 __version__ = '2.1.5'
 
 MAX_INPUT_READ = 4*1024**2
+PARTIAL_READ = 4*1024
 DEFAULT_ALGORITHM = 'sha1'
+SPLIT_THRESHOLD = 1024**3
+DEFAULT_LEAF_SIZE = 1024**2
+PAGE_CACHE_KEEP = 'keep'
+PAGE_CACHE_DROP = 'drop'
+PAGE_CACHE_DIRECT = 'direct'
+DIRECT_IO_ALIGNMENT = 4096
 E_OK = 0
 E_FAIL = 1
 E_FAIL_NO_FILES = 2
@@ -30,138 +45,1863 @@ VERIFICATION_OK = 'OK'
 VERIFICATION_FAIL = 'FAILED'
 
 
-PY3 = sys.version_info >= (3, 0)
+PY3 = sys.version_info >= (3, 0)
+
+# pylint: disable=missing-docstring
+def _get_available_hash_algorithms():
+    try:
+        available = hashlib.algorithms_available
+    except AttributeError:
+        try:
+            available = set(hashlib.algorithms)
+        except AttributeError:
+            available = {'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512'}
+
+    aliases = {
+        'sha1': {'DSA', 'DSA-SHA', 'dsaEncryption', 'dsaWithSHA', 'ecdsa-with-SHA1'}
+    }
+
+    for name in aliases:
+        if name in available:
+            available -= aliases[name]
+
+    to_remove = set()
+    for algo in available:
+        lowered = algo.lower()
+        if algo != lowered and lowered in available:
+            to_remove.add(algo)
+
+    available -= to_remove
+    return available
+
+AVAILABLE_HASH_ALGORITHMS = _get_available_hash_algorithms()
+AVAILABLE_CHECKSUM_ALGORITHMS = {'crc32', 'adler32'}
+AVAILABLE_ALGORITHMS = sorted(AVAILABLE_HASH_ALGORITHMS | AVAILABLE_CHECKSUM_ALGORITHMS)
+TREE_PREFIX = 'tree-'
+AVAILABLE_TREE_ALGORITHMS = {TREE_PREFIX + algo for algo in AVAILABLE_HASH_ALGORITHMS
+    if not algo.startswith('shake')}
+QUICK_PREFIX = 'quick-'
+AVAILABLE_QUICK_ALGORITHMS = {QUICK_PREFIX + algo for algo in AVAILABLE_ALGORITHMS if not algo.startswith('shake')}
+DEFAULT_QUICK_SAMPLES = 16
+QUICK_BLOCK_SIZE = 64*1024
+
+
+def _zlib_input(data):
+    """
+    zlib functions of Python 2 don't accept memoryview (chunks are views of reused buffers, see _read_chunks)
+    :param data:
+    :return:
+    """
+    if not PY3 and isinstance(data, memoryview):
+        return data.tobytes()
+    return data
+
+
+class Checksum(object):
+    """
+    hashlib-like interface for zlib checksums
+    """
+    def __init__(self, algo):
+        if algo not in AVAILABLE_CHECKSUM_ALGORITHMS:
+            raise ValueError("Unknown algorithm: %s" % algo)
+
+        self.name = algo
+        self._hasher = getattr(zlib, algo)
+        self._value = 0
+
+    def update(self, data):
+        self._value = self._hasher(_zlib_input(data), self._value)
+
+    def hexdigest(self):
+        value = self._value & 0xffffffff
+        return hex(value)[2:]
+
+
+def new_digester(algo):
+    """
+    Create hashlib-like object (with update and hexdigest methods) for any known algorithm
+    :param algo:
+    :return:
+    """
+    if algo in AVAILABLE_CHECKSUM_ALGORITHMS:
+        return Checksum(algo)
+
+    return hashlib.new(algo)
+
+
+def _get_executor_class():
+    """
+    Import concurrent.futures only when something is really calculated in parallel, it's slow to import
+    :return: ThreadPoolExecutor or None if not available
+    """
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:
+        return None
+
+    return ThreadPoolExecutor
+
+
+_RANGE_EXECUTORS = {}
+_RANGE_EXECUTORS_LOCK = threading.Lock()
+
+
+def _get_range_executor(jobs):
+    """
+    Return pool of threads shared by all files read in parts in parallel (see checksum_file and tree_leaves), so
+    files processed at once by other threads don't multiply number of threads (and buffers) reading parts
+    :param jobs: number of threads in pool
+    :return: ThreadPoolExecutor, or None if parts should be read in current thread
+    """
+    executor_class = _get_executor_class() if jobs > 1 else None
+    if executor_class is None:
+        return None
+
+    with _RANGE_EXECUTORS_LOCK:
+        if jobs not in _RANGE_EXECUTORS:
+            _RANGE_EXECUTORS[jobs] = executor_class(max_workers=jobs)
+        return _RANGE_EXECUTORS[jobs]
+
+
+_clock = getattr(time, 'perf_counter', time.time)
+_BUFFERS = threading.local()
+
+
+def _get_buffer(size):
+    """
+    Return buffer for reading data, allocated once per thread and reused for every file
+    :param size:
+    :return:
+    """
+    buf = getattr(_BUFFERS, 'buffer', None)
+    if buf is None or len(buf) != size:
+        buf = _BUFFERS.buffer = bytearray(size)
+    return buf
+
+
+def _new_aligned_buffer(size):
+    """
+    Allocate buffer aligned to memory page, as required by O_DIRECT
+    :param size: rounded up to DIRECT_IO_ALIGNMENT
+    :return:
+    """
+    import mmap
+
+    # anonymous maps are page aligned
+    return mmap.mmap(-1, -(-size // DIRECT_IO_ALIGNMENT) * DIRECT_IO_ALIGNMENT)
+
+
+def _get_aligned_buffer(size):
+    """
+    Return buffer aligned to memory page (see _new_aligned_buffer), allocated once per thread and reused
+    :param size:
+    :return:
+    """
+    buf = getattr(_BUFFERS, 'aligned', None)
+    if buf is None or len(buf) != -(-size // DIRECT_IO_ALIGNMENT) * DIRECT_IO_ALIGNMENT:
+        buf = _BUFFERS.aligned = _new_aligned_buffer(size)
+    return buf
+
+
+def _map_file(fh):
+    """
+    Map whole file into memory, return None if file cannot be mapped (empty files, pipes, devices...)
+    :param fh: file opened in binary mode
+    :return:
+    """
+    import mmap
+
+    try:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        return None
+
+
+def _read_chunks_ahead(fh, max_input_read, buffers, allocate=bytearray):
+    """
+    Yield content of file in chunks, read by separate thread into a pool of buffers, so reading next chunks
+    overlaps with processing current one. Every chunk must be consumed before next one is requested.
+    :param fh: file opened in binary mode
+    :param max_input_read: size of every buffer
+    :param buffers: number of buffers, memory used is limited to buffers * max_input_read
+    :param allocate: function allocating buffer of given size
+    :return:
+    """
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    free = queue.Queue()
+    filled = queue.Queue()
+    for _ in range(buffers):
+        free.put(allocate(max_input_read))
+
+    def _reader():
+        try:
+            while True:
+                buf = free.get()
+                # consumer is gone
+                if buf is None:
+                    return
+
+                size = fh.readinto(buf)
+                filled.put((buf, size, None))
+                if not size:
+                    return
+        except EnvironmentError as exc:
+            filled.put((None, 0, exc))
+
+    reader = threading.Thread(target=_reader, name='hashfile-reader')
+    reader.daemon = True
+    reader.start()
+
+    try:
+        while True:
+            buf, size, exc = filled.get()
+            if exc is not None:
+                raise exc
+            if not size:
+                break
+
+            yield memoryview(buf)[:size]
+            free.put(buf)
+    finally:
+        # reader can be blocked on reading from a pipe, so it is woken up but not joined
+        free.put(None)
+
+
+def _is_stream(file_path):
+    return file_path == '-' or hasattr(file_path, 'read')
+
+
+def _open_input(file_path, direct=False):
+    """
+    Open file for reading in unbuffered binary mode
+    :param file_path: path, '-' for STDIN, or file object (like archive member) opened in binary mode
+    :param direct: open with O_DIRECT, bypassing page cache, if supported by system and filesystem
+    :return: (file, True if opened with O_DIRECT)
+    """
+    if file_path == '-':
+        return sys.stdin.buffer if PY3 else sys.stdin, False
+    if _is_stream(file_path):
+        return file_path, False
+
+    # aligned buffers (maps) of Python 2 cannot be read into
+    if direct and PY3 and hasattr(os, 'O_DIRECT'):
+        try:
+            fd = os.open(file_path, os.O_RDONLY | os.O_DIRECT)
+        except OSError as exc:
+            # filesystem doesn't support O_DIRECT (like tmpfs)
+            if exc.errno != errno.EINVAL:
+                raise
+        else:
+            return os.fdopen(fd, 'rb', 0), True
+
+    return open(file_path, 'rb', 0), False
+
+
+def _drop_behind(fh, chunks):
+    """
+    Pass chunks through, advising kernel to read file sequentially, and to drop from page cache every chunk
+    already consumed
+    :param fh: file opened by _open_input, at the beginning
+    :param chunks: iterator of chunks of fh
+    :return:
+    """
+    fd = fh.fileno()
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    offset = 0
+    for chunk in chunks:
+        size = len(chunk)
+        yield chunk
+        os.posix_fadvise(fd, offset, size, os.POSIX_FADV_DONTNEED)
+        offset += size
+
+
+def drop_page_cache(file_path):
+    """
+    Advise kernel to drop whole file from page cache (when supported by system)
+    :param file_path:
+    :return:
+    """
+    if file_path == '-' or not hasattr(os, 'posix_fadvise'):
+        return
+
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _read_chunks(fh, max_input_read, use_mmap=False, readahead=0, direct=False):
+    """
+    Yield content of file in chunks. Chunks are views of the same reused buffer, so every one must be consumed
+    before next one is requested.
+    :param fh: file opened by _open_input
+    :param max_input_read:
+    :param use_mmap: read file through memory map, if possible
+    :param readahead: number of buffers filled in advance by separate thread (0 to read in current thread)
+    :param direct: fh is opened with O_DIRECT, data is read into aligned buffers (use_mmap is ignored)
+    :return:
+    """
+    # some file objects of Python 2 (like members of tar archives) can't read into buffer
+    if not hasattr(fh, 'readinto'):
+        for chunk in iter(lambda: fh.read(max_input_read), b''):
+            yield chunk
+        return
+
+    if direct and readahead > 0:
+        for chunk in _read_chunks_ahead(fh, max_input_read, readahead, _new_aligned_buffer):
+            yield chunk
+        return
+
+    if direct:
+        buf = _get_aligned_buffer(max_input_read)
+        view = memoryview(buf)
+        while True:
+            size = fh.readinto(buf)
+            if not size:
+                break
+
+            yield view[:size]
+        return
+
+    mapped = _map_file(fh) if use_mmap else None
+    if mapped is not None:
+        # map is not closed explicitly: consumer may still hold the last chunk, map is released with it. Map of
+        # Python 2 doesn't support memoryview, its chunks are copies.
+        view = memoryview(mapped) if PY3 else mapped
+        for offset in range(0, len(mapped), max_input_read):
+            yield view[offset:offset + max_input_read]
+        return
+
+    if readahead > 0:
+        for chunk in _read_chunks_ahead(fh, max_input_read, readahead):
+            yield chunk
+        return
+
+    buf = _get_buffer(max_input_read)
+    view = memoryview(buf)
+    while True:
+        size = fh.readinto(buf)
+        if not size:
+            break
+
+        yield view[:size]
+
+
+def digest_file(file_path, algos, max_input_read=4*1024**2, use_mmap=False, readahead=0, stats=None,
+        page_cache=PAGE_CACHE_KEEP):
+    """
+    Calculate hashes and checksums for many algorithms at once, reading file only once
+    :param file_path: path, '-' for STDIN, or file object opened in binary mode (it's not closed)
+    :param algos: list of algorithms
+    :param max_input_read:
+    :param use_mmap: read regular files through memory map
+    :param readahead: number of buffers filled in advance by separate reader thread
+    :param stats: FileStats to record time of opening, reading and hashing, or None
+    :param page_cache: PAGE_CACHE_KEEP, PAGE_CACHE_DROP to drop data from page cache as soon as it's hashed, or
+        PAGE_CACHE_DIRECT to bypass page cache with O_DIRECT (falls back to PAGE_CACHE_DROP when not supported)
+    :return: dict algo -> hash
+    """
+    digesters = [new_digester(algo) for algo in algos]
+
+    started = _clock() if stats is not None else None
+    stream = _is_stream(file_path)
+    fh, direct = _open_input(file_path, page_cache == PAGE_CACHE_DIRECT)
+    try:
+        chunks = _read_chunks(fh, max_input_read, use_mmap and not stream, readahead, direct)
+        if page_cache != PAGE_CACHE_KEEP and not direct and not stream and hasattr(os, 'posix_fadvise'):
+            chunks = _drop_behind(fh, chunks)
+        if stats is None:
+            for data in chunks:
+                for digester in digesters:
+                    digester.update(data)
+        else:
+            stats.open += _clock() - started
+            _digest_chunks_with_stats(chunks, algos, digesters, stats)
+    finally:
+        if not stream:
+            fh.close()
+
+    return {algo: digester.hexdigest() for algo, digester in zip(algos, digesters)}
+
+
+def _digest_chunks_with_stats(chunks, algos, digesters, stats):
+    while True:
+        started = _clock()
+        data = next(chunks, None)
+        stats.read += _clock() - started
+        if data is None:
+            break
+
+        stats.bytes += len(data)
+        for algo, digester in zip(algos, digesters):
+            started = _clock()
+            digester.update(data)
+            stats.hash[algo] = stats.hash.get(algo, 0) + _clock() - started
+
+
+def _gf2_matrix_times(matrix, vector):
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return result
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1, crc2, len2):
+    """
+    Calculate crc32 of concatenated data from crc32 of both parts (port of zlib's crc32_combine)
+    :param crc1: crc32 of first part
+    :param crc2: crc32 of second part
+    :param len2: length of second part
+    :return:
+    """
+    if len2 <= 0:
+        return crc1
+
+    # operator for one zero bit, then for two and four zero bits
+    odd = [0xedb88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    # apply len2 zeros to crc1
+    while True:
+        even = _gf2_matrix_square(odd)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+        odd = _gf2_matrix_square(even)
+        if len2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        len2 >>= 1
+        if not len2:
+            break
+
+    return crc1 ^ crc2
+
+
+def adler32_combine(adler1, adler2, len2):
+    """
+    Calculate adler32 of concatenated data from adler32 of both parts. Both parts must be calculated with
+    starting value 0, as checksum_file does.
+    :param adler1: adler32 of first part
+    :param adler2: adler32 of second part
+    :param len2: length of second part
+    :return:
+    """
+    base = 65521
+    sum_a = ((adler1 & 0xffff) + (adler2 & 0xffff)) % base
+    sum_b = ((adler1 >> 16) + (adler2 >> 16) + len2 * (adler1 & 0xffff)) % base
+    return sum_b << 16 | sum_a
+
+
+CHECKSUM_COMBINERS = {'crc32': crc32_combine, 'adler32': adler32_combine}
+
+
+def _checksum_range(file_path, algo, offset, length, max_input_read):
+    """
+    Calculate checksum (with starting value 0) of `length` bytes of file starting at `offset`
+    """
+    hasher = getattr(zlib, algo)
+    value = 0
+    buf = _get_buffer(max_input_read)
+    view = memoryview(buf)
+    with open(file_path, 'rb', 0) as fh:
+        fh.seek(offset)
+        while length > 0:
+            size = fh.readinto(view[:min(length, max_input_read)])
+            if not size:
+                break
+
+            value = hasher(_zlib_input(view[:size]), value)
+            length -= size
+
+    return value & 0xffffffff
+
+
+def checksum_file(file_path, algo, max_input_read=4*1024**2, use_mmap=False, readahead=0, jobs=1,
+        split_threshold=None, stats=None, page_cache=PAGE_CACHE_KEEP):
+    """
+    Calculate checksum
+    :param file_path: path or '-' for STDIN
+    :param algo:
+    :param max_input_read:
+    :param use_mmap: read regular files through memory map
+    :param readahead: number of buffers filled in advance by separate reader thread
+    :param jobs: number of threads used for files bigger than split_threshold (shared by all files, see
+        _get_range_executor)
+    :param split_threshold: files at least that big are split into `jobs` ranges checksummed in parallel, and
+        results are combined
+    :param stats: FileStats to record time of opening, reading and hashing, or None
+    :param page_cache: PAGE_CACHE_KEEP, PAGE_CACHE_DROP or PAGE_CACHE_DIRECT (see digest_file)
+    :return:
+    """
+    if algo not in AVAILABLE_CHECKSUM_ALGORITHMS:
+        raise ValueError("Unknown algorithm: %s" % algo)
+
+    size = 0
+    if file_path != '-' and jobs > 1 and split_threshold and _get_executor_class() is not None:
+        size = os.stat(file_path).st_size
+    if not split_threshold or size < split_threshold:
+        return digest_file(file_path, [algo], max_input_read, use_mmap, readahead, stats, page_cache)[algo]
+
+    # ranges aligned to max_input_read
+    range_size = -(-size // (jobs * max_input_read)) * max_input_read
+    ranges = [(offset, min(range_size, size - offset)) for offset in range(0, size, range_size)]
+
+    def _checksum(file_range):
+        offset, length = file_range
+        return _checksum_range(file_path, algo, offset, length, max_input_read)
+
+    started = _clock() if stats is not None else None
+    combine = CHECKSUM_COMBINERS[algo]
+    value = 0
+    for (_, length), range_value in zip(ranges, _imap_ordered(_checksum, ranges, jobs, _get_range_executor(jobs))):
+        value = combine(value, range_value, length)
+    if page_cache != PAGE_CACHE_KEEP:
+        drop_page_cache(file_path)
+
+    if stats is not None:
+        # ranges are read and checksummed together in many threads, so everything is counted as hashing
+        stats.bytes += size
+        stats.hash[algo] = stats.hash.get(algo, 0) + _clock() - started
+    return hex(value)[2:]
+
+
+def hash_file(file_path, algo, max_input_read=4*1024**2, use_mmap=False, readahead=0, stats=None,
+        page_cache=PAGE_CACHE_KEEP):
+    """
+    Calculate hash
+    :param file_path: path or '-' for STDIN
+    :param algo:
+    :param max_input_read:
+    :param use_mmap: read regular files through memory map
+    :param readahead: number of buffers filled in advance by separate reader thread
+    :param stats: FileStats to record time of opening, reading and hashing, or None
+    :param page_cache: PAGE_CACHE_KEEP, PAGE_CACHE_DROP or PAGE_CACHE_DIRECT (see digest_file)
+    :return:
+    """
+    if algo in AVAILABLE_CHECKSUM_ALGORITHMS:
+        raise ValueError("Unknown algorithm: %s" % algo)
+
+    return digest_file(file_path, [algo], max_input_read, use_mmap, readahead, stats, page_cache)[algo]
+
+
+def split_algorithm(algo):
+    """
+    Split algorithm label (like tree-sha256@65536) into name of algorithm and its numeric parameter (or None)
+    :param algo:
+    :return:
+    """
+    name, _, param = algo.partition('@')
+    return name, int(param) if param else None
+
+
+def _tree_base_algorithm(algo):
+    return split_algorithm(algo)[0][len(TREE_PREFIX):]
+
+
+def _read_tree_leaves(fh, base_algo, leaf_size, max_input_read, count=None):
+    """
+    Yield digests of leaves read from current position of fh: hash of 0x00 byte followed by leaf data
+    :param fh: file opened in unbuffered binary mode, or STDIN
+    :param base_algo: hashlib algorithm
+    :param leaf_size:
+    :param max_input_read:
+    :param count: read exactly that many leaves (last one can be shorter), or everything up to the end of file
+    :return:
+    """
+    buf = _get_buffer(max_input_read)
+    view = memoryview(buf)
+    read_leaves = 0
+    while count is None or read_leaves < count:
+        digester = hashlib.new(base_algo, b'\x00')
+        remaining = leaf_size
+        while remaining > 0:
+            size = fh.readinto(view[:min(remaining, max_input_read)])
+            if not size:
+                break
+            digester.update(view[:size])
+            remaining -= size
+
+        # empty data is one empty leaf, but there is no empty leaf at the end of data
+        if remaining == leaf_size and read_leaves > 0 and count is None:
+            break
+
+        read_leaves += 1
+        yield digester.digest()
+
+        if remaining > 0 and count is None:
+            break
+
+
+def tree_leaves(file_path, algo, max_input_read=4*1024**2, jobs=1, first=0, last=None):
+    """
+    Calculate digests of leaves of tree hash of file, reading parts of file in parallel
+    :param file_path: path or '-' for STDIN
+    :param algo: tree algorithm, like tree-sha256 or tree-sha256@65536
+    :param max_input_read:
+    :param jobs: number of threads reading parts of file (shared by all files, see _get_range_executor)
+    :param first: index of first leaf to calculate (only for regular files)
+    :param last: index of leaf after last one to calculate (only for regular files), or None for all
+    :return: list of digests (bytes)
+    """
+    base_algo = _tree_base_algorithm(algo)
+    leaf_size = split_algorithm(algo)[1] or DEFAULT_LEAF_SIZE
+
+    if file_path == '-':
+        fh = sys.stdin.buffer if PY3 else sys.stdin
+        return list(_read_tree_leaves(fh, base_algo, leaf_size, max_input_read))
+
+    count = max(1, -(-os.stat(file_path).st_size // leaf_size))
+    last = count if last is None else min(last, count)
+    span = max(1, -(-(last - first) // (jobs * 4)))
+
+    def _read_span(leaves_range):
+        start, stop = leaves_range
+        with open(file_path, 'rb', 0) as fh:
+            fh.seek(start * leaf_size)
+            return list(_read_tree_leaves(fh, base_algo, leaf_size, max_input_read, stop - start))
+
+    spans = [(start, min(start + span, last)) for start in range(first, last, span)]
+    # small files (single leaf) are read in current thread
+    if len(spans) == 1:
+        return _read_span(spans[0])
+
+    leaves = []
+    for digests in _imap_ordered(_read_span, spans, jobs, _get_range_executor(jobs)):
+        leaves.extend(digests)
+    return leaves
+
+
+def tree_root(leaves, algo):
+    """
+    Calculate root of tree hash from digests of leaves. Inner nodes are hashes of 0x01 byte followed by both
+    children, odd node at the end of level is promoted to next level.
+    :param leaves: list of digests (bytes)
+    :param algo: tree algorithm, like tree-sha256
+    :return: hex digest
+    """
+    base_algo = _tree_base_algorithm(algo)
+    level = leaves
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level) - 1, 2):
+            digester = hashlib.new(base_algo, b'\x01')
+            digester.update(level[i])
+            digester.update(level[i + 1])
+            parents.append(digester.digest())
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+
+    return binascii.hexlify(level[0]).decode('ascii')
+
+
+def tree_sidecar_path(file_path, algo):
+    return '%s.%s.leaves' % (file_path, split_algorithm(algo)[0])
+
+
+def write_tree_sidecar(file_path, algo, leaves):
+    """
+    Save digests of leaves next to the file (atomically), to allow finding damaged parts of file later
+    :param file_path:
+    :param algo:
+    :param leaves:
+    :return:
+    """
+    path = tree_sidecar_path(file_path, algo)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as fh:
+        fh.write('# %s %s\n' % (algo, os.stat(file_path).st_size))
+        for leaf in leaves:
+            fh.write('%s\n' % binascii.hexlify(leaf).decode('ascii'))
+    os.rename(tmp_path, path)
+
+
+def read_tree_sidecar(file_path, algo):
+    """
+    Read digests of leaves saved by write_tree_sidecar
+    :param file_path:
+    :param algo:
+    :return: (size of file, list of digests), or (None, None) when there is no sidecar for this algorithm
+    """
+    try:
+        fh = open(tree_sidecar_path(file_path, algo), 'r')
+    except (OSError, IOError):
+        return None, None
+
+    with fh:
+        header = fh.readline().split()
+        if len(header) != 3 or split_algorithm(header[1]) != split_algorithm(algo):
+            return None, None
+        return int(header[2]), [binascii.unhexlify(line.strip()) for line in fh if line.strip()]
+
+
+def tree_diff_ranges(file_path, algo, max_input_read=4*1024**2, jobs=1, byte_range=None):
+    """
+    Compare leaves of file with its sidecar, return list of (first byte, last byte) ranges which differ
+    :param file_path:
+    :param algo:
+    :param max_input_read:
+    :param jobs:
+    :param byte_range: (first byte, last byte) to compare only part of file, or None for whole file
+    :return: list of ranges, or None when there is no sidecar
+    """
+    leaf_size = split_algorithm(algo)[1] or DEFAULT_LEAF_SIZE
+    expected_size, expected = read_tree_sidecar(file_path, algo)
+    if expected is None:
+        return None
+
+    size = max(os.stat(file_path).st_size, expected_size)
+    first, last = 0, max(1, -(-size // leaf_size))
+    if byte_range is not None:
+        first = byte_range[0] // leaf_size
+        last = min(last, byte_range[1] // leaf_size + 1)
+
+    current = tree_leaves(file_path, algo, max_input_read, jobs, first, last)
+    ranges = []
+    for i in range(first, last):
+        leaf = current[i - first] if i - first < len(current) else None
+        if i < len(expected) and leaf == expected[i]:
+            continue
+
+        start, end = i * leaf_size, min((i + 1) * leaf_size, size) - 1
+        if ranges and ranges[-1][1] == start - 1:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def tree_hash_file(file_path, algo, max_input_read=4*1024**2, use_mmap=False, jobs=1, sidecar=False, stats=None,
+        page_cache=PAGE_CACHE_KEEP):
+    """
+    Calculate tree (Merkle) hash: file is split into leaves (1MiB by default, or as given after @ in algo)
+    which are hashed in parallel
+    :param file_path: path or '-' for STDIN
+    :param algo: tree algorithm, like tree-sha256 or tree-sha256@65536
+    :param max_input_read:
+    :param use_mmap: ignored, leaves are read with positional reads
+    :param jobs: number of threads
+    :param sidecar: save digests of leaves next to the file (see write_tree_sidecar)
+    :param stats: FileStats to record time of hashing, or None
+    :param page_cache: PAGE_CACHE_KEEP, or anything else to drop file from page cache when it's hashed
+    :return:
+    """
+    if split_algorithm(algo)[0] not in AVAILABLE_TREE_ALGORITHMS:
+        raise ValueError("Unknown algorithm: %s" % algo)
+
+    started = _clock() if stats is not None else None
+    leaves = tree_leaves(file_path, algo, max_input_read, jobs)
+    if sidecar and file_path != '-':
+        write_tree_sidecar(file_path, algo, leaves)
+
+    root = tree_root(leaves, algo)
+    if page_cache != PAGE_CACHE_KEEP:
+        drop_page_cache(file_path)
+    if stats is not None:
+        # leaves are read and hashed together in many threads, so everything is counted as hashing
+        if file_path != '-':
+            stats.bytes += os.stat(file_path).st_size
+        stats.hash[algo] = stats.hash.get(algo, 0) + _clock() - started
+    return root
+
+
+def _quick_offsets(size, samples, block_size=QUICK_BLOCK_SIZE):
+    """
+    Return offsets of blocks read by quick-* algorithms: head, tail and `samples` evenly spaced blocks between
+    them (aligned to 4KiB), or None if whole file should be read
+    :param size: size of file
+    :param samples:
+    :param block_size:
+    :return:
+    """
+    if size <= (samples + 2) * block_size:
+        return None
+
+    last = size - block_size
+    middle = [(last * (i + 1) // (samples + 1)) // 4096 * 4096 for i in range(samples)]
+    return sorted(set([0] + middle + [last]))
+
+
+def quick_hash_file(file_path, algo, max_input_read=4*1024**2, use_mmap=False, stats=None,
+        page_cache=PAGE_CACHE_KEEP):
+    """
+    Calculate quick fingerprint: hash of size of file and of sampled blocks only (head, tail and evenly spaced
+    blocks between them, 16 by default or as given after @ in algo), so cost doesn't depend on size of file.
+    Files not bigger than all sampled blocks are hashed whole. Detects most changes, but not all of them: use
+    for triage only.
+    :param file_path: path of regular file, STDIN is not supported
+    :param algo: quick algorithm, like quick-sha1 or quick-sha1@64
+    :param max_input_read: size of chunks in which files hashed whole are read, sampled blocks are read at once
+    :param use_mmap: ignored, blocks are read with positional reads
+    :param stats: FileStats to record time of hashing, or None
+    :param page_cache: PAGE_CACHE_KEEP, or anything else to drop file from page cache when it's hashed
+    :return:
+    """
+    name, samples = split_algorithm(algo)
+    if name not in AVAILABLE_QUICK_ALGORITHMS:
+        raise ValueError("Unknown algorithm: %s" % algo)
+    if file_path == '-':
+        raise IOError(errno.ESPIPE, '%s cannot be calculated for STDIN' % algo)
+
+    started = _clock() if stats is not None else None
+    digester = new_digester(name[len(QUICK_PREFIX):])
+    read = 0
+    with open(file_path, 'rb', 0) as fh:
+        size = os.fstat(fh.fileno()).st_size
+        digester.update(('%d\n' % size).encode('ascii'))
+
+        offsets = _quick_offsets(size, DEFAULT_QUICK_SAMPLES if samples is None else samples)
+        if offsets is None:
+            # whole file (it can be big, with many samples) is read in chunks, only up to size hashed above
+            for data in _read_chunks(fh, max_input_read):
+                data = data[:size - read]
+                digester.update(data)
+                read += len(data)
+                if read >= size:
+                    break
+        else:
+            for offset in offsets:
+                if hasattr(os, 'pread'):
+                    data = os.pread(fh.fileno(), QUICK_BLOCK_SIZE, offset)
+                else:
+                    fh.seek(offset)
+                    data = fh.read(QUICK_BLOCK_SIZE)
+                digester.update(data)
+                read += len(data)
+
+    if page_cache != PAGE_CACHE_KEEP:
+        drop_page_cache(file_path)
+    if stats is not None:
+        stats.bytes += read
+        stats.hash[algo] = stats.hash.get(algo, 0) + _clock() - started
+    return digester.hexdigest()
+
+
+def _get_file_helpers():
+    helpers = {algo: hash_file for algo in AVAILABLE_HASH_ALGORITHMS}
+    helpers.update({algo: checksum_file for algo in AVAILABLE_CHECKSUM_ALGORITHMS})
+    helpers.update({algo: tree_hash_file for algo in AVAILABLE_TREE_ALGORITHMS})
+    helpers.update({algo: quick_hash_file for algo in AVAILABLE_QUICK_ALGORITHMS})
+    return helpers
+
+FILE_HELPERS = _get_file_helpers()
+
+
+def get_file_helper(algo):
+    """
+    Return function calculating digest of file for algorithm label (see split_algorithm)
+    :param algo:
+    :return:
+    """
+    return FILE_HELPERS[split_algorithm(algo)[0]]
+
+
+def _get_cpu_count():
+    try:
+        count = os.cpu_count()
+    except AttributeError:
+        import multiprocessing
+        try:
+            count = multiprocessing.cpu_count()
+        except NotImplementedError:
+            count = None
+
+    return count or 1
+
+DEFAULT_JOBS = _get_cpu_count()
+
+
+def _imap_ordered(func, items, jobs=DEFAULT_JOBS, executor=None):
+    """
+    Call func for every item from items in a pool of threads, yield results in order of items
+    Only `jobs` items are processed at once, and only few finished results are kept waiting for
+    slower predecessors, so memory use is bounded no matter how many items are given.
+    :param func:
+    :param items: any iterable, consumed lazily
+    :param jobs: number of worker threads, 1 means no threads at all
+    :param executor: existing pool of threads (not shut down when done), or None to create new one
+    :return:
+    """
+    shared = executor is not None
+    if not shared:
+        executor_class = _get_executor_class() if jobs > 1 else None
+        if executor_class is None:
+            for item in items:
+                yield func(item)
+            return
+        executor = executor_class(max_workers=jobs)
+
+    pending = collections.deque()
+    completed = False
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= jobs * 4:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+        completed = True
+    finally:
+        for future in pending:
+            future.cancel()
+        # when iteration is abandoned or interrupted, items still being processed are not waited for
+        if not shared:
+            executor.shutdown(wait=completed)
+
+
+SCHEDULES = ('inode', 'extent')
+DEFAULT_SCHEDULE_WINDOW = 10000
+FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_UNSUPPORTED = set()
+
+
+def _first_extent(path, device):
+    """
+    Return physical offset of first extent of file, using FIEMAP ioctl (Linux only)
+    :param path:
+    :param device: st_dev of file, devices not supporting FIEMAP are remembered
+    :return: offset in bytes, or None if not available
+    """
+    if device in _FIEMAP_UNSUPPORTED:
+        return None
+
+    try:
+        import array
+        import fcntl
+        import struct
+    except ImportError:
+        return None
+
+    # struct fiemap for single struct fiemap_extent: start, length, flags, mapped extents, extent count, reserved
+    # (array, because ioctl of Python 2 doesn't accept bytearray as mutable buffer)
+    request = array.array(str('B'), struct.pack('=QQLLLL', 0, 0xffffffffffffffff, 0, 0, 1, 0) + b'\0' * 56)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    except (OSError, IOError):
+        _FIEMAP_UNSUPPORTED.add(device)
+        return None
+    finally:
+        os.close(fd)
+
+    # empty files, and files stored inline in inode have no extents
+    if not struct.unpack_from('=L', request, 20)[0]:
+        return 0
+    return struct.unpack_from('=Q', request, 40)[0]
+
+
+def file_location(path, schedule='inode'):
+    """
+    Return key sorting files by their location on disk
+    :param path:
+    :param schedule: 'inode' to sort by inode number, 'extent' to sort by physical offset of first extent of
+        file (falls back to inode number when filesystem doesn't support FIEMAP)
+    :return: tuple (device, offset or inode)
+    """
+    try:
+        stat = os.stat(path) if path != '-' else None
+    except OSError:
+        stat = None
+    if stat is None:
+        return -1, 0
+
+    if schedule == 'extent':
+        offset = _first_extent(path, stat.st_dev)
+        if offset is not None:
+            return stat.st_dev, offset
+
+    return stat.st_dev, stat.st_ino
+
+
+def _imap_scheduled(func, items, jobs, key, window=DEFAULT_SCHEDULE_WINDOW):
+    """
+    Like _imap_ordered, but every `window` items are processed in order given by key (for example location on
+    disk). Results are still yielded in order of items, after whole window is processed.
+    :param func:
+    :param items: any iterable, consumed lazily, window by window
+    :param jobs: number of worker threads
+    :param key: function returning sort key for item
+    :param window: number of items sorted at once
+    :return:
+    """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, window))
+        if not batch:
+            return
+
+        keys = [key(item) for item in batch]
+        order = sorted(range(len(batch)), key=keys.__getitem__)
+        results = [None] * len(batch)
+        for i, result in zip(order, _imap_ordered(func, (batch[i] for i in order), jobs)):
+            results[i] = result
+
+        for result in results:
+            yield result
+
+
+def walk_files(path, follow_symlinks=False, exclude=(), sort=False, onerror=None):
+    """
+    Yield paths of all regular files in directory path and its subdirectories, as soon as they are found.
+    Only open directories are kept in memory, not the list of found files.
+    :param path:
+    :param follow_symlinks: follow symbolic links to files and directories, they are skipped otherwise
+    :param exclude: list of glob patterns, matching files and directories (by name or by whole path) are skipped
+    :param sort: yield files in deterministic order (sorted by name in every directory, depth first)
+    :param onerror: function called with OSError when directory cannot be read
+    :return:
+    """
+    import fnmatch
+
+    def _excluded(entry):
+        for pattern in exclude:
+            if fnmatch.fnmatch(entry.name, pattern) or fnmatch.fnmatch(entry.path, pattern):
+                return True
+        return False
+
+    def _open_dir(dir_path):
+        try:
+            entries = scandir(dir_path)
+            if sort:
+                entries = iter(sorted(entries, key=lambda entry: entry.name))
+            return entries
+        except OSError as exc:
+            if onerror is not None:
+                onerror(exc)
+            return None
+
+    def _dir_id(dir_path):
+        stat = os.stat(dir_path)
+        return stat.st_dev, stat.st_ino
+
+    # stack of directories being read, with their ids to detect symlink loops
+    root = _open_dir(path)
+    if root is None:
+        return
+    stack = [(root, _dir_id(path) if follow_symlinks else None)]
+    try:
+        while stack:
+            entry = next(stack[-1][0], None)
+            if entry is None:
+                stack.pop()
+                continue
+
+            if _excluded(entry):
+                continue
+
+            try:
+                if entry.is_symlink() and not follow_symlinks:
+                    continue
+
+                if entry.is_dir():
+                    dir_id = None
+                    if follow_symlinks:
+                        dir_id = _dir_id(entry.path)
+                        if dir_id in [parent_id for _, parent_id in stack]:
+                            continue
+
+                    entries = _open_dir(entry.path)
+                    if entries is not None:
+                        stack.append((entries, dir_id))
+                elif entry.is_file():
+                    yield entry.path
+            except OSError as exc:
+                if onerror is not None:
+                    onerror(exc)
+    finally:
+        for entries, _ in stack:
+            if hasattr(entries, 'close'):
+                entries.close()
+
+
+def _get_default_cache_path():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'hashfile', 'digests.sqlite')
+
+DEFAULT_CACHE_PATH = _get_default_cache_path()
+DEFAULT_CACHE_SIZE = 1000000
+
+
+# digests of files modified so recently can be stale even if metadata did not change (modification in the same
+# timestamp tick as hashing), so their metadata is not trusted
+RACY_NS = 2 * 10**9
+
+
+def _mtime_ns(stat):
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 10**9)
+    return mtime_ns
+
+
+class DigestCache(object):
+    """
+    On-disk (SQLite) cache of calculated digests of regular files, keyed by device, inode, size and modification
+    time of file, and algorithm. Least recently used entries are evicted when there is more than max_entries of
+    them. Can be shared by many threads and by many processes: write transactions are short, never kept open
+    while files are read, and when database can't be used (for example it's locked for too long by another
+    process) digests are calculated without cache.
+    """
+    # digests of racy files are not stored
+    RACY_NS = RACY_NS
+    # times of last use of cached digests are saved in batches
+    USED_BATCH = 1000
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_CACHE_SIZE, refresh=False):
+        import sqlite3
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+
+        self.path = path
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._used = {}
+        self._errors = sqlite3.Error
+        self._failed = False
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        try:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            pass
+        self._db.execute('CREATE TABLE IF NOT EXISTS digests ('
+            'dev INTEGER, ino INTEGER, algo TEXT, size INTEGER, mtime_ns INTEGER, digest TEXT, used REAL, '
+            'PRIMARY KEY (dev, ino, algo))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS digests_used ON digests (used)')
+        self._db.commit()
+
+    @staticmethod
+    def file_key(file_path):
+        """
+        Return metadata identifying content of file: (st_dev, st_ino, st_size, st_mtime_ns)
+        :param file_path:
+        :return: None for anything but regular file (metadata of devices doesn't change when they are written)
+        """
+        stat = os.stat(file_path)
+        if not S_ISREG(stat.st_mode):
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_size, _mtime_ns(stat)
+
+    def get(self, key, algo):
+        """
+        Return cached digest for file identified by key (see file_key), or None
+        :param key:
+        :param algo:
+        :return:
+        """
+        if self.refresh:
+            return None
+
+        dev, ino, size, mtime_ns = key
+        with self._lock:
+            row = self._db.execute('SELECT digest FROM digests WHERE dev = ? AND ino = ? AND algo = ? '
+                'AND size = ? AND mtime_ns = ?', (dev, ino, algo, size, mtime_ns)).fetchone()
+            if row is None:
+                return None
+
+            # read only lookup doesn't lock database for writing
+            self._used[dev, ino, algo] = time.time()
+            if len(self._used) >= self.USED_BATCH:
+                self._save_used()
+
+        return row[0]
+
+    def set(self, key, algo, digest):
+        """
+        Store digest for file identified by key (see file_key)
+        :param key:
+        :param algo:
+        :param digest:
+        :return:
+        """
+        dev, ino, size, mtime_ns = key
+        if mtime_ns > time.time() * 10**9 - self.RACY_NS:
+            return
+
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO digests (dev, ino, algo, size, mtime_ns, digest, used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', (dev, ino, algo, size, mtime_ns, digest, time.time()))
+
+    def digest(self, file_path, algos, calculate):
+        """
+        Return digests of file for all algos, calling calculate(missing_algos) only for algorithms not found
+        in cache
+        :param file_path:
+        :param algos:
+        :param calculate: function returning dict algo -> digest
+        :return: dict algo -> digest
+        """
+        key = self.file_key(file_path)
+        if key is None:
+            return calculate(algos)
+
+        digests = {}
+        try:
+            for algo in algos:
+                digest = self.get(key, algo)
+                if digest is not None:
+                    digests[algo] = digest
+        except self._errors as exc:
+            self._error(exc)
+
+        missing = [algo for algo in algos if algo not in digests]
+        if not missing:
+            return digests
+
+        digests.update(calculate(missing))
+        # file changed while it was read, result is not reliable enough to be cached
+        if self.file_key(file_path) == key:
+            try:
+                for algo in missing:
+                    self.set(key, algo, digests[algo])
+            except self._errors as exc:
+                self._error(exc)
+
+        return digests
+
+    def _error(self, exc):
+        # reported once, every file is still hashed
+        if not self._failed:
+            self._failed = True
+            print('ERROR: %s %s (digests are calculated without cache)' % (self.path, exc), file=sys.stderr)
+
+    def _save_used(self):
+        used, self._used = self._used, {}
+        with self._db:
+            self._db.executemany('UPDATE digests SET used = ? WHERE dev = ? AND ino = ? AND algo = ?',
+                [(used_time, dev, ino, algo) for (dev, ino, algo), used_time in used.items()])
+
+    def close(self):
+        """
+        Evict least recently used entries over the limit, and save everything
+        :return:
+        """
+        with self._lock:
+            try:
+                self._save_used()
+                count = self._db.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+                if count > self.max_entries:
+                    with self._db:
+                        self._db.execute('DELETE FROM digests WHERE rowid IN '
+                            '(SELECT rowid FROM digests ORDER BY used LIMIT ?)', (count - self.max_entries, ))
+            except self._errors as exc:
+                self._error(exc)
+            finally:
+                self._db.close()
+
+
+def _open_cache(args):
+    """
+    Open digest cache if enabled by command line or HASHFILE_CACHE environment variable
+    :param args:
+    :return:
+    """
+    if args.no_cache or not (args.cache or args.refresh_cache or os.environ.get('HASHFILE_CACHE')):
+        return None
+
+    import sqlite3
+    try:
+        return DigestCache(args.cache_file, max_entries=args.cache_size, refresh=args.refresh_cache)
+    except sqlite3.Error as exc:
+        print('ERROR: %s %s (digests are calculated without cache)' % (args.cache_file, exc), file=sys.stderr)
+        return None
+
+
+class FileStats(object):
+    """
+    Time spent on opening, reading and hashing (per algorithm) single file, and amount of data read
+    """
+    def __init__(self, path):
+        self.path = path
+        self.open = 0.0
+        self.read = 0.0
+        self.hash = {}
+        self.bytes = 0
+        self.cached = False
+        self.error = None
+
+    def as_dict(self):
+        return {
+            'path': self.path,
+            'open_s': self.open,
+            'read_s': self.read,
+            'hash_s': self.hash,
+            'bytes': self.bytes,
+            'cached': self.cached,
+            'error': str(self.error) if self.error is not None else None,
+        }
+
+
+class Stats(object):
+    """
+    Counters of processed files and data, and of time spent on opening, reading, hashing (per algorithm) and
+    printing results. Times of all threads are summed, so they can be bigger than wall time. Opened files are
+    counted the same way as manifests in OPENED_FILES.
+    """
+    def __init__(self, on_file=None):
+        """
+        :param on_file: function called with FileStats of every processed file (from worker threads)
+        """
+        self.on_file = on_file
+        self.started = _clock()
+        self.opened = {'succes': 0, 'fail': 0}
+        self.cached = 0
+        self.bytes = 0
+        self.open = 0.0
+        self.read = 0.0
+        self.output = 0.0
+        self.algorithms = {}
+        self._lock = threading.Lock()
+
+    def add(self, file_stats, algos):
+        """
+        Add stats of processed file
+        :param file_stats: FileStats
+        :param algos: algorithms calculated for file
+        :return:
+        """
+        with self._lock:
+            self.opened['fail' if file_stats.error is not None else 'succes'] += 1
+            self.cached += file_stats.cached
+            self.bytes += file_stats.bytes
+            self.open += file_stats.open
+            self.read += file_stats.read
+            for algo in algos:
+                counters = self.algorithms.setdefault(algo, {'files': 0, 'bytes': 0, 'hash_s': 0.0})
+                if file_stats.error is None:
+                    counters['files'] += 1
+                    counters['bytes'] += file_stats.bytes
+                counters['hash_s'] += file_stats.hash.get(algo, 0.0)
+
+        if self.on_file is not None:
+            self.on_file(file_stats)
+
+    def add_output(self, seconds):
+        self.output += seconds
+
+    def summary(self):
+        """
+        :return: dict with all counters
+        """
+        elapsed = _clock() - self.started
+        files = self.opened['succes']
+        algorithms = {}
+        for algo, counters in self.algorithms.items():
+            algorithms[algo] = dict(counters, files_per_s=counters['files'] / elapsed if elapsed else None)
+
+        return {
+            'elapsed_s': elapsed,
+            'files': files,
+            'failed': self.opened['fail'],
+            'cached': self.cached,
+            'manifests': dict(OPENED_FILES),
+            'bytes': self.bytes,
+            'files_per_s': files / elapsed if elapsed else None,
+            'bytes_per_s': self.bytes / elapsed if elapsed else None,
+            'open_s': self.open,
+            'read_s': self.read,
+            'hash_s': sum(counters['hash_s'] for counters in self.algorithms.values()),
+            'output_s': self.output,
+            'algorithms': algorithms,
+        }
+
+    def format_summary(self):
+        """
+        :return: human readable summary, list of lines
+        """
+        summary = self.summary()
+        mib = 1024.0**2
+        lines = [
+            'stats: %d files (%d failed, %d cached), %.1f MiB in %.2fs: %.1f files/s, %.1f MiB/s' % (
+                summary['files'], summary['failed'], summary['cached'], summary['bytes'] / mib,
+                summary['elapsed_s'], summary['files_per_s'] or 0, (summary['bytes_per_s'] or 0) / mib),
+            'stats: time in open %.3fs, read %.3fs, hash %.3fs, output %.3fs' % (
+                summary['open_s'], summary['read_s'], summary['hash_s'], summary['output_s']),
+        ]
+        for algo in sorted(summary['algorithms']):
+            counters = summary['algorithms'][algo]
+            lines.append('stats: %s: %d files, %.1f MiB, hash %.3fs: %.1f files/s, %.1f MiB/s' % (
+                algo, counters['files'], counters['bytes'] / mib, counters['hash_s'], counters['files_per_s'] or 0,
+                counters['bytes'] / mib / counters['hash_s'] if counters['hash_s'] else 0))
+        return lines
+
+
+HASH_OPTIONS = {
+    'max_input_read': MAX_INPUT_READ,
+    'use_mmap': False,
+    'readahead': 0,
+    'jobs': 1,
+    'split_threshold': SPLIT_THRESHOLD,
+    'tree_sidecar': False,
+    'page_cache': PAGE_CACHE_KEEP,
+}
+
+
+def _hash_options(options):
+    """
+    Return complete options for _file_digests: given ones with defaults for missing
+    :param options: dict, keys as in HASH_OPTIONS
+    :return:
+    """
+    unknown = set(options) - set(HASH_OPTIONS)
+    if unknown:
+        raise TypeError('Unknown options: %s' % ', '.join(sorted(unknown)))
+
+    result = dict(HASH_OPTIONS)
+    result.update(options)
+    return result
+
+
+def _file_digests(file_path, algos, options, cache=None, stats=None):
+    """
+    Calculate digests of file for all algos, using FILE_HELPERS (or reading file once for many algos) and cache
+    :param file_path:
+    :param algos:
+    :param options: dict, as returned by _hash_options
+    :param cache: DigestCache or None
+    :param stats: FileStats or None
+    :return: dict algo -> digest
+    """
+    def _calculate(algos):
+        if stats is not None:
+            stats.cached = False
+
+        if len(algos) > 1:
+            return digest_file(file_path, algos, max_input_read=options['max_input_read'],
+                use_mmap=options['use_mmap'], readahead=options['readahead'], stats=stats,
+                page_cache=options['page_cache'])
+
+        algo = algos[0]
+        helper_options = {'page_cache': options['page_cache']}
+        if stats is not None:
+            helper_options['stats'] = stats
+        if algo in AVAILABLE_CHECKSUM_ALGORITHMS:
+            helper_options.update(readahead=options['readahead'], jobs=options['jobs'],
+                split_threshold=options['split_threshold'])
+        elif algo.startswith(TREE_PREFIX):
+            helper_options.update(jobs=options['jobs'], sidecar=options['tree_sidecar'])
+        elif algo.startswith(QUICK_PREFIX):
+            pass
+        else:
+            helper_options.update(readahead=options['readahead'])
+
+        file_helper = get_file_helper(algo)
+        return {algo: file_helper(file_path, algo=algo, max_input_read=options['max_input_read'],
+            use_mmap=options['use_mmap'], **helper_options)}
+
+    if cache is None or file_path == '-':
+        return _calculate(algos)
+
+    if stats is not None:
+        stats.cached = True
+    return cache.digest(file_path, algos, _calculate)
+
+
+HashResult = collections.namedtuple('HashResult', ['path', 'algo', 'digest', 'size', 'error', 'mtime_ns'])
+HashResult.__new__.__defaults__ = (None, )
+
+
+def hash_many(paths, algorithms=(DEFAULT_ALGORITHM, ), jobs=DEFAULT_JOBS, cache=None, stats=None, schedule=None,
+        schedule_window=DEFAULT_SCHEDULE_WINDOW, **options):
+    """
+    Calculate digests of many files in parallel, yield results in order of paths. When many algorithms are given,
+    every file is read only once.
+    :param paths: iterable of paths ('-' for STDIN), or of (path, algorithms) tuples to use other algorithms
+        for some files. Consumed lazily.
+    :param algorithms: list of algorithms calculated for every path
+    :param jobs: number of threads
+    :param cache: DigestCache or None
+    :param stats: Stats collecting time spent on opening, reading and hashing files, or None
+    :param schedule: None to read files in order of paths, or one of SCHEDULES: every schedule_window files are
+        read in order of their location on disk (see file_location), to avoid seeking on rotational disks.
+        Results are yielded in order of paths anyway.
+    :param schedule_window: number of files reordered at once
+    :param options: max_input_read, use_mmap, readahead, split_threshold, tree_sidecar, page_cache (see HASH_OPTIONS)
+    :return: iterator of HashResult (path, algo, digest, size, error, mtime_ns), one for every path and algorithm.
+        When file cannot be read, digest is None and error is the exception (the same one for all algorithms).
+        mtime_ns is modification time of file before it was read, None if file was modified so recently that
+        it could be modified again without changing it (see RACY_NS).
+    """
+    options = _hash_options(dict(options, jobs=jobs))
+
+    def _tasks():
+        for path in paths:
+            if isinstance(path, tuple):
+                yield path
+            else:
+                yield path, algorithms
+
+    def _calculate(task):
+        path, algos = task
+        return _hash_results(path, algos, options, cache, stats)
+
+    if schedule is None:
+        results_iter = _imap_ordered(_calculate, _tasks(), jobs)
+    else:
+        results_iter = _imap_scheduled(_calculate, _tasks(), jobs, lambda task: file_location(task[0], schedule),
+            schedule_window)
+
+    for results in results_iter:
+        for result in results:
+            yield result
+
+
+def _hash_results(path, algos, options, cache=None, stats=None):
+    """
+    Calculate digests of file, return list of HashResult, one for every algorithm
+    :param path:
+    :param algos:
+    :param options: dict, as returned by _hash_options
+    :param cache: DigestCache or None
+    :param stats: Stats or None
+    :return:
+    """
+    algos = list(algos)
+    file_stats = FileStats(path) if stats is not None else None
+    try:
+        size = mtime_ns = None
+        if path != '-':
+            stat = os.stat(path)
+            size, mtime_ns = stat.st_size, _mtime_ns(stat)
+            if mtime_ns > time.time() * 10**9 - RACY_NS:
+                mtime_ns = None
+        digests = _file_digests(path, algos, options, cache, file_stats)
+    except (OSError, IOError) as exc:
+        if stats is not None:
+            file_stats.error = exc
+            stats.add(file_stats, algos)
+        return [HashResult(path, algo, None, None, exc) for algo in algos]
+
+    if stats is not None:
+        stats.add(file_stats, algos)
+    return [HashResult(path, algo, digests[algo], size, None, mtime_ns) for algo in algos]
+
+
+def _cli_hash_options(args):
+    """
+    Return options for hash_many and verify_manifest from command line arguments
+    :param args:
+    :return:
+    """
+    return {
+        'max_input_read': args.max_input_read,
+        'use_mmap': args.mmap,
+        'readahead': args.readahead,
+        'split_threshold': args.split_threshold,
+        'tree_sidecar': args.tree_sidecar,
+        'page_cache': args.page_cache,
+    }
+
+
+def _open_stats(args):
+    """
+    Create Stats if enabled by --stats option, with printing stats of every file as JSON lines when requested
+    :param args:
+    :return:
+    """
+    if not args.stats:
+        return None
+
+    import json
+
+    on_file = None
+    if args.stats == 'json':
+        lock = threading.Lock()
 
-# pylint: disable=missing-docstring
-def _get_available_hash_algorithms():
-    try:
-        available = hashlib.algorithms_available
-    except AttributeError:
-        try:
-            available = set(hashlib.algorithms)
-        except AttributeError:
-            available = {'md5', 'sha1', 'sha224', 'sha256', 'sha384', 'sha512'}
+        def on_file(file_stats):
+            with lock:
+                print(json.dumps(file_stats.as_dict(), sort_keys=True), file=sys.stderr)
 
-    aliases = {
-        'sha1': {'DSA', 'DSA-SHA', 'dsaEncryption', 'dsaWithSHA', 'ecdsa-with-SHA1'}
-    }
+    return Stats(on_file=on_file)
 
-    for name in aliases:
-        if name in available:
-            available -= aliases[name]
 
-    to_remove = set()
-    for algo in available:
-        lowered = algo.lower()
-        if algo != lowered and lowered in available:
-            to_remove.add(algo)
+def _print_stats(args, stats):
+    if stats is None:
+        return
 
-    available -= to_remove
-    return available
+    import json
 
-AVAILABLE_HASH_ALGORITHMS = _get_available_hash_algorithms()
-AVAILABLE_CHECKSUM_ALGORITHMS = {'crc32', 'adler32'}
-AVAILABLE_ALGORITHMS = sorted(AVAILABLE_HASH_ALGORITHMS | AVAILABLE_CHECKSUM_ALGORITHMS)
+    if args.stats == 'json':
+        print(json.dumps({'summary': stats.summary()}, sort_keys=True), file=sys.stderr)
+    else:
+        for line in stats.format_summary():
+            print(line, file=sys.stderr)
 
 
-def checksum_file(file_path, algo, max_input_read=4*1024**2):
+def _iter_input_files(args):
     """
-    Calculate checksum
-    :param file_path: path or '-' for STDIN
-    :param algo:
-    :param max_input_read:
+    Yield (index of argument, path) for every file from args.files, directories are walked when --recursive
+    option is given. With --shard only paths belonging to given shard are yielded.
+    :param args:
     :return:
     """
-    if algo not in AVAILABLE_CHECKSUM_ALGORITHMS:
-        raise ValueError("Unknown algorithm: %s" % algo)
+    def _walk_error(exc):
+        print('ERROR: %s %s' % (exc.filename, str(exc)), file=sys.stderr)
 
-    value = 0
-    hasher = getattr(zlib, algo)
+    for i, filename in enumerate(args.files):
+        if args.recursive and filename != '-' and os.path.isdir(filename):
+            for path in walk_files(filename, follow_symlinks=args.follow_symlinks, exclude=args.exclude,
+                    sort=args.sort, onerror=_walk_error):
+                if in_shard(path, args.shard):
+                    yield i, path
+        elif in_shard(filename, args.shard):
+            yield i, filename
 
-    fh = open(file_path, 'rb') if file_path != '-' else sys.stdin
-    while True:
-        data = fh.read(max_input_read)
-        if not len(data):
-            break
 
-        value = hasher(data, value)
+OPENED_FILES = {'succes': 0, 'fail': 0}
 
-    if file_path != '-':
-        fh.close()
 
-    value = value & 0xffffffff
-    return hex(value)[2:]
+def mode_generate_algo_symlinks(args):
+    """
+    Print commmands to create symlinks for hashfile for every known algorithm
+    :return:
+    """
+    current = os.path.realpath(sys.argv[0])
+    bindir = os.path.dirname(current)
+    for algo in AVAILABLE_ALGORITHMS:
+        print('ln -s %s %s' % (current, os.path.join(bindir, algo)))
+
+    return E_OK
 
 
-def hash_file(file_path, algo, max_input_read=4*1024**2):
+def digest_file_ends(file_path, algo, size=PARTIAL_READ):
     """
-    Calculate hash
-    :param file_path: path or '-' for STDIN
+    Calculate hash of first and last `size` bytes of file (whole file if it is not bigger than 2 * size)
+    :param file_path:
     :param algo:
-    :param max_input_read:
+    :param size:
     :return:
     """
-    hasher = hashlib.new(algo)
+    digester = new_digester(algo)
+    with open(file_path, 'rb') as fh:
+        digester.update(fh.read(size))
+        fh.seek(max(fh.tell(), os.fstat(fh.fileno()).st_size - size))
+        digester.update(fh.read(size))
 
-    if file_path == '-': # sys.stdin
-        fh = sys.stdin
-        if PY3:
-            fh = fh.buffer
+    return digester.hexdigest()
 
-        while True:
-            data = fh.read(max_input_read)
-            if not len(data):
-                break
 
-            hasher.update(data)
+def mode_find_duplicates(args):
+    """
+    Find files with the same content and print them in groups. Files are grouped by size first, then by hash
+    of their beginning and end, and only files still colliding are hashed fully. Hardlinks are read only once.
+    :param args:
+    :return:
+    """
+    algo = args.algorithm[0]
+    options = _hash_options(dict(_cli_hash_options(args), jobs=args.jobs))
 
-    else:
-        fh = open(file_path, 'rb')
+    # size -> (st_dev, st_ino) -> paths, in order of discovery
+    by_size = collections.OrderedDict()
+    for _, filename in _iter_input_files(args):
+        try:
+            stat = os.stat(filename)
+        except OSError as exc:
+            print('ERROR: %s %s' % (filename, str(exc)), file=sys.stderr)
+            continue
 
-        while True:
-            data = fh.read(max_input_read)
-            if not len(data):
-                break
+        if stat.st_size == 0:
+            continue
 
-            hasher.update(data)
+        inodes = by_size.setdefault(stat.st_size, collections.OrderedDict())
+        inodes.setdefault((stat.st_dev, stat.st_ino), []).append(filename)
+
+    def _group(candidates, key_func):
+        # candidates: list of lists of paths (one list per inode), yield lists of candidates with the same key
+        def _key(paths):
+            try:
+                return paths, key_func(paths[0]), None
+            except (OSError, IOError) as exc:
+                return paths, None, exc
+
+        groups = collections.OrderedDict()
+        for paths, key, exc in _imap_ordered(_key, candidates, args.jobs):
+            if exc is not None:
+                print('ERROR: %s %s' % (paths[0], str(exc)), file=sys.stderr)
+                continue
+            groups.setdefault(key, []).append(paths)
+
+        for key, group in groups.items():
+            if len(group) > 1:
+                yield key, group
+
+    cache = _open_cache(args)
+    try:
+        first_group = True
+        for size, inodes in by_size.items():
+            if len(inodes) < 2:
+                continue
+
+            candidates = [list(inodes.values())]
+            # ends of files are only compared, so any hashlib algorithm will do, even if algo can't be used for
+            # partial data (like tree-* ones)
+            if size > 2 * PARTIAL_READ:
+                candidates = [group for _, group in _group(candidates[0],
+                    lambda path: digest_file_ends(path, DEFAULT_ALGORITHM))]
+
+            for group in candidates:
+                full_digest = lambda path: _file_digests(path, [algo], options, cache)[algo]
+                for filehash, duplicates in _group(group, full_digest):
+                    if not first_group:
+                        print()
+                    first_group = False
+
+                    for paths in duplicates:
+                        for path in paths:
+                            print('%s: %s %s' % (algo, filehash, path))
+    finally:
+        if cache is not None:
+            cache.close()
 
-        fh.close()
+    return E_OK
 
-    return hasher.hexdigest()
 
+META_PREFIX = '#meta '
+FileMeta = collections.namedtuple('FileMeta', ['size', 'mtime_ns', 'verified'])
 
-def _get_file_helpers():
-    helpers = {algo: hash_file for algo in AVAILABLE_HASH_ALGORITHMS}
-    helpers.update({algo: checksum_file for algo in AVAILABLE_CHECKSUM_ALGORITHMS})
-    return helpers
 
-FILE_HELPERS = _get_file_helpers()
+def format_meta(size, mtime_ns, verified):
+    """
+    Format line with metadata of file, written to manifest (with --stamp) before entries of the file. It's a
+    comment, so older versions of hashfile ignore it.
+    :param size:
+    :param mtime_ns: modification time of file (in nanoseconds) before it was hashed
+    :param verified: unix time when file was hashed
+    :return:
+    """
+    return '%ssize=%d mtime_ns=%d verified=%d' % (META_PREFIX, size, mtime_ns, verified)
 
 
-OPENED_FILES = {'succes': 0, 'fail': 0}
-def fileinput_openhook_safe(name, mode):
+def parse_meta(line):
+    """
+    Parse line written by format_meta
+    :param line:
+    :return: FileMeta, or None if line is not correct
+    """
+    if not line.startswith(META_PREFIX):
+        return None
+
     try:
-        fh = open(name, mode)
-    except Exception as exc:
-        OPENED_FILES['fail'] += 1
-        print('%s: cannot open (%s)' % (name, exc.args[1]))
-        return StringIO()
-    else:
-        OPENED_FILES['succes'] += 1
-        return fh
+        values = dict(field.split('=', 1) for field in line[len(META_PREFIX):].split())
+        return FileMeta(int(values['size']), int(values['mtime_ns']), int(values['verified']))
+    except (KeyError, ValueError):
+        return None
 
 
-def mode_generate_algo_symlinks(args):
+SHARD_PREFIX = '#shard '
+ShardInfo = collections.namedtuple('ShardInfo', ['index', 'count', 'entries'])
+
+
+def parse_shard(value):
     """
-    Print commmands to create symlinks for hashfile for every known algorithm
+    Parse shard given as INDEX/COUNT, INDEX from 1 to COUNT
+    :param value:
+    :return: (index, count)
+    :raise ValueError: when value is not correct
+    """
+    index, _, count = value.partition('/')
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError('shard must be given as INDEX/COUNT, INDEX from 1 to COUNT')
+    return index, count
+
+
+def in_shard(path, shard):
+    """
+    Check if path belongs to shard. Paths are assigned to shards by their crc32, so assignment is the same
+    for every run and on every host, as long as paths are given the same way (both relative or both absolute).
+    :param path:
+    :param shard: (index, count) as returned by parse_shard, or None for all paths
     :return:
     """
-    current = os.path.realpath(sys.argv[0])
-    bindir = os.path.dirname(current)
-    for algo in AVAILABLE_ALGORITHMS:
-        print('ln -s %s %s' % (current, os.path.join(bindir, algo)))
+    if shard is None:
+        return True
 
-    return E_OK
+    index, count = shard
+    data = path.encode('utf-8', 'surrogateescape') if PY3 else path.encode('utf-8')
+    return (zlib.crc32(data) & 0xffffffff) % count == index - 1
+
+
+def format_shard(shard, entries=None):
+    """
+    Format line written to manifest calculated with --shard: at the beginning (without entries), and at the end
+    (with number of entries), so --merge can detect missing or incomplete shards. It's a comment, so it's
+    ignored by --check.
+    :param shard: (index, count)
+    :param entries: number of entries in manifest, or None
+    :return:
+    """
+    line = '%s%d/%d' % (SHARD_PREFIX, shard[0], shard[1])
+    if entries is not None:
+        line += ' entries=%d' % entries
+    return line
+
+
+def parse_shard_line(line):
+    """
+    Parse line written by format_shard
+    :param line:
+    :return: ShardInfo (entries is None for line from the beginning of manifest), or None if line is not correct
+    """
+    if not line.startswith(SHARD_PREFIX):
+        return None
+
+    fields = line[len(SHARD_PREFIX):].split()
+    try:
+        index, count = parse_shard(fields[0])
+        entries = None
+        if len(fields) > 1:
+            name, _, entries = fields[1].partition('=')
+            if name != 'entries' or len(fields) > 2:
+                return None
+            entries = int(entries)
+    except (IndexError, ValueError):
+        return None
+
+    return ShardInfo(index, count, entries)
+
+
+def _print_hash_result(result, last_error=None):
+    """
+    Print HashResult to stdout, or error to stderr
+    :param result:
+    :param last_error: error of previous result, the same error is reported for every algorithm calculated for
+        the file but printed only once
+    :return:
+    """
+    if result.error is None:
+        print('%s: %s %s' % (result.algo, result.digest, result.path))
+    elif result.error is not last_error:
+        print('ERROR: %s %s' % (result.path, str(result.error)), file=sys.stderr)
 
 
 def mode_calculate(args):
@@ -170,18 +1910,523 @@ def mode_calculate(args):
     :param args:
     :return:
     """
-    for i, filename in enumerate(args.files):
-        algo = args.algorithm[i] if len(args.algorithm) > i else args.algorithm[-1]
+    def _paths():
+        for i, filename in _iter_input_files(args):
+            if args.all_of:
+                yield filename, args.all_of
+            else:
+                yield filename, [args.algorithm[i] if len(args.algorithm) > i else args.algorithm[-1]]
+
+    cache = _open_cache(args)
+    stats = _open_stats(args)
+    if args.shard:
+        print(format_shard(args.shard))
+    entries = 0
+    try:
+        last_error = None
+        results = hash_many(_paths(), jobs=args.jobs, cache=cache, stats=stats, schedule=args.schedule,
+            schedule_window=args.schedule_window, **_cli_hash_options(args))
+        for result in results:
+            started = _clock() if stats is not None else None
+            # metadata is printed before first entry of every file
+            if args.stamp and result.error is None and result.mtime_ns is not None and (
+                    not args.all_of or result.algo == args.all_of[0]):
+                print(format_meta(result.size, result.mtime_ns, int(time.time())))
+            _print_hash_result(result, last_error)
+            last_error = result.error
+            entries += result.error is None
+            if stats is not None:
+                stats.add_output(_clock() - started)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    # written only when all files were processed, so incomplete shard can be detected by --merge
+    if args.shard:
+        print(format_shard(args.shard, entries))
+    _print_stats(args, stats)
+    return E_OK
+
+
+def _iter_manifest_lines(manifests):
+    """
+    Yield (manifest, line, exc) for every line of every manifest, exc is set (and line is None) when
+    manifest cannot be opened
+    :param manifests: list of paths, '-' for STDIN
+    :return:
+    """
+    for manifest in manifests:
+        if manifest == '-':
+            for line in sys.stdin:
+                yield manifest, line, None
+            continue
 
-        file_helper = FILE_HELPERS[algo]
         try:
-            filehash = file_helper(filename, algo=algo, max_input_read=args.max_input_read)
+            fh = open(manifest, 'r')
         except (OSError, IOError) as exc:
-            print('ERROR: %s %s' % (filename, str(exc)), file=sys.stderr)
-        else:
-            print('%s: %s %s' % (algo, filehash, filename))
+            OPENED_FILES['fail'] += 1
+            yield manifest, None, exc
+            continue
 
-    return E_OK
+        OPENED_FILES['succes'] += 1
+        with fh:
+            for line in fh:
+                yield manifest, line, None
+
+
+HEX_DIGITS = '0123456789abcdefABCDEF'
+GNU_DIGEST_LENGTHS = {32: 'md5', 40: 'sha1', 56: 'sha224', 64: 'sha256', 96: 'sha384', 128: 'sha512'}
+
+
+def _is_hex(value):
+    return bool(value) and not value.strip(HEX_DIGITS)
+
+
+def _unescape_name(name):
+    """
+    Unescape file name from GNU coreutils manifest line starting with backslash: \\\\ and \\n
+    :param name:
+    :return:
+    """
+    result = []
+    chars = iter(name)
+    for char in chars:
+        if char == '\\':
+            following = next(chars, '')
+            char = {'n': '\n', 'r': '\r', '\\': '\\'}.get(following, char + following)
+        result.append(char)
+    return ''.join(result)
+
+
+def _bsd_algorithm(name):
+    """
+    Convert algorithm name used in BSD format (MD5, SHA256, SHA2-256, SHA512-256, SHA3-256, BLAKE2b) to hashfile one
+    :param name:
+    :return:
+    """
+    name = name.lower()
+    if name.startswith('sha2-'):
+        name = 'sha' + name[len('sha2-'):]
+    if name not in FILE_HELPERS:
+        name = name.replace('-', '_')
+    return name
+
+
+def _is_known_algorithm(algo):
+    try:
+        return split_algorithm(algo)[0] in FILE_HELPERS
+    except ValueError:
+        return False
+
+
+def parse_manifest_line(line, algorithm=None):
+    """
+    Parse line of manifest in one of formats:
+        hashfile: ALGO: DIGEST PATH
+        GNU coreutils: DIGEST  PATH or DIGEST *PATH (algorithm given or guessed from length of digest)
+        BSD: ALGO (PATH) = DIGEST, also without spaces as printed by openssl: ALGO(PATH)= DIGEST
+    Lines of GNU and BSD formats starting with backslash have escaped file names.
+    :param line: line without trailing newline
+    :param algorithm: algorithm of GNU coreutils format lines
+    :return: (algo, expected digest, path)
+    :raise ValueError: line in unknown format
+    """
+    escaped = line.startswith('\\')
+    if not escaped:
+        first, _, rest = line.partition(' ')
+        if first.endswith(':') and len(first) > 1 and '(' not in first:
+            expected, _, path = rest.partition(' ')
+            if expected and path:
+                return first[:-1], expected, path
+    else:
+        line = line[1:]
+
+    head, sep, expected = line.rpartition(') = ')
+    if not sep:
+        head, sep, expected = line.rpartition(')= ')
+    if sep and _is_hex(expected):
+        algo, sep, path = head.partition('(')
+        algo = algo.rstrip(' ')
+        if sep and algo and ' ' not in algo:
+            return _bsd_algorithm(algo), expected.lower(), _unescape_name(path) if escaped else path
+
+    expected, _, rest = line.partition(' ')
+    if _is_hex(expected) and rest[:1] in (' ', '*') and len(rest) > 1:
+        algo = algorithm or GNU_DIGEST_LENGTHS.get(len(expected))
+        if algo:
+            path = rest[1:]
+            return algo, expected.lower(), _unescape_name(path) if escaped else path
+
+    raise ValueError('Incorrect format: %s' % line)
+
+
+CHECK_OK = 'ok'
+CHECK_CACHED = 'cached'
+CHECK_FAILED = 'failed'
+CHECK_ERROR = 'error'
+CHECK_MANIFEST_ERROR = 'manifest-error'
+CHECK_FORMAT_ERROR = 'format-error'
+
+CheckResult = collections.namedtuple('CheckResult',
+    ['manifest', 'path', 'algo', 'expected', 'digest', 'status', 'detail', 'error', 'position'])
+CheckResult.__new__.__defaults__ = (None, )
+
+
+def verify_manifest(manifests, jobs=DEFAULT_JOBS, cache=None, verify_range=None, details=True, stats=None,
+        algorithm=None, changed_only=False, reverify_age=None, start=0, shard=None, **options):
+    """
+    Verify digests listed in manifests, in parallel, yield results in order of manifests. Stop iterating to cancel
+    verification of remaining entries. Manifests are read lazily, in hashfile, GNU coreutils or BSD format (see
+    parse_manifest_line). Consecutive entries for the same file are verified together, reading file only once.
+    :param manifests: path of manifest ('-' for STDIN) or list of them
+    :param jobs: number of threads
+    :param cache: DigestCache or None
+    :param verify_range: (first byte, last byte): for tree-* algorithms verify only part of files, using digests
+        of leaves saved with tree_sidecar option
+    :param details: for failed tree-* digests find damaged byte ranges (in detail), when leaves were saved
+    :param stats: Stats collecting time spent on opening, reading and hashing files, or None
+    :param algorithm: algorithm of entries in GNU coreutils format, guessed from length of digest if not given
+    :param changed_only: files with metadata saved in manifest (see format_meta) are verified only if their size
+        or modification time changed, others are reported as CHECK_CACHED
+    :param reverify_age: with changed_only: files verified more than reverify_age seconds ago are verified anyway
+    :param start: number of lines of manifests to skip (position of last reported result), to resume verification
+    :param shard: (index, count): verify only files belonging to shard (see in_shard), members of archives are
+        assigned to shard of archive
+    :param options: max_input_read, use_mmap, readahead, split_threshold, page_cache (see HASH_OPTIONS)
+    :return: iterator of CheckResult (manifest, path, algo, expected, digest, status, detail, error, position),
+        where position is number of lines of manifests read up to entry (unreadable manifest counts as one line).
+        Status is one of: CHECK_OK, CHECK_CACHED (not verified, metadata of file not changed), CHECK_FAILED, CHECK_ERROR
+        (file cannot be read, see error), CHECK_MANIFEST_ERROR (manifest cannot be read, see error) or
+        CHECK_FORMAT_ERROR (incorrect line in manifest)
+    """
+    if not isinstance(manifests, (list, tuple)):
+        manifests = [manifests]
+    options = _hash_options(dict(options, jobs=jobs))
+
+    # entries are passed through the pool together with notices about unreadable manifests and broken
+    # lines, so everything is reported in manifest order
+    # metadata line applies to following entries of the same file
+    def _entries():
+        meta, meta_key = None, None
+        for position, (manifest, line, exc) in enumerate(_iter_manifest_lines(manifests), 1):
+            if exc is not None:
+                if position > start:
+                    yield CheckResult(manifest, None, None, None, None, CHECK_MANIFEST_ERROR, None, exc,
+                        position), None
+                continue
+
+            line = line.rstrip('\n').rstrip('\r')
+            if line.startswith(META_PREFIX):
+                meta, meta_key = parse_meta(line), (manifest, None)
+                continue
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            try:
+                algo, expected_filehash, filename = parse_manifest_line(line, algorithm)
+            except ValueError:
+                if position > start:
+                    yield CheckResult(manifest, None, None, None, None, CHECK_FORMAT_ERROR, line, None,
+                        position), None
+                continue
+
+            entry = CheckResult(manifest, filename, algo, expected_filehash, None, None, None, None, position)
+            if not _is_known_algorithm(algo):
+                entry = entry._replace(status=CHECK_ERROR, error=ValueError('Unknown algorithm: %s' % algo))
+
+            if meta is not None and meta_key in ((manifest, None), (manifest, filename)):
+                meta_key = (manifest, filename)
+            else:
+                meta = None
+            # skipped entries are parsed anyway, to track metadata lines
+            if position > start:
+                yield entry, meta
+
+    # archive of entry, if it's archive member (see hashfile.archive)
+    def _archive(entry):
+        if entry.status is not None or '!' not in entry.path:
+            return None
+        from hashfile import archive
+        member = archive.split_member_path(entry.path)
+        return member[0] if member is not None else None
+
+    def _selected():
+        for entry, meta in _entries():
+            archive_path = _archive(entry)
+            if entry.status is not None or in_shard(archive_path or entry.path, shard):
+                yield entry, meta, archive_path
+
+    selected = _selected()
+    # entry read, but not verified by the reader: first member of archive, or first file after archive
+    lookahead = []
+
+    def _next():
+        return lookahead.pop() if lookahead else next(selected, None)
+
+    # consecutive entries for the same file are verified together, reading file only once, up to first entry
+    # for archive member
+    def _groups():
+        group, group_meta = [], None
+        while True:
+            item = _next()
+            if item is None or item[2] is not None:
+                if item is not None:
+                    lookahead.append(item)
+                break
+
+            entry, meta, _ = item
+            if group and (entry.status is not None or group[0].status is not None or
+                    entry.manifest != group[0].manifest or meta is not group_meta or
+                    len(group) >= 64 or entry.path != group[0].path):
+                yield group, group_meta
+                group = []
+            if not group:
+                group_meta = meta
+            group.append(entry)
+
+        if group:
+            yield group, group_meta
+
+    # consecutive entries for members of the same archive, verified in single pass over archive
+    def _members(archive_path):
+        while True:
+            item = _next()
+            if item is None or item[2] != archive_path:
+                if item is not None:
+                    lookahead.append(item)
+                return
+            yield item[0]
+
+    def _unchanged(filename, meta):
+        stat = os.stat(filename)
+        if stat.st_size != meta.size or _mtime_ns(stat) != meta.mtime_ns:
+            return False
+        return reverify_age is None or time.time() - meta.verified < reverify_age
+
+    def _diff_ranges(filename, algo, byte_range=None):
+        ranges = tree_diff_ranges(filename, algo, max_input_read=options['max_input_read'], jobs=jobs,
+            byte_range=byte_range)
+        detail = None
+        if ranges:
+            detail = 'bytes %s differ' % ', '.join('%d-%d' % file_range for file_range in ranges)
+        return ranges, detail
+
+    def _digests(filename, algos):
+        file_stats = FileStats(filename) if stats is not None else None
+        try:
+            return _file_digests(filename, algos, options, cache, file_stats)
+        except (OSError, IOError) as exc:
+            if stats is not None:
+                file_stats.error = exc
+            raise
+        finally:
+            if stats is not None:
+                stats.add(file_stats, algos)
+
+    def _verify_range(entry):
+        filename, algo, expected_filehash = entry.path, entry.algo, entry.expected
+        # only part of file is compared with leaves saved in sidecar, and sidecar with manifest
+        _, leaves = read_tree_sidecar(filename, algo)
+        if leaves is None or tree_root(leaves, algo) != expected_filehash:
+            return entry._replace(status=CHECK_FAILED, detail='no matching leaves file')
+
+        ranges, detail = _diff_ranges(filename, algo, verify_range)
+        return entry._replace(status=CHECK_FAILED if ranges else CHECK_OK, detail=detail)
+
+    def _verify(task):
+        group, meta = task
+        if group[0].status is not None:
+            return group
+
+        filename = group[0].path
+        results = []
+        try:
+            if changed_only and meta is not None and _unchanged(filename, meta):
+                return [entry._replace(digest=entry.expected, status=CHECK_CACHED) for entry in group]
+
+            algos = []
+            for entry in group:
+                if entry.algo not in algos and not (verify_range and entry.algo.startswith(TREE_PREFIX)):
+                    algos.append(entry.algo)
+
+            # algorithms calculated by digest_file read file once for all of them, others one by one
+            together = [algo for algo in algos if algo in AVAILABLE_ALGORITHMS]
+            digests = _digests(filename, together) if together else {}
+            for algo in algos:
+                if algo not in digests:
+                    digests.update(_digests(filename, [algo]))
+
+            for entry in group:
+                if entry.algo not in digests:
+                    results.append(_verify_range(entry))
+                elif digests[entry.algo] == entry.expected:
+                    results.append(entry._replace(digest=digests[entry.algo], status=CHECK_OK))
+                else:
+                    detail = None
+                    if details and entry.algo.startswith(TREE_PREFIX):
+                        _, detail = _diff_ranges(filename, entry.algo)
+                    results.append(entry._replace(digest=digests[entry.algo], status=CHECK_FAILED, detail=detail))
+        except (OSError, IOError) as exc:
+            return results + [entry._replace(status=CHECK_ERROR, error=exc) for entry in group[len(results):]]
+
+        return results
+
+    # files are verified in parallel, archives (read sequentially) one by one, as their members are reached
+    while True:
+        for results in _imap_ordered(_verify, _groups(), jobs):
+            for result in results:
+                yield result
+        if not lookahead:
+            break
+
+        from hashfile import archive
+        archive_path = lookahead[0][2]
+        for result in archive.verify_members(archive_path, _members(archive_path), options):
+            yield result
+
+
+CHECKPOINT_INTERVAL = 10
+DEFAULT_WATCH_INTERVAL = 10.0
+
+
+class Checkpoint(object):
+    """
+    Progress of verification saved in file (atomically, every `interval` seconds), so interrupted verification
+    can be resumed. Saved position is the number of lines of manifests with all results reported: results are
+    reported in manifest order, so entries verified out of order by other threads are just verified again after
+    resume. Reported failures are saved too, to be reported again by resumed verification.
+    """
+    def __init__(self, path, manifests, interval=CHECKPOINT_INTERVAL):
+        """
+        :param path: path of checkpoint file
+        :param manifests: list of paths of verified manifests
+        :param interval: minimal number of seconds between saves
+        """
+        self.path = path
+        self.manifests = [self._identify(manifest) for manifest in manifests]
+        self.interval = interval
+        self.complete = False
+        self._saved = _clock()
+        self._failures = []
+        # position, exit code and number of failures, replaced at once (see advance)
+        self._progress = (0, E_OK, 0)
+
+    @property
+    def position(self):
+        return self._progress[0]
+
+    @property
+    def exit_code(self):
+        return self._progress[1]
+
+    @property
+    def failures(self):
+        """
+        :return: list of [stderr, line] of reported failures
+        """
+        return self._failures[:self._progress[2]]
+
+    @staticmethod
+    def _identify(manifest):
+        try:
+            stat = os.stat(manifest)
+        except OSError:
+            return [manifest, None, None]
+        return [manifest, stat.st_size, _mtime_ns(stat)]
+
+    def load(self):
+        """
+        Load progress saved by previous verification
+        :return: False if there is no saved progress
+        :raise ValueError: when checkpoint is broken, or was saved for other (or modified) manifests
+        """
+        import json
+
+        try:
+            fh = open(self.path, 'r')
+        except (OSError, IOError) as exc:
+            if exc.errno == errno.ENOENT:
+                return False
+            raise
+
+        with fh:
+            data = json.load(fh)
+        if data.get('manifests') != self.manifests:
+            raise ValueError('checkpoint was saved for other manifests, or they were modified')
+
+        self._failures = data['failures']
+        self._progress = (data['position'], data['exit_code'], len(self._failures))
+        self.complete = data['complete']
+        return True
+
+    def advance(self, position, exit_code, failures=()):
+        """
+        Move position after reported result, save checkpoint if `interval` seconds passed since last save
+        :param position: CheckResult.position of reported result
+        :param exit_code: exit code so far
+        :param failures: list of (stderr, line) of failures reported for result: True if line was printed on STDERR
+        :return:
+        """
+        self._failures.extend([stderr, line] for stderr, line in failures)
+        # failures are counted in the same assignment which moves position, so checkpoint saved at any moment (also
+        # by signal handler) never has failure of result without its position: it would be reported twice
+        self._progress = (position, exit_code, len(self._failures))
+        if _clock() - self._saved >= self.interval:
+            self.save()
+
+    def save(self):
+        import json
+
+        position, exit_code, failures = self._progress
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            json.dump({
+                'manifests': self.manifests,
+                'position': position,
+                'exit_code': exit_code,
+                'failures': self._failures[:failures],
+                'complete': self.complete,
+            }, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp_path, self.path)
+        self._saved = _clock()
+
+
+def _open_checkpoint(args):
+    """
+    Open checkpoint given by --checkpoint, load saved progress with --resume
+    :param args:
+    :return: Checkpoint or None
+    """
+    if not args.checkpoint:
+        return None
+
+    checkpoint = Checkpoint(args.checkpoint, args.files)
+    try:
+        if args.resume:
+            checkpoint.load()
+        # fail early if checkpoint cannot be saved
+        checkpoint.save()
+    except (OSError, IOError, ValueError, KeyError) as exc:
+        print('ERROR: %s %s' % (args.checkpoint, exc), file=sys.stderr)
+        sys.exit(E_FAIL)
+
+    return checkpoint
+
+
+def _exit_now(exit_code):
+    """
+    Exit without waiting for threads still reading files (maybe big ones, or never ending, like FIFOs)
+    :param exit_code:
+    :return:
+    """
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (IOError, OSError, RuntimeError):
+            pass
+    os._exit(exit_code)
 
 
 def mode_check(args):
@@ -194,23 +2439,40 @@ def mode_check(args):
         print('ERROR: no files to check specified', file=sys.stderr)
         sys.exit(1)
 
-    def _quiet(inp1, inp2):
-        if inp1 != inp2:
-            print('%s: %s' % (filename, VERIFICATION_FAIL))
+    checkpoint = _open_checkpoint(args)
+    # failures reported for current result, saved in checkpoint together with its position
+    reported = []
+
+    def _report(line, stderr=False):
+        print(line, file=sys.stderr if stderr else sys.stdout)
+        if checkpoint is not None:
+            reported.append((stderr, line))
+
+    def _failed(filename, detail):
+        if detail:
+            _report('%s: %s (%s)' % (filename, VERIFICATION_FAIL, detail))
+        else:
+            _report('%s: %s' % (filename, VERIFICATION_FAIL))
+
+    def _quiet(filename, verified, detail=None):
+        if not verified:
+            _failed(filename, detail)
             return
         return True
 
-    def _verbose(inp1, inp2):
-        if inp1 == inp2:
+    def _verbose(filename, verified, detail=None):
+        if verified and detail:
+            print('%s: %s (%s)' % (filename, VERIFICATION_OK, detail))
+        elif verified:
             print('%s: %s' % (filename, VERIFICATION_OK))
         else:
-            print('%s: %s' % (filename, VERIFICATION_FAIL))
+            _failed(filename, detail)
 
         return True
 
-    def _status(inp1, inp2):
-        if inp1 != inp2:
-            sys.exit(E_FAIL)
+    def _status(filename, verified, detail=None):
+        if not verified:
+            return
 
         return True
 
@@ -222,30 +2484,73 @@ def mode_check(args):
         verifier = _verbose
 
     exit_code = E_OK
-
-    for line in fileinput.input(args.files, openhook=fileinput_openhook_safe):
-        line = line.strip()
-        if not line or line.startswith('#'):
-            continue
-
-        try:
-            algo, expected_filehash = line.split(': ', 1)
-            expected_filehash, filename = expected_filehash.split(' ')
-        except ValueError:
-            if args.warn:
-                print('ERROR: %s Incorrect format' % (fileinput.filename()), file=sys.stderr)
-            continue
-
-        file_helper = FILE_HELPERS[algo]
-        try:
-            filehash = file_helper(filename, algo=algo, max_input_read=args.max_input_read)
-        except (OSError, IOError) as exc:
-            print('ERROR: %s %s' % (filename, str(exc)), file=sys.stderr)
-        else:
-            if not verifier(filehash, expected_filehash):
+    start = 0
+    if checkpoint is not None:
+        # failures reported before interruption are reported again, so final report is complete
+        for stderr, line in checkpoint.failures:
+            print(line, file=sys.stderr if stderr else sys.stdout)
+        if checkpoint.complete:
+            return checkpoint.exit_code
+        exit_code, start = checkpoint.exit_code, checkpoint.position
+
+        def _terminate(signum, frame):  # pylint: disable=unused-argument
+            # verification stopped by SIGTERM can be resumed from the last reported result: progress is saved
+            # right away, and files still being read are not waited for
+            checkpoint.save()
+            _exit_now(E_FAIL)
+
+        import signal
+        signal.signal(signal.SIGTERM, _terminate)
+
+    cache = _open_cache(args)
+    stats = _open_stats(args)
+    results = verify_manifest(args.files, jobs=args.jobs, cache=cache, verify_range=args.verify_range,
+        details=not args.status, stats=stats, algorithm=args.check_algorithm, changed_only=args.changed_only,
+        reverify_age=args.reverify_age, start=start, shard=args.shard, **_cli_hash_options(args))
+    stopped = False
+    try:
+        for result in results:
+            started = _clock() if stats is not None else None
+            if result.status == CHECK_MANIFEST_ERROR:
+                _report('%s: cannot open (%s)' % (result.manifest, result.error.args[1]))
+            elif result.status == CHECK_FORMAT_ERROR:
+                if args.warn:
+                    _report('ERROR: %s Incorrect format' % result.manifest, stderr=True)
+            elif result.status == CHECK_ERROR:
+                _report('ERROR: %s %s' % (result.path, str(result.error)), stderr=True)
+            elif result.status == CHECK_CACHED:
+                verifier(result.path, True, 'cached')
+            elif not verifier(result.path, result.status == CHECK_OK, result.detail):
                 exit_code = E_FAIL
+                if args.status:
+                    # no need to check anything more, cancel everything still waiting in the pool
+                    stopped = True
+                    break
+            if stats is not None:
+                stats.add_output(_clock() - started)
+            if checkpoint is not None:
+                checkpoint.advance(result.position, exit_code, reported)
+                del reported[:]
+
+        if checkpoint is not None:
+            checkpoint.complete = True
+    finally:
+        results.close()
+        if cache is not None:
+            cache.close()
+        if checkpoint is not None and not checkpoint.complete:
+            checkpoint.save()
+
+    _print_stats(args, stats)
+
     if exit_code == E_OK and OPENED_FILES['fail'] > 0:
         exit_code = E_FAIL_NO_FILES
+    if checkpoint is not None:
+        checkpoint.advance(checkpoint.position, exit_code)
+        checkpoint.save()
+    if stopped:
+        # files already being read by other threads are not waited for
+        _exit_now(exit_code)
     return exit_code
 
 
@@ -258,32 +2563,151 @@ def mode_default(args):
     return E_OK
 
 
+def _parse_age(value):
+    """
+    Parse age given as number of seconds, optionally with suffix (m, h or d)
+    :param value:
+    :return: number of seconds, or None if value is not correct
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    value = value.strip().lower()
+    unit = units.get(value[-1:])
+    try:
+        age = float(value[:-1] if unit else value) * (unit or 1)
+    except ValueError:
+        return None
+    return age if age >= 0 else None
+
+
 def parse_args(argv):
     """
     Parse input params
     :param argv:
     :return:
     """
+    import argparse
+
     parser = argparse.ArgumentParser(description='Calculate hash of some files',
         epilog='Algorithm can be also set from program name (for example call program as sha1 to use sha1 algorithm)')
-    parser.add_argument('--algorithm', '-a', default=[], action='append', choices=AVAILABLE_ALGORITHMS,
+    parser.add_argument('--algorithm', '-a', default=[], action='append',
+        choices=AVAILABLE_ALGORITHMS + sorted(AVAILABLE_TREE_ALGORITHMS) + sorted(AVAILABLE_QUICK_ALGORITHMS),
         help='algorithm used to calculate hash '
              'If given more then one, then use different algorithms for different files (use first algo to first '
              'file, second algo to second file etc. If there is more files then algorithms, last algorithm from '
              'list is used.')
+    parser.add_argument('--all-of', metavar='ALGO[,ALGO...]',
+        help='calculate all of given (comma separated) algorithms for every file, reading each file only once')
+    parser.add_argument('--find-duplicates', action='store_const', dest='mode', const='find-duplicates',
+        help='find files with the same content (directories are searched recursively), and print them in groups')
+    parser.add_argument('--recursive', '-r', action='store_true',
+        help='calculate hashes of all files in given directories and their subdirectories')
+    parser.add_argument('--follow-symlinks', '-L', action='store_true',
+        help='with --recursive: follow symbolic links (they are skipped by default)')
+    parser.add_argument('--exclude', default=[], action='append', metavar='GLOB',
+        help='with --recursive: skip files and directories matching GLOB (by name or path), can be given many times')
+    parser.add_argument('--sort', action='store_true',
+        help='with --recursive: process files in deterministic order (sorted by name)')
+    parser.add_argument('--serve', metavar='SOCKET',
+        help='run as server: calculate digests for requests sent to Unix SOCKET (by --client), until SIGTERM')
+    parser.add_argument('--archive', action='store_const', dest='mode', const='archive',
+        help='calculate digests of members of tar (also compressed) and zip archives, without extracting them, '
+             'as: ALGO: DIGEST ARCHIVE!MEMBER (such entries are verified by --check directly against archive)')
+    parser.add_argument('--shard', metavar='INDEX/COUNT',
+        help='calculate (or with --check: verify) digests only of files belonging to shard INDEX of COUNT (from '
+             '1/COUNT to COUNT/COUNT), so many hosts can process disjoint parts of the same files')
+    parser.add_argument('--merge', action='store_const', dest='mode', const='merge',
+        help='merge manifests calculated with --shard (FILEs) into one sorted manifest, report missing, '
+             'incomplete or duplicated shards and duplicated entries')
+    parser.add_argument('--watch', metavar='DIR',
+        help='keep manifest (given by --manifest) of all files in DIR up to date: hash all files, then only files '
+             'written or moved into DIR (Linux only), until SIGTERM')
+    parser.add_argument('--manifest', metavar='FILE',
+        help='with --watch: path of manifest, rewritten atomically')
+    parser.add_argument('--watch-interval', metavar='SECONDS', type=float, default=DEFAULT_WATCH_INTERVAL,
+        help='with --watch: write manifest at most every SECONDS (default: %(default)s)')
+    parser.add_argument('--batch', action='store_const', dest='mode', const='batch',
+        help='calculate digests of NUL terminated paths read from stdin (like from find -print0), print results '
+             'as soon as they are ready')
+    parser.add_argument('--client', metavar='SOCKET',
+        help='ask server listening on SOCKET (see --serve) for digests of FILEs')
     parser.add_argument('--generate-algo-symlinks', action='store_const', dest='mode', const='generate-algo-symlinks',
         help='Show aliases for every algorithm handled by hashfile')
     # http://linux.die.net/man/1/md5sum
     parser.add_argument('--check', '-c', action='store_const', dest='mode', const='check',
         help='read checksums from the FILEs and check them ')
+    parser.add_argument('--stamp', action='store_true',
+        help='save size and modification time of files in manifest (in #meta comments, ignored by older versions), '
+             'so --check --changed-only can skip unchanged files')
+    parser.add_argument('--checkpoint', metavar='FILE',
+        help='with --check: save progress of verification in FILE every %d seconds' % CHECKPOINT_INTERVAL)
+    parser.add_argument('--resume', action='store_true',
+        help='with --checkpoint: resume verification from progress saved in checkpoint (if any), report failures '
+             'found before, and exit with the same code as uninterrupted verification')
+    parser.add_argument('--changed-only', action='store_true',
+        help='with --check: verify only files with size or modification time other than saved with --stamp, '
+             'report other ones as "OK (cached)"')
+    parser.add_argument('--reverify-age', metavar='AGE',
+        help='with --changed-only: verify anyway files verified more than AGE ago (seconds, or with suffix: m, h, '
+             'd, for example 30d)')
     parser.add_argument('--quiet', '-q', action='store_true',
         help='don\'t print OK for each successfully verified file')
     parser.add_argument('--status', '-s', action='store_true',
         help='don\'t output anything, status code shows success')
     parser.add_argument('--warn', '-w', action='store_true',
         help='warn about improperly formatted checksum lines')
-    parser.add_argument('--max-input-read', default=MAX_INPUT_READ,
+    parser.add_argument('--max-input-read', default=MAX_INPUT_READ, type=int,
         help='maximum data size for read at once')
+    parser.add_argument('--mmap', action='store_true',
+        help='read regular files through memory map')
+    parser.add_argument('--no-cache-pollution', action='store_const', dest='page_cache', const=PAGE_CACHE_DROP,
+        default=PAGE_CACHE_KEEP,
+        help='do not fill page cache with hashed files: drop data from cache as soon as it is hashed (Linux and '
+             'other systems with posix_fadvise)')
+    parser.add_argument('--direct', action='store_const', dest='page_cache', const=PAGE_CACHE_DIRECT,
+        help='read files with O_DIRECT, bypassing page cache (falls back to --no-cache-pollution when not '
+             'supported by filesystem, or on Python 2)')
+    parser.add_argument('--split-threshold', default=SPLIT_THRESHOLD, type=int,
+        help='crc32 and adler32 of files at least that big are calculated in --jobs parallel parts '
+             '(0 disables, default: %(default)s)')
+    parser.add_argument('--leaf-size', default=DEFAULT_LEAF_SIZE, type=int,
+        help='size of leaves for tree-* algorithms (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+        help='calculate quick fingerprints (quick-ALGO): hash of size and sampled blocks of files instead of '
+             'whole content, for cheap detection of changes (verify suspicious files with full hash)')
+    parser.add_argument('--quick-samples', default=DEFAULT_QUICK_SAMPLES, type=int, metavar='BLOCKS',
+        help='number of %dKiB blocks sampled by quick-* algorithms, besides first and last one '
+             '(default: %%(default)s)' % (QUICK_BLOCK_SIZE // 1024))
+    parser.add_argument('--tree-sidecar', action='store_true',
+        help='for tree-* algorithms save digests of leaves in FILE.ALGO.leaves, to find damaged parts of '
+             'file with --check later')
+    parser.add_argument('--verify-range', metavar='FIRST-LAST',
+        help='with --check: for tree-* algorithms verify only given range of bytes, using digests of leaves '
+             'saved with --tree-sidecar')
+    parser.add_argument('--cache', action='store_true',
+        help='use on-disk cache of digests, keyed by inode and modification time of files (can be also enabled '
+             'by HASHFILE_CACHE environment variable)')
+    parser.add_argument('--no-cache', action='store_true',
+        help='do not use cache of digests, even if enabled by HASHFILE_CACHE environment variable')
+    parser.add_argument('--refresh-cache', action='store_true',
+        help='ignore cached digests, calculate everything again and store results in cache')
+    parser.add_argument('--cache-file', default=DEFAULT_CACHE_PATH,
+        help='path to cache of digests (default: %(default)s)')
+    parser.add_argument('--cache-size', default=DEFAULT_CACHE_SIZE, type=int,
+        help='maximum number of entries in cache of digests, least recently used are removed (default: %(default)s)')
+    parser.add_argument('--readahead', default=0, type=int, metavar='BUFFERS',
+        help='read data in separate thread, up to BUFFERS chunks of --max-input-read size ahead of hashing '
+             '(useful for stdin and slow network files, 0 disables)')
+    parser.add_argument('--schedule', choices=SCHEDULES,
+        help='read files in order of their location on disk, to avoid seeking on rotational disks: by inode '
+             'number, or by physical offset (extent, falls back to inode when not supported by filesystem). '
+             'Results are printed in original order')
+    parser.add_argument('--schedule-window', default=DEFAULT_SCHEDULE_WINDOW, type=int, metavar='FILES',
+        help='with --schedule: number of files reordered at once (default: %(default)s)')
+    parser.add_argument('--stats', nargs='?', const='summary', choices=['summary', 'json'],
+        help='print to stderr summary of time spent on opening, reading, hashing and printing, amount of data '
+             'and files per second per algorithm; with "json": also stats of every file, as JSON lines')
+    parser.add_argument('--jobs', '-j', default=DEFAULT_JOBS, type=int,
+        help='number of files processed in parallel (default: number of CPUs: %(default)s)')
     parser.add_argument('files', metavar='FILE', type=str, nargs='*',
         help='list of files (stdin by default)')
     parser.add_argument('--version', '-v', action="version", version="%%(prog)s %s" % __version__)
@@ -293,9 +2717,130 @@ def parse_args(argv):
     args = parser.parse_args()
 
 
+    for option, mode in (('serve', 'serve'), ('client', 'client'), ('watch', 'watch')):
+        if getattr(args, option):
+            if args.mode != 'calculate':
+                parser.error('--serve, --client, --watch, --batch and other modes are mutually exclusive')
+            args.mode = mode
+
+    if args.mode in ('serve', 'client'):
+        import socket
+        if not hasattr(socket, 'AF_UNIX'):
+            parser.error('--serve and --client options require Unix sockets')
+    if args.mode in ('serve', 'batch'):
+        if args.files:
+            parser.error('--serve and --batch options do not accept FILEs')
+        if len(args.algorithm) > 1:
+            parser.error('--batch option accepts only one --algorithm')
+    if args.mode == 'watch':
+        if args.files:
+            parser.error('--watch option does not accept FILEs')
+        if not args.manifest:
+            parser.error('--watch option requires --manifest option')
+        if len(args.algorithm) > 1:
+            parser.error('--watch option accepts only one --algorithm')
+        if args.watch_interval < 0:
+            parser.error('--watch-interval must not be negative')
+        # symbolic links are not watched, and manifest is always sorted
+        if args.follow_symlinks or args.sort:
+            parser.error('--follow-symlinks and --sort options are not available with --watch option')
+    elif args.manifest:
+        parser.error('--manifest option is available only with --watch option')
+    if args.mode == 'find-duplicates' and (not args.files or '-' in args.files):
+        parser.error('--find-duplicates option requires FILEs (STDIN is not supported)')
+    if args.mode == 'client' and (not args.files or '-' in args.files):
+        parser.error('--client option requires FILEs (STDIN is not supported)')
+
     if args.mode != 'check' and (args.quiet or args.status or args.warn):
         parser.error('--quiet, --status and --warn options are available only with --check option')
 
+    if args.all_of:
+        if args.mode not in ('calculate', 'archive', 'batch', 'client', 'watch') or args.algorithm:
+            parser.error('--all-of option is available only in calculate, --archive, --batch, --client and --watch '
+                         'modes, without --algorithm')
+
+        args.all_of = [algo.strip() for algo in args.all_of.split(',') if algo.strip()]
+        unknown = [algo for algo in args.all_of if algo not in AVAILABLE_ALGORITHMS]
+        if not args.all_of:
+            parser.error('--all-of: no algorithm given')
+        elif unknown:
+            parser.error('--all-of: unknown algorithm: %s' % ', '.join(unknown))
+
+    if args.shard is not None:
+        if args.mode not in ('calculate', 'archive', 'check'):
+            parser.error('--shard option is available only in calculate, --archive and --check modes')
+        if not args.files or '-' in args.files:
+            parser.error('--shard option requires FILEs (STDIN is not supported)')
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError:
+            parser.error('--shard must be given as INDEX/COUNT, INDEX from 1 to COUNT')
+    if args.mode == 'merge' and (not args.files or '-' in args.files):
+        parser.error('--merge option requires FILEs (STDIN is not supported)')
+
+    if args.checkpoint and args.mode != 'check':
+        parser.error('--checkpoint option is available only with --check option')
+    if args.checkpoint and '-' in args.files:
+        parser.error('--checkpoint option cannot be used with manifest read from STDIN')
+    if args.resume and not args.checkpoint:
+        parser.error('--resume option is available only with --checkpoint option')
+
+    if args.stamp and args.mode != 'calculate':
+        parser.error('--stamp option is available only in calculate mode')
+    if (args.changed_only or args.reverify_age) and args.mode != 'check':
+        parser.error('--changed-only and --reverify-age options are available only with --check option')
+    if args.reverify_age is not None:
+        if not args.changed_only:
+            parser.error('--reverify-age option is available only with --changed-only option')
+        args.reverify_age = _parse_age(args.reverify_age)
+        if args.reverify_age is None:
+            parser.error('--reverify-age must be number of seconds, optionally with suffix: m, h or d')
+
+    if args.schedule and args.mode != 'calculate':
+        parser.error('--schedule option is available only in calculate mode')
+    if args.schedule_window < 1:
+        parser.error('--schedule-window must be at least 1')
+
+    if args.stats and args.mode not in ('calculate', 'check'):
+        parser.error('--stats option is available only in calculate and check modes')
+
+    if args.mode in ('find-duplicates', 'watch'):
+        args.recursive = True
+    elif args.mode not in ('calculate', 'client') and args.recursive:
+        parser.error('--recursive option is available only in calculate and --client modes')
+
+    if not args.recursive and (args.follow_symlinks or args.exclude or args.sort):
+        parser.error('--follow-symlinks, --exclude and --sort options are available only with --recursive option')
+
+    if args.recursive and scandir is None:
+        parser.error('--recursive option requires Python 3.5+ or scandir module')
+
+    if args.leaf_size < 1:
+        parser.error('--leaf-size must be at least 1')
+    elif args.leaf_size != DEFAULT_LEAF_SIZE:
+        args.algorithm = ['%s@%d' % (algo, args.leaf_size) if algo.startswith(TREE_PREFIX) else algo
+            for algo in args.algorithm]
+
+    if args.verify_range is not None:
+        if args.mode != 'check':
+            parser.error('--verify-range option is available only with --check option')
+        try:
+            args.verify_range = tuple(int(value) for value in args.verify_range.split('-', 1))
+        except ValueError:
+            args.verify_range = None
+        if not args.verify_range or len(args.verify_range) != 2 or args.verify_range[0] > args.verify_range[1]:
+            parser.error('--verify-range must be given as FIRST-LAST (numbers of bytes)')
+
+    if args.max_input_read < 1:
+        parser.error('--max-input-read must be at least 1')
+
+    if args.readahead < 0:
+        parser.error('--readahead must not be negative')
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+
+    explicit_algorithm = len(args.algorithm) > 0 or os.path.basename(sys.argv[0]) in AVAILABLE_ALGORITHMS
     if len(args.algorithm) > 0:
         pass
     elif os.path.basename(sys.argv[0]) in AVAILABLE_ALGORITHMS:
@@ -303,6 +2848,30 @@ def parse_args(argv):
     else:
         args.algorithm = [DEFAULT_ALGORITHM, ]
 
+    # algorithm of manifest entries in GNU coreutils format, when given explicitly
+    args.check_algorithm = args.algorithm[0] if explicit_algorithm else None
+
+    if args.quick:
+        if args.all_of or args.mode not in ('calculate', 'client'):
+            parser.error('--quick option is available only in calculate and --client modes, without --all-of')
+        args.algorithm = [algo if algo.startswith(QUICK_PREFIX) else QUICK_PREFIX + algo
+            for algo in args.algorithm]
+        unknown = [algo for algo in args.algorithm if algo not in AVAILABLE_QUICK_ALGORITHMS]
+        if unknown:
+            parser.error('--quick: quick fingerprint not available for: %s' % ', '.join(unknown))
+
+    if args.quick_samples < 0:
+        parser.error('--quick-samples must not be negative')
+    elif args.quick_samples != DEFAULT_QUICK_SAMPLES:
+        args.algorithm = ['%s@%d' % (algo, args.quick_samples) if algo.startswith(QUICK_PREFIX) else algo
+            for algo in args.algorithm]
+
+    if args.mode == 'find-duplicates' and args.algorithm[0].startswith(QUICK_PREFIX):
+        parser.error('--find-duplicates option: quick-* algorithms don\'t compare whole content of files')
+    if args.mode == 'archive' and any(algo not in AVAILABLE_ALGORITHMS for algo in args.algorithm):
+        parser.error('--archive option: members are read sequentially, tree-* and quick-* algorithms are not '
+                     'supported')
+
     if not args.files:
         args.files = ['-']
     # PYTHON2
@@ -312,14 +2881,86 @@ def parse_args(argv):
     return args
 
 
+_LAZY_ATTRIBUTES = {
+    'ahash_file': 'aio',
+    'ahash_many': 'aio',
+    'AsyncHasher': 'aio',
+}
+
+
+def __getattr__(name):
+    """
+    Import optional parts of hashfile (like asyncio front-end) only when they are used
+    """
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    import importlib
+    module = importlib.import_module('%s.%s' % (__name__, _LAZY_ATTRIBUTES[name]))
+    return getattr(module, name)
+
+
+def _lazy_mode(module, name):
+    """
+    Return mode handler from hashfile submodule, imported only when mode is used
+    :param module:
+    :param name:
+    :return:
+    """
+    def _mode(args):
+        import importlib
+        return getattr(importlib.import_module('%s.%s' % (__name__, module)), name)(args)
+    return _mode
+
+
+def _main_fast(argv):
+    """
+    Fast path for the most common call: through symlink named as algorithm (see --generate-algo-symlinks), for
+    single file or STDIN, without any options. Result is the same as from mode_calculate, but argparse is not
+    imported nor parser built, and no thread pool is started.
+    :param argv:
+    :return: exit code, or None if full command line parsing is needed
+    """
+    algo = os.path.basename(argv[0])
+    files = argv[1:]
+    if algo not in AVAILABLE_ALGORITHMS or len(files) > 1 or os.environ.get('HASHFILE_CACHE'):
+        return None
+
+    filename = files[0] if files else '-'
+    if filename != '-' and filename.startswith('-'):
+        return None
+
+    # PYTHON2
+    if hasattr(filename, 'decode'):
+        filename = filename.decode('utf-8')
+
+    last_error = None
+    for result in _hash_results(filename, [algo], _hash_options({'jobs': DEFAULT_JOBS})):
+        _print_hash_result(result, last_error)
+        last_error = result.error
+
+    return E_OK
+
+
 # pylint: disable=missing-docstring
 def main():
+    exit_code = _main_fast(sys.argv)
+    if exit_code is not None:
+        sys.exit(exit_code)
+
     args = parse_args(sys.argv[1:])
 
     modes = {
         'calculate': mode_calculate,
         'check': mode_check,
+        'find-duplicates': mode_find_duplicates,
         'generate-algo-symlinks': mode_generate_algo_symlinks,
+        'archive': _lazy_mode('archive', 'mode_archive'),
+        'merge': _lazy_mode('merge', 'mode_merge'),
+        'watch': _lazy_mode('watch', 'mode_watch'),
+        'batch': _lazy_mode('daemon', 'mode_batch'),
+        'serve': _lazy_mode('daemon', 'mode_serve'),
+        'client': _lazy_mode('daemon', 'mode_client'),
     }
     handler = modes.get(args.mode, mode_default)
     exit_code = handler(args)
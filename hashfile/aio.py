@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio front-end for hashfile: digests are calculated in a bounded pool of threads, so event loop is never
+blocked by reading or hashing data. Requires Python 3.7+ (names are exported lazily, through module
+__getattr__ of hashfile).
+"""
+
+import asyncio
+import collections
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import hashfile
+
+__all__ = ['ahash_file', 'ahash_many', 'AsyncHasher', 'get_executor', 'measure_loop_latency']
+
+_EXECUTOR = None
+
+
+def get_executor():
+    """
+    Return default pool of threads used for hashing, with hashfile.DEFAULT_JOBS workers
+    :return:
+    """
+    global _EXECUTOR  # pylint: disable=global-statement
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=hashfile.DEFAULT_JOBS)
+    return _EXECUTOR
+
+
+async def ahash_file(file_path, algo=hashfile.DEFAULT_ALGORITHM, executor=None, cache=None, **options):
+    """
+    Calculate digest of file in pool of threads
+    :param file_path:
+    :param algo:
+    :param executor: pool of threads, get_executor() by default
+    :param cache: hashfile.DigestCache or None
+    :param options: max_input_read, use_mmap, readahead, jobs, split_threshold, tree_sidecar, page_cache
+        (see hashfile.HASH_OPTIONS)
+    :return:
+    """
+    options = hashfile._hash_options(options)  # pylint: disable=protected-access
+    loop = asyncio.get_running_loop()
+    digests = await loop.run_in_executor(executor or get_executor(),
+        functools.partial(hashfile._file_digests, file_path, [algo], options, cache))  # pylint: disable=protected-access
+    return digests[algo]
+
+
+async def ahash_many(paths, algorithms=(hashfile.DEFAULT_ALGORITHM, ), concurrency=hashfile.DEFAULT_JOBS,
+        executor=None, cache=None, **options):
+    """
+    Calculate digests of many files, yield hashfile.HashResult in order of paths. At most `concurrency` files are
+    processed at once, and next paths are not taken until consumer takes results, so nothing is queued without
+    limit.
+    :param paths: iterable or async iterable of paths, or of (path, algorithms) tuples
+    :param algorithms: list of algorithms calculated for every path
+    :param concurrency: maximum number of files processed at once
+    :param executor: pool of threads, get_executor() by default
+    :param cache: hashfile.DigestCache or None
+    :param options: see ahash_file
+    :return:
+    """
+    options = hashfile._hash_options(options)  # pylint: disable=protected-access
+    loop = asyncio.get_running_loop()
+    executor = executor or get_executor()
+
+    async def _paths():
+        if hasattr(paths, '__aiter__'):
+            async for path in paths:
+                yield path
+        else:
+            for path in paths:
+                yield path
+
+    pending = collections.deque()
+    try:
+        async for path in _paths():
+            path, algos = path if isinstance(path, tuple) else (path, algorithms)
+            pending.append(loop.run_in_executor(executor,
+                functools.partial(hashfile._hash_results, path, algos, options, cache)))  # pylint: disable=protected-access
+            if len(pending) >= concurrency:
+                for result in await pending.popleft():
+                    yield result
+
+        while pending:
+            for result in await pending.popleft():
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class AsyncHasher(object):
+    """
+    Incremental hasher for data coming from async streams, for many algorithms at once. Big chunks are hashed in
+    pool of threads, and every update waits until data is hashed, so producer cannot outrun hashing.
+    """
+    # hashing smaller chunks directly is cheaper than passing them to other thread
+    SYNC_UPDATE_SIZE = 64 * 1024
+
+    def __init__(self, algos=(hashfile.DEFAULT_ALGORITHM, ), executor=None):
+        self.algos = list(algos)
+        self._digesters = [hashfile.new_digester(algo) for algo in self.algos]
+        self._executor = executor or get_executor()
+        self._lock = asyncio.Lock()
+
+    def _update(self, data):
+        for digester in self._digesters:
+            digester.update(data)
+
+    async def update(self, data):
+        """
+        Hash next chunk of data
+        :param data:
+        :return:
+        """
+        async with self._lock:
+            if len(data) < self.SYNC_UPDATE_SIZE:
+                self._update(data)
+            else:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._update, data)
+
+    async def consume(self, stream, chunk_size=hashfile.MAX_INPUT_READ):
+        """
+        Hash everything from stream: async iterable of bytes, or object with coroutine read(size)
+        (like asyncio.StreamReader)
+        :param stream:
+        :param chunk_size: size of chunks read from stream with read()
+        :return: self
+        """
+        if hasattr(stream, '__aiter__'):
+            async for chunk in stream:
+                await self.update(chunk)
+        else:
+            while True:
+                chunk = await stream.read(chunk_size)
+                if not chunk:
+                    break
+                await self.update(chunk)
+
+        return self
+
+    def hexdigests(self):
+        """
+        :return: dict algo -> digest
+        """
+        return {algo: digester.hexdigest() for algo, digester in zip(self.algos, self._digesters)}
+
+    def hexdigest(self):
+        """
+        :return: digest for first algorithm
+        """
+        return self._digesters[0].hexdigest()
+
+
+def measure_loop_latency(coroutines, interval=0.001):
+    """
+    Run coroutines in new event loop, measuring how late is a task sleeping for `interval` in a loop
+    :param coroutines:
+    :param interval:
+    :return: dict with total time of coroutines, and maximum and 99th percentile of lag (in milliseconds)
+    """
+    async def _measure():
+        lags = []
+
+        async def _ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                lags.append(time.perf_counter() - started - interval)
+
+        ticker = asyncio.ensure_future(_ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*coroutines)
+        seconds = time.perf_counter() - started
+        ticker.cancel()
+
+        lags.sort()
+        return {
+            'seconds': seconds,
+            'max_lag_ms': lags[-1] * 1000 if lags else None,
+            'p99_lag_ms': lags[int(len(lags) * 0.99)] * 1000 if lags else None,
+        }
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(_measure())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
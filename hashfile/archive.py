@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+"""
+Digests of archive members, calculated while archive is streamed, without extracting it. Tar archives (also
+compressed with gzip, bzip2 or xz) are read sequentially (also from STDIN), zip archives in order of data of
+members. Member is identified by path of archive and name of member separated by '!':
+
+    sha256: DIGEST archive.tar.gz!dir/member
+
+Such entries in manifests are verified by --check in single pass over archive, when all entries of archive
+are consecutive (as written by --archive). Results are reported as pass reaches members.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import collections
+import errno
+import os
+import sys
+import tarfile
+import zipfile
+import zlib
+
+import hashfile
+
+MEMBER_SEPARATOR = '!'
+ARCHIVE_ERRORS = (OSError, IOError, EOFError, tarfile.TarError, zipfile.BadZipfile, zlib.error)
+# single member cannot be read, but others can: encrypted, or compressed with unsupported method (zip)
+MEMBER_ERRORS = (RuntimeError, NotImplementedError)
+
+
+def member_path(archive_path, name):
+    return '%s%s%s' % (archive_path, MEMBER_SEPARATOR, name)
+
+
+def split_member_path(path):
+    """
+    Split path of archive member (see member_path). Paths of existing files are never treated as members, even
+    if they contain separator.
+    :param path:
+    :return: (archive path, member name), or None if path doesn't point to archive member
+    """
+    if MEMBER_SEPARATOR not in path or os.path.lexists(path):
+        return None
+
+    position = path.find(MEMBER_SEPARATOR)
+    while position >= 0:
+        if os.path.isfile(path[:position]):
+            return path[:position], path[position + 1:]
+        position = path.find(MEMBER_SEPARATOR, position + 1)
+
+    return None
+
+
+def is_supported_algorithm(algo):
+    """
+    Check if algorithm can be calculated for archive members: they are read sequentially, so tree-* and
+    quick-* algorithms (which need positional reads) are not supported
+    :param algo:
+    :return:
+    """
+    return algo in hashfile.AVAILABLE_ALGORITHMS
+
+
+def iter_members(archive_path):
+    """
+    Yield (name, file object, error) for every regular file in archive. File object can be read only until next
+    member is requested, it's None when member cannot be opened (see MEMBER_ERRORS for error).
+    :param archive_path: path of tar or zip archive, '-' for tar archive from STDIN
+    :return:
+    """
+    if archive_path != '-' and zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            # central directory doesn't have to be in order of data
+            for info in sorted(archive.infolist(), key=lambda info: info.header_offset):
+                if info.filename.endswith('/'):
+                    continue
+                try:
+                    fh = archive.open(info)
+                except MEMBER_ERRORS as exc:
+                    yield info.filename, None, exc
+                    continue
+                with fh:
+                    yield info.filename, fh, None
+        return
+
+    if archive_path == '-':
+        archive = tarfile.open(fileobj=getattr(sys.stdin, 'buffer', sys.stdin), mode='r|*')
+    else:
+        archive = tarfile.open(archive_path, mode='r|*')
+
+    with archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member), None
+
+
+def _digest_member(fh, error, algos, options):
+    """
+    Calculate digests of member yielded by iter_members
+    :return: (dict algo -> digest, None), or (None, error) when member cannot be read
+    """
+    if error is None:
+        try:
+            return hashfile.digest_file(fh, algos, max_input_read=options['max_input_read'],
+                readahead=options['readahead']), None
+        except MEMBER_ERRORS as exc:
+            error = exc
+    return None, error
+
+
+def digest_members(archive_path, algos, options):
+    """
+    Calculate digests of archive members, reading archive once
+    :param archive_path: path of tar or zip archive, '-' for tar archive from STDIN
+    :param algos: list of algorithms (see is_supported_algorithm)
+    :param options: dict, as returned by hashfile._hash_options
+    :return: iterator of (member name, dict algo -> digest or None, error or None if member was read), raises one
+        of ARCHIVE_ERRORS when archive is broken
+    """
+    for name, fh, error in iter_members(archive_path):
+        digests, error = _digest_member(fh, error, algos, options)
+        yield name, digests, error
+
+
+def verify_members(archive_path, entries, options):
+    """
+    Verify manifest entries of members of single archive, in single pass over archive. Results are yielded as
+    soon as pass reaches members, and entries are read only as far as needed to find member reached, so when they
+    are in order of archive (as written by --archive) only few entries and digests are kept in memory.
+    Consecutive entries for the same member are verified together, N-th of them for given algorithm against N-th
+    copy of member in archive.
+    :param archive_path:
+    :param entries: iterator of hashfile.CheckResult with paths of members of archive (see member_path)
+    :param options: dict, as returned by hashfile._hash_options
+    :return: iterator of CheckResult, in order of entries
+    """
+    entries = iter(entries)
+    prefix = len(archive_path) + len(MEMBER_SEPARATOR)
+    # entries read and not reported yet, in order, as [entry, result or None]
+    pending = collections.deque()
+    # member name -> algo -> deque of pending items not verified yet
+    waiting = {}
+    # name of member of last read entry
+    last = [None]
+
+    def _read():
+        entry = next(entries, None)
+        if entry is None:
+            last[0] = None
+            return False
+
+        item = [entry, None]
+        pending.append(item)
+        last[0] = entry.path[prefix:]
+        if is_supported_algorithm(entry.algo):
+            waiting.setdefault(last[0], {}).setdefault(entry.algo, collections.deque()).append(item)
+        else:
+            item[1] = entry._replace(status=hashfile.CHECK_ERROR,
+                error=ValueError('Algorithm not supported for archive members: %s' % entry.algo))
+        return True
+
+    def _read_for(name):
+        while name not in waiting and _read():
+            pass
+        while name in waiting and last[0] == name and _read():
+            pass
+        return waiting.pop(name, None)
+
+    error = None
+    try:
+        for name, fh, member_error in iter_members(archive_path):
+            items = _read_for(name)
+            if items is None:
+                continue
+
+            algos = sorted(items)
+            digests, member_error = _digest_member(fh, member_error, algos, options)
+            for algo in algos:
+                item = items[algo].popleft()
+                if member_error is not None:
+                    item[1] = item[0]._replace(status=hashfile.CHECK_ERROR, error=member_error)
+                    continue
+                item[1] = item[0]._replace(digest=digests[algo],
+                    status=hashfile.CHECK_OK if digests[algo] == item[0].expected else hashfile.CHECK_FAILED)
+            # entries for next copies of member
+            items = dict((algo, queue) for algo, queue in items.items() if queue)
+            if items:
+                waiting[name] = items
+
+            while pending and pending[0][1] is not None:
+                yield pending.popleft()[1]
+    except ARCHIVE_ERRORS as exc:
+        error = exc
+
+    while _read():
+        pass
+    for entry, result in pending:
+        yield result or entry._replace(status=hashfile.CHECK_ERROR,
+            error=error or IOError(errno.ENOENT, 'No such member in archive'))
+
+
+def mode_archive(args):
+    """
+    Calculate digests of members of archives, print them as in calculate mode
+    :param args:
+    :return:
+    """
+    options = hashfile._hash_options(hashfile._cli_hash_options(args))
+    if args.shard:
+        print(hashfile.format_shard(args.shard))
+    entries = 0
+    for i, archive_path in hashfile._iter_input_files(args):
+        algos = args.all_of or [args.algorithm[i] if len(args.algorithm) > i else args.algorithm[-1]]
+        try:
+            for name, digests, error in digest_members(archive_path, algos, options):
+                path = member_path(archive_path, name)
+                if error is not None:
+                    print('ERROR: %s %s' % (path, error), file=sys.stderr)
+                    continue
+                for algo in algos:
+                    print('%s: %s %s' % (algo, digests[algo], path))
+                    entries += 1
+        except ARCHIVE_ERRORS as exc:
+            print('ERROR: %s %s' % (archive_path, exc), file=sys.stderr)
+
+    if args.shard:
+        print(hashfile.format_shard(args.shard, entries))
+    return hashfile.E_OK
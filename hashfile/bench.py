@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for hashfile: throughput of every algorithm for different file sizes and chunk sizes, scaling with
+number of workers, files per second for tiny files, startup time and event loop latency of asyncio front-end.
+Every case is run in separate process, to measure its own peak RSS. Results are written as JSON, so they can
+be compared between versions.
+
+    python -m hashfile.bench --output bench.json
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import hashfile
+
+# shake_* algorithms have no digest of fixed length
+DEFAULT_ALGORITHMS = [algo for algo in hashfile.AVAILABLE_ALGORITHMS if not algo.startswith('shake')]
+DEFAULT_SIZES = '1k,1m,64m'
+DEFAULT_CHUNK_SIZES = '64k,1m,4m'
+DEFAULT_JOBS = '1,2,4'
+DEFAULT_TINY_FILES = 1000
+DEFAULT_STARTUP_RUNS = 10
+DEFAULT_SCHEDULE_FILES = 2000
+DATA_BLOCK = 1024**2
+UNITS = {'': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3}
+
+
+def parse_size(value):
+    """
+    Parse size like 4k, 64m or 2g
+    :param value:
+    :return:
+    """
+    value = value.strip().lower()
+    unit = value[-1:] if value[-1:] in UNITS else ''
+    return int(value[:len(value) - len(unit)]) * UNITS[unit]
+
+
+def format_size(value):
+    for unit in ('g', 'm', 'k'):
+        if value >= UNITS[unit] and value % UNITS[unit] == 0:
+            return '%d%s' % (value // UNITS[unit], unit)
+    return str(value)
+
+
+def create_file(path, size):
+    """
+    Create file with pseudo-random content of given size
+    :param path:
+    :param size:
+    :return:
+    """
+    block = os.urandom(min(size, DATA_BLOCK))
+    with open(path, 'wb') as fh:
+        remaining = size
+        while remaining > 0:
+            fh.write(block[:remaining])
+            remaining -= len(block)
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def _run_hash(case):
+    paths = case['paths']
+    options = {'max_input_read': case['chunk_size']}
+    # first run reads files into page cache
+    for _ in hashfile.hash_many(paths, [case['algorithm']], jobs=case['jobs'], **options):
+        pass
+
+    started = hashfile._clock()
+    for _ in range(case['repeat']):
+        for result in hashfile.hash_many(paths, [case['algorithm']], jobs=case['jobs'], **options):
+            if result.error is not None:
+                raise result.error
+    seconds = (hashfile._clock() - started) / case['repeat']
+
+    total = sum(os.path.getsize(path) for path in paths)
+    return {
+        'seconds': seconds,
+        'mb_per_s': total / 1024.0**2 / seconds if seconds else None,
+        'files_per_s': len(paths) / seconds if seconds else None,
+    }
+
+
+def drop_caches():
+    """
+    Drop page cache (Linux, requires root), so files are read from disk
+    :return: True if cache was dropped
+    """
+    if hasattr(os, 'sync'):
+        os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as fh:
+            fh.write('3\n')
+    except (OSError, IOError):
+        return False
+    return True
+
+
+def resident_fraction(path):
+    """
+    Measure which part of file is in page cache, with mincore (Linux)
+    :param path:
+    :return: fraction of pages of file in page cache, or None if it cannot be measured
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        import mmap
+        mincore = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).mincore
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    size = os.path.getsize(path)
+    if not size:
+        return None
+
+    pages = -(-size // mmap.PAGESIZE)
+    vector = (ctypes.c_ubyte * pages)()
+    with open(path, 'rb') as fh:
+        # private map can be exported as ctypes object, pages are not read by mapping them
+        mapped = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_COPY)
+        try:
+            address = ctypes.c_char.from_buffer(mapped)
+            ret = mincore(ctypes.c_void_p(ctypes.addressof(address)), ctypes.c_size_t(size), vector)
+            del address
+        finally:
+            mapped.close()
+
+    if ret != 0:
+        return None
+    return sum(page & 1 for page in vector) / float(pages)
+
+
+def _run_page_cache(case):
+    cold = drop_caches() if case['drop_caches'] else False
+    started = hashfile._clock()
+    for result in hashfile.hash_many(case['paths'], [case['algorithm']], jobs=case['jobs'],
+            max_input_read=case['chunk_size'], page_cache=case['page_cache']):
+        if result.error is not None:
+            raise result.error
+    seconds = hashfile._clock() - started
+
+    total = sum(os.path.getsize(path) for path in case['paths'])
+    return {
+        'seconds': seconds,
+        'mb_per_s': total / 1024.0**2 / seconds if seconds else None,
+        'cold_cache': cold,
+        'resident_fraction': resident_fraction(case['paths'][0]),
+    }
+
+
+def _run_schedule(case):
+    paths = case['paths']
+    # delayed allocation: files have no physical location until they are written back
+    if hasattr(os, 'sync'):
+        os.sync()
+    locations = {path: hashfile.file_location(path, 'extent') for path in paths}
+    # order in which files are read (all of them fit in one window), to sum distances between them
+    read_order = list(paths)
+    if case['schedule'] is not None:
+        read_order.sort(key=lambda path: hashfile.file_location(path, case['schedule']))
+
+    seek_distance = 0
+    for previous, path in zip(read_order, read_order[1:]):
+        if locations[previous][0] == locations[path][0]:
+            seek_distance += abs(locations[path][1] - locations[previous][1])
+
+    cold = drop_caches() if case['drop_caches'] else False
+    started = hashfile._clock()
+    for result in hashfile.hash_many(paths, [case['algorithm']], jobs=case['jobs'], schedule=case['schedule']):
+        if result.error is not None:
+            raise result.error
+    seconds = hashfile._clock() - started
+
+    return {
+        'seconds': seconds,
+        'files_per_s': len(paths) / seconds if seconds else None,
+        'cold_cache': cold,
+        'seek_distance_mb': seek_distance / 1024.0**2,
+    }
+
+
+def _run_aio_latency(case):
+    from hashfile import aio
+
+    return aio.measure_loop_latency([hashfile.ahash_file(path, case['algorithm']) for path in case['paths']])
+
+
+def run_case(case):
+    """
+    Run single benchmark case in current process
+    :param case: dict describing case
+    :return: dict with results
+    """
+    runners = {
+        'hash': _run_hash,
+        'schedule': _run_schedule,
+        'page-cache': _run_page_cache,
+        'aio-latency': _run_aio_latency,
+    }
+    result = runners[case['kind']](case)
+    result['peak_rss_kb'] = _peak_rss_kb()
+    return result
+
+
+def run_case_subprocess(case):
+    """
+    Run single benchmark case in new process
+    :param case: dict describing case
+    :return: dict with results
+    """
+    # case is passed through stdin, list of paths can be too long for command line
+    proc = subprocess.Popen([sys.executable, '-m', 'hashfile.bench', '--run-case'], stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, errors = proc.communicate(json.dumps(case).encode('utf-8'))
+    if proc.returncode:
+        # last line of traceback describes error
+        lines = errors.decode('utf-8', 'replace').strip().splitlines()
+        raise subprocess.CalledProcessError(proc.returncode, 'hashfile.bench --run-case',
+            lines[-1] if lines else None)
+    return json.loads(output.decode('utf-8'))
+
+
+def measure_startup(path, runs, algorithm):
+    """
+    Measure time of running hashfile for single tiny file, and of importing hashfile module only
+    :param path: file to hash
+    :param runs: number of runs, median is reported
+    :param algorithm: used as program name, as when called through symlink
+    :return:
+    """
+    def _median(cmd):
+        times = []
+        for _ in range(runs):
+            started = hashfile._clock()
+            subprocess.check_call(cmd, stdout=subprocess.PIPE)
+            times.append(hashfile._clock() - started)
+        times.sort()
+        return times[len(times) // 2]
+
+    code = 'import sys; sys.argv[0] = %r; import hashfile; hashfile.main()' % algorithm
+    return {
+        'kind': 'startup',
+        'algorithm': algorithm,
+        'runs': runs,
+        'python_seconds': _median([sys.executable, '-c', 'pass']),
+        'import_seconds': _median([sys.executable, '-c', 'import hashfile']),
+        'run_seconds': _median([sys.executable, '-c', code, path]),
+    }
+
+
+def write_report(report, output):
+    """
+    Write report as JSON, file is replaced atomically (so it's always complete, also when written after every case)
+    :param report:
+    :param output: path of file, '-' for stdout
+    :return:
+    """
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if output == '-':
+        print(data)
+        return
+
+    tmp_path = '%s.%d.tmp' % (output, os.getpid())
+    with open(tmp_path, 'w') as fh:
+        fh.write(data + '\n')
+    os.rename(tmp_path, output)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark hashfile')
+    parser.add_argument('--algorithms', default=','.join(DEFAULT_ALGORITHMS),
+        help='comma separated list of algorithms (default: all available, except shake_*)')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+        help='comma separated list of file sizes, for example 1k,1m,4g (default: %(default)s)')
+    parser.add_argument('--chunk-sizes', default=DEFAULT_CHUNK_SIZES,
+        help='comma separated list of --max-input-read values (default: %(default)s)')
+    parser.add_argument('--jobs', default=DEFAULT_JOBS,
+        help='comma separated list of numbers of workers (default: %(default)s)')
+    parser.add_argument('--scaling-algorithm', default=hashfile.DEFAULT_ALGORITHM,
+        help='algorithm used to measure scaling with number of workers (default: %(default)s)')
+    parser.add_argument('--tiny-files', default=DEFAULT_TINY_FILES, type=int,
+        help='number of 1k files used to measure files per second (default: %(default)s)')
+    parser.add_argument('--schedule-files', default=DEFAULT_SCHEDULE_FILES, type=int,
+        help='number of 16k files, written in random order, used to compare --schedule orders '
+             '(default: %(default)s)')
+    parser.add_argument('--drop-caches', action='store_true',
+        help='drop page cache of whole system before page cache and schedule cases, so files are read from disk '
+             '(only when running as root on Linux)')
+    parser.add_argument('--startup-runs', default=DEFAULT_STARTUP_RUNS, type=int,
+        help='number of runs used to measure startup time (default: %(default)s)')
+    parser.add_argument('--repeat', default=1, type=int,
+        help='number of repetitions of every case (default: %(default)s)')
+    parser.add_argument('--tmpdir', default=None,
+        help='directory for synthetic files (default: system temporary directory)')
+    parser.add_argument('--output', '-o', default='-',
+        help='file for results in JSON (default: stdout)')
+    parser.add_argument('--run-case', action='store_true', help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+    args.algorithms = [algo for algo in args.algorithms.split(',') if algo]
+    unsupported = [algo for algo in args.algorithms + [args.scaling_algorithm] if algo not in DEFAULT_ALGORITHMS]
+    if unsupported:
+        parser.error('unsupported algorithm: %s' % ', '.join(unsupported))
+    args.sizes = [parse_size(size) for size in args.sizes.split(',') if size]
+    args.chunk_sizes = [parse_size(size) for size in args.chunk_sizes.split(',') if size]
+    args.jobs = [int(jobs) for jobs in args.jobs.split(',') if jobs]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(sys.stdin.read()))))
+        return
+
+    def _progress(message):
+        print(message, file=sys.stderr)
+
+    report = {
+        'hashfile': hashfile.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': hashfile.DEFAULT_JOBS,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': [],
+    }
+    results = report['results']
+
+    workdir = tempfile.mkdtemp(prefix='hashfile-bench-', dir=args.tmpdir)
+    cases = []
+    try:
+        files = {}
+        for size in args.sizes:
+            files[size] = os.path.join(workdir, 'file-%s' % format_size(size))
+            create_file(files[size], size)
+
+        for algo in args.algorithms:
+            for size in args.sizes:
+                for chunk_size in args.chunk_sizes:
+                    case = {'kind': 'hash', 'algorithm': algo, 'size': size, 'chunk_size': chunk_size, 'jobs': 1,
+                        'files': 1, 'paths': [files[size]], 'repeat': args.repeat}
+                    cases.append(case)
+
+        biggest = max(args.sizes)
+        scaling_paths = [files[biggest]] + [os.path.join(workdir, 'scaling-%d' % i) for i in range(1, max(args.jobs))]
+        for path in scaling_paths[1:]:
+            shutil.copyfile(files[biggest], path)
+
+        tiny_paths = [os.path.join(workdir, 'tiny-%d' % i) for i in range(args.tiny_files)]
+        for path in tiny_paths:
+            create_file(path, 1024)
+
+        for jobs in args.jobs:
+            cases.append({'kind': 'hash', 'algorithm': args.scaling_algorithm, 'size': biggest,
+                'chunk_size': hashfile.MAX_INPUT_READ, 'jobs': jobs, 'files': len(scaling_paths),
+                'paths': scaling_paths, 'repeat': args.repeat})
+            if tiny_paths:
+                cases.append({'kind': 'hash', 'algorithm': args.scaling_algorithm, 'size': 1024,
+                    'chunk_size': hashfile.MAX_INPUT_READ, 'jobs': jobs, 'files': len(tiny_paths),
+                    'paths': tiny_paths, 'repeat': args.repeat})
+
+        # cold page cache (with --drop-caches), and part of file left in page cache after hashing
+        for page_cache in (hashfile.PAGE_CACHE_KEEP, hashfile.PAGE_CACHE_DROP, hashfile.PAGE_CACHE_DIRECT):
+            cases.append({'kind': 'page-cache', 'algorithm': args.scaling_algorithm, 'page_cache': page_cache,
+                'size': biggest, 'jobs': 1, 'chunk_size': hashfile.MAX_INPUT_READ, 'files': 1,
+                'paths': [files[biggest]], 'drop_caches': args.drop_caches})
+
+        # files are written in random order, so their order on disk differs from order of names
+        schedule_paths = [os.path.join(workdir, 'schedule-%05d' % i) for i in range(args.schedule_files)]
+        for path in random.sample(schedule_paths, len(schedule_paths)):
+            create_file(path, 16 * 1024)
+        for schedule in (None, ) + hashfile.SCHEDULES:
+            if schedule_paths:
+                cases.append({'kind': 'schedule', 'algorithm': args.scaling_algorithm, 'schedule': schedule,
+                    'size': 16 * 1024, 'jobs': 1, 'chunk_size': hashfile.MAX_INPUT_READ,
+                    'files': len(schedule_paths), 'paths': schedule_paths, 'drop_caches': args.drop_caches})
+
+        if sys.version_info >= (3, 7):
+            cases.append({'kind': 'aio-latency', 'algorithm': args.scaling_algorithm, 'size': biggest,
+                'files': len(scaling_paths), 'paths': scaling_paths})
+
+        for case in cases:
+            description = '%s: %s, %d file(s) of %s' % (case['kind'], case['algorithm'], case['files'],
+                format_size(case['size']))
+            if 'jobs' in case:
+                description += ', chunk %s, %d job(s)' % (format_size(case['chunk_size']), case['jobs'])
+            if case['kind'] == 'schedule':
+                description += ', schedule %s' % case['schedule']
+            elif case['kind'] == 'page-cache':
+                description += ', page cache %s' % case['page_cache']
+            _progress(description)
+            try:
+                case.update(run_case_subprocess(case))
+            except (subprocess.CalledProcessError, ValueError) as exc:
+                # failed case doesn't stop benchmark, its error is reported instead of results
+                case['error'] = getattr(exc, 'output', None) or str(exc)
+                _progress('  failed: %s' % case['error'])
+            del case['paths']
+            results.append(case)
+            if args.output != '-':
+                write_report(report, args.output)
+
+        _progress('startup')
+        try:
+            results.append(measure_startup(tiny_paths[0] if tiny_paths else files[min(args.sizes)],
+                args.startup_runs, args.scaling_algorithm))
+        except subprocess.CalledProcessError as exc:
+            results.append({'kind': 'startup', 'algorithm': args.scaling_algorithm, 'error': str(exc)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        # results of finished cases are kept even if benchmark is interrupted
+        write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
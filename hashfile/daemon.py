@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+
+"""
+Long running hashfile: digests are calculated for requests read from Unix socket (--serve) or from STDIN
+(--batch), so interpreter is started only once. Workers, their read buffers and digest cache are shared by all
+requests, and digests are calculated by the same FILE_HELPERS as in calculate mode.
+
+Protocol (--serve and --client): every request is terminated by NUL byte and contains algorithm (or comma
+separated algorithms) and absolute path separated by single space:
+
+    sha256 /path/to/file\\0
+
+For every algorithm one line is sent back, in order of requests, as soon as digest is ready:
+
+    sha256: DIGEST
+    ERROR: MESSAGE
+
+In --batch mode STDIN contains only NUL terminated paths (as from `find -print0`), algorithms are given by
+--algorithm or --all-of, and results are printed as in calculate mode.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import errno
+import os
+import signal
+import socket
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import hashfile
+
+READ_SIZE = 64 * 1024
+MAX_REQUEST_SIZE = 64 * 1024
+QUEUED_REPLIES = 4
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _decode(data):
+    if hashfile.PY3:
+        return data.decode('utf-8', 'surrogateescape')
+    return data.decode('utf-8')
+
+
+def _encode(text):
+    if hashfile.PY3:
+        return text.encode('utf-8', 'surrogateescape')
+    return text.encode('utf-8')
+
+
+def iter_nul_delimited(read, read_size=READ_SIZE, max_size=MAX_REQUEST_SIZE):
+    """
+    Yield NUL terminated records read by `read` function, until EOF. Last record doesn't need terminating NUL.
+    :param read: function like file.read or socket.recv
+    :param read_size: number of bytes read at once
+    :param max_size: maximum size of single record, ProtocolError is raised for longer ones
+    :return: iterator of decoded records
+    """
+    pending = b''
+    while True:
+        data = read(read_size)
+        if not data:
+            break
+
+        records = (pending + data).split(b'\0')
+        pending = records.pop()
+        for record in records:
+            yield _decode(record)
+
+        if len(pending) > max_size:
+            raise ProtocolError('request too long')
+
+    if pending:
+        yield _decode(pending)
+
+
+def is_known_algorithm(algo):
+    """
+    Check if algorithm label can be calculated by any of FILE_HELPERS
+    :param algo:
+    :return:
+    """
+    try:
+        name, _ = hashfile.split_algorithm(algo)
+    except ValueError:
+        return False
+    return name in hashfile.FILE_HELPERS
+
+
+def serve_requests(requests, reply, executor, options, cache=None, queued=QUEUED_REPLIES):
+    """
+    Calculate digests for requests in executor, and call reply with results in order of requests. Requests are
+    consumed in calling thread and replies are sent from another one as soon as digests are ready, so client
+    may wait for reply before sending next request.
+    :param requests: iterable of (path, algorithms) tuples, invalid requests can be given as lists of HashResult
+    :param reply: function called with list of HashResult (one for every algorithm) for every request
+    :param executor: pool of threads (concurrent.futures.Executor)
+    :param options: dict, as returned by hashfile._hash_options
+    :param cache: DigestCache or None
+    :param queued: number of requests queued in executor for every worker
+    :return:
+    """
+    from concurrent.futures import Future
+
+    pending = queue.Queue(max(1, getattr(executor, '_max_workers', 1)) * queued)
+    failed = []
+
+    def _writer():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            if failed:
+                future.cancel()
+                continue
+
+            try:
+                reply(future.result())
+            except Exception as exc:  # pylint: disable=broad-except
+                # client is gone, remaining requests are cancelled
+                failed.append(exc)
+
+    writer = threading.Thread(target=_writer)
+    writer.daemon = True
+    writer.start()
+    try:
+        for request in requests:
+            if failed:
+                break
+
+            if isinstance(request, list):
+                future = Future()
+                future.set_result(request)
+            else:
+                path, algos = request
+                future = executor.submit(hashfile._hash_results, path, algos, options, cache)
+            pending.put(future)
+    finally:
+        pending.put(None)
+        writer.join()
+
+    if failed:
+        raise failed[0]
+
+
+def parse_request(request):
+    """
+    Parse request sent to --serve: algorithms (comma separated) and path separated by space
+    :param request:
+    :return: (path, algorithms) or list of HashResult with errors for invalid request
+    """
+    algos, _, path = request.partition(' ')
+    algos = algos.split(',')
+    if not path:
+        error = ProtocolError('invalid request: %r' % request)
+    elif not os.path.isabs(path):
+        error = ProtocolError('path must be absolute: %s' % path)
+    else:
+        unknown = [algo for algo in algos if not is_known_algorithm(algo)]
+        if not unknown:
+            return path, algos
+        error = ValueError('Unknown algorithm: %s' % ', '.join(unknown))
+
+    return [hashfile.HashResult(path, algo, None, None, error) for algo in algos]
+
+
+def format_reply(results):
+    """
+    Format results of single request as sent by --serve: line for every algorithm
+    :param results: list of HashResult
+    :return:
+    """
+    lines = []
+    for result in results:
+        if result.error is None:
+            lines.append('%s: %s\n' % (result.algo, result.digest))
+        else:
+            lines.append('ERROR: %s\n' % str(result.error).replace('\n', ' '))
+    return ''.join(lines)
+
+
+def _new_executor(args):
+    executor_class = hashfile._get_executor_class()
+    if executor_class is None:
+        print('ERROR: concurrent.futures module is required', file=sys.stderr)
+        return None
+    return executor_class(max_workers=args.jobs)
+
+
+def _stop_on_sigterm():
+    def _handler(signum, frame):  # pylint: disable=unused-argument
+        raise SystemExit(hashfile.E_OK)
+
+    signal.signal(signal.SIGTERM, _handler)
+
+
+def mode_batch(args):
+    """
+    Calculate digests of NUL terminated paths read from STDIN, print them as in calculate mode
+    :param args:
+    :return:
+    """
+    algos = args.all_of or args.algorithm[:1]
+    executor = _new_executor(args)
+    if executor is None:
+        return hashfile.E_FAIL
+
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    read = getattr(stdin, 'read1', stdin.read)
+    requests = ((path, algos) for path in iter_nul_delimited(read) if path)
+
+    def _reply(results):
+        last_error = None
+        for result in results:
+            hashfile._print_hash_result(result, last_error)
+            last_error = result.error
+        sys.stdout.flush()
+
+    cache = hashfile._open_cache(args)
+    try:
+        serve_requests(requests, _reply, executor, hashfile._hash_options(hashfile._cli_hash_options(args)), cache)
+    finally:
+        executor.shutdown(wait=False)
+        if cache is not None:
+            cache.close()
+
+    return hashfile.E_OK
+
+
+def _prepare_socket(path):
+    """
+    Remove stale socket left by server which wasn't stopped cleanly
+    :param path:
+    :return: False if another server is listening on given socket
+    """
+    if not os.path.exists(path):
+        return True
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as exc:
+        if exc.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.unlink(path)
+        return True
+    finally:
+        sock.close()
+
+    return False
+
+
+def mode_serve(args):
+    """
+    Serve requests (see module documentation) on Unix socket until SIGTERM or SIGINT
+    :param args:
+    :return:
+    """
+    if not _prepare_socket(args.serve):
+        print('ERROR: %s: another server is already listening' % args.serve, file=sys.stderr)
+        return hashfile.E_FAIL
+
+    executor = _new_executor(args)
+    if executor is None:
+        return hashfile.E_FAIL
+
+    options = hashfile._hash_options(hashfile._cli_hash_options(args))
+    cache = hashfile._open_cache(args)
+
+    class _Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            requests = (parse_request(request) for request in iter_nul_delimited(self.request.recv) if request)
+
+            def _reply(results):
+                self.request.sendall(_encode(format_reply(results)))
+
+            try:
+                serve_requests(requests, _reply, executor, options, cache)
+            except (ProtocolError, socket.error) as exc:
+                print('ERROR: %s' % exc, file=sys.stderr)
+
+    class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    # only owner can ask for digests of files readable by server
+    old_umask = os.umask(0o077)
+    try:
+        server = _Server(args.serve, _Handler)
+    finally:
+        os.umask(old_umask)
+
+    _stop_on_sigterm()
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.serve):
+            os.unlink(args.serve)
+        executor.shutdown(wait=False)
+        if cache is not None:
+            cache.close()
+
+    return hashfile.E_OK
+
+
+def mode_client(args):
+    """
+    Ask server started with --serve for digests of files, print them as in calculate mode
+    :param args:
+    :return:
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(args.client)
+    except socket.error as exc:
+        print('ERROR: %s %s' % (args.client, exc), file=sys.stderr)
+        return hashfile.E_FAIL
+
+    sent = queue.Queue()
+
+    def _sender():
+        try:
+            for i, filename in hashfile._iter_input_files(args):
+                algos = args.all_of or [args.algorithm[i] if len(args.algorithm) > i else args.algorithm[-1]]
+                sent.put((filename, algos))
+                sock.sendall(_encode('%s %s\0' % (','.join(algos), os.path.abspath(filename))))
+            sock.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+        finally:
+            sent.put(None)
+
+    sender = threading.Thread(target=_sender)
+    sender.daemon = True
+    sender.start()
+
+    replies = sock.makefile('rb')
+    try:
+        while True:
+            request = sent.get()
+            if request is None:
+                break
+
+            filename, algos = request
+            reported = False
+            for algo in algos:
+                line = _decode(replies.readline()).rstrip('\n')
+                if not line:
+                    print('ERROR: %s: connection closed by server' % args.client, file=sys.stderr)
+                    return hashfile.E_FAIL
+
+                if line.startswith('ERROR: '):
+                    # the same error is reported for every algorithm calculated for the file
+                    if not reported:
+                        print('ERROR: %s %s' % (filename, line[len('ERROR: '):]), file=sys.stderr)
+                    reported = True
+                else:
+                    print('%s %s' % (line, filename))
+    finally:
+        replies.close()
+        sock.close()
+
+    return hashfile.E_OK
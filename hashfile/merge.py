@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Merging of manifests calculated with --shard (on many hosts) into one manifest, sorted by path and algorithm.
+Manifests don't have to be sorted: their entries are sorted in runs of RUN_SIZE entries, which are spilled to
+temporary files and merged with k-way merge, so memory used doesn't depend on size of manifests.
+
+Shard manifests begin and end with #shard comments (see hashfile.format_shard), they are used to report
+missing shards, shards given more than once and incomplete shards (calculation was interrupted). Entries for
+the same path and algorithm found more than once are reported and written only once.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import heapq
+import itertools
+import pickle
+import sys
+import tempfile
+
+import hashfile
+
+RUN_SIZE = 100000
+
+
+class _ShardState(object):
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.header = None
+        self.footer = None
+        self.entries = 0
+
+
+def _iter_records(index, manifest, report, shards):
+    """
+    Yield (path, algo, index of manifest, line) for every entry of manifest. Metadata lines (see
+    hashfile.format_meta) are yielded with empty algo, so they are sorted before entries of their file.
+    :param index: index of manifest, entries from earlier manifests win when duplicated
+    :param manifest: path of manifest
+    :param report: function called with description of every problem
+    :param shards: list, _ShardState of manifest is appended to it
+    :return:
+    """
+    state = _ShardState(manifest)
+    meta = None
+    for _, line, exc in hashfile._iter_manifest_lines([manifest]):
+        if exc is not None:
+            report('%s %s' % (manifest, exc))
+            return
+
+        line = line.rstrip('\n').rstrip('\r')
+        if line.startswith(hashfile.SHARD_PREFIX):
+            info = hashfile.parse_shard_line(line)
+            if info is not None and info.entries is None:
+                state.header = info
+            elif info is not None:
+                state.footer = info
+            continue
+        if line.startswith(hashfile.META_PREFIX):
+            meta = line
+            continue
+        if not line.strip() or line.startswith('#'):
+            continue
+
+        try:
+            algo, _, path = hashfile.parse_manifest_line(line)
+        except ValueError:
+            report('%s Incorrect format' % manifest)
+            continue
+
+        state.entries += 1
+        if meta is not None:
+            yield path, '', index, meta
+            meta = None
+        yield path, algo, index, line
+
+    shards.append(state)
+
+
+def _load_run(fh):
+    with fh:
+        while True:
+            try:
+                yield pickle.load(fh)
+            except EOFError:
+                return
+
+
+def _sorted_runs(records, run_size=RUN_SIZE):
+    """
+    Sort records in runs of run_size records, all but the last one are kept in temporary files
+    :param records:
+    :param run_size:
+    :return: iterator of iterators of sorted records
+    """
+    while True:
+        run = sorted(itertools.islice(records, run_size))
+        if len(run) < run_size:
+            yield iter(run)
+            return
+
+        fh = tempfile.TemporaryFile()
+        for record in run:
+            pickle.dump(record, fh, pickle.HIGHEST_PROTOCOL)
+        fh.seek(0)
+        yield _load_run(fh)
+
+
+def _check_shards(shards, report):
+    """
+    Report incomplete shards, missing shards and shards given more than once
+    :param shards: list of _ShardState
+    :param report:
+    :return:
+    """
+    by_index = {}
+    counts = set()
+    for state in shards:
+        if state.header is None:
+            continue
+
+        label = '%d/%d' % (state.header.index, state.header.count)
+        if state.footer is None or state.footer[:2] != state.header[:2]:
+            report('%s incomplete shard %s (no end marker)' % (state.manifest, label))
+        elif state.footer.entries != state.entries:
+            report('%s incomplete shard %s (%d of %d entries)' % (state.manifest, label, state.entries,
+                state.footer.entries))
+        by_index.setdefault(state.header.index, []).append(state.manifest)
+        counts.add(state.header.count)
+
+    if len(counts) > 1:
+        report('shards of different number of shards: %s' % ', '.join(str(count) for count in sorted(counts)))
+    for index in range(1, max(counts) + 1 if counts else 1):
+        manifests = by_index.get(index)
+        if not manifests:
+            report('missing shard %d/%d' % (index, max(counts)))
+        elif len(manifests) > 1:
+            report('shard %d/%d given more than once: %s' % (index, max(counts), ', '.join(manifests)))
+
+
+def merge_manifests(manifests, report, run_size=RUN_SIZE):
+    """
+    Merge manifests into one, sorted by path and algorithm
+    :param manifests: list of paths of manifests
+    :param report: function called with description of every problem (missing, incomplete or duplicated shards,
+        duplicated entries, broken lines)
+    :param run_size: number of entries sorted in memory at once
+    :return: iterator of lines of merged manifest
+    """
+    shards = []
+    records = itertools.chain.from_iterable(_iter_records(index, manifest, report, shards)
+        for index, manifest in enumerate(manifests))
+    # all manifests are read (and runs spilled) before anything is merged
+    runs = list(_sorted_runs(records, run_size))
+    _check_shards(shards, report)
+
+    previous = None
+    for record in heapq.merge(*runs):
+        path, algo, index, line = record
+        if previous is not None and previous[:2] == (path, algo):
+            if algo:
+                report('%s entries for %s (%s) in %s and %s' % (
+                    'duplicated' if line == previous[3] else 'conflicting', path, algo,
+                    manifests[previous[2]], manifests[index]))
+            continue
+
+        previous = record
+        yield line
+
+
+def mode_merge(args):
+    """
+    Merge manifests (args.files) into one, print it to stdout, and problems to stderr
+    :param args:
+    :return: E_FAIL if any problem was found
+    """
+    problems = []
+
+    def _report(problem):
+        problems.append(problem)
+        print('ERROR: %s' % problem, file=sys.stderr)
+
+    for line in merge_manifests(args.files, _report):
+        print(line)
+
+    return hashfile.E_FAIL if problems else hashfile.E_OK
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""
+Manifest of directory kept up to date (--watch DIR --manifest FILE), on Linux. All files are hashed once at
+start, then only files closed after writing or moved into directory (reported by inotify) are hashed again.
+Events for the same file are coalesced: file is hashed when no event for it came for WATCH_DEBOUNCE seconds.
+Manifest is rewritten atomically (every --watch-interval seconds, if anything changed) in the same format as
+written by calculate mode, sorted by path.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import errno
+import fnmatch
+import os
+import select
+import signal
+import struct
+import sys
+
+import hashfile
+
+WATCH_DEBOUNCE = 1.0
+READ_SIZE = 64 * 1024
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+# struct inotify_event: wd, mask, cookie, len, followed by name padded with NUL bytes
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _fsencode(path):
+    return os.fsencode(path) if hashfile.PY3 else path.encode('utf-8')
+
+
+def _fsdecode(path):
+    return os.fsdecode(path) if hashfile.PY3 else path.decode('utf-8')
+
+
+class Inotify(object):
+    """
+    Minimal inotify binding (through ctypes, watched directories only)
+    """
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._ctypes = ctypes
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            init = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not supported by system')
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = init(IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+        # watch descriptor -> path of directory
+        self.paths = {}
+
+    def _raise(self, path=None):
+        err = self._ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path):
+        """
+        Watch directory for events (see WATCH_MASK), adding the same directory again is harmless
+        :param path:
+        :return:
+        """
+        wd = self._add_watch(self.fd, _fsencode(path), WATCH_MASK)
+        if wd < 0:
+            self._raise(path)
+        self.paths[wd] = path
+
+    def read_events(self):
+        """
+        Read pending events, blocks when there are none
+        :return: list of (path of directory or None, mask, name)
+        """
+        data = os.read(self.fd, READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = _fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            events.append((self.paths.get(wd), mask, name))
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ManifestWatcher(object):
+    """
+    Digests of all regular files in directory and its subdirectories, updated on inotify events, and written to
+    manifest
+    """
+    def __init__(self, root, manifest, algos, options, cache=None, exclude=(),
+            interval=hashfile.DEFAULT_WATCH_INTERVAL, debounce=WATCH_DEBOUNCE, jobs=hashfile.DEFAULT_JOBS):
+        """
+        :param root: watched directory
+        :param manifest: path of manifest, it's never hashed even if it's in watched directory
+        :param algos: list of algorithms
+        :param options: dict of options for hashfile.hash_many (see hashfile.HASH_OPTIONS)
+        :param cache: DigestCache or None
+        :param exclude: list of glob patterns, matching files and directories (by name or by path) are skipped
+        :param interval: minimal number of seconds between writes of manifest
+        :param debounce: file is hashed when there was no event for it for this number of seconds
+        :param jobs: number of threads
+        """
+        self.root = root
+        self.manifest = manifest
+        self.algos = algos
+        self.options = options
+        self.cache = cache
+        self.exclude = exclude
+        self.interval = interval
+        self.debounce = debounce
+        self.jobs = jobs
+        self.inotify = Inotify()
+        # path -> HashResults of all algos, path -> time of last event
+        self.entries = {}
+        self.pending = {}
+        self.changed = False
+        self._manifest_path = os.path.abspath(manifest)
+
+    def _excluded(self, path):
+        # manifest and its temporary copies
+        abs_path = os.path.abspath(path)
+        if abs_path == self._manifest_path or abs_path.startswith(self._manifest_path + '.'):
+            return True
+
+        name = os.path.basename(path)
+        for pattern in self.exclude:
+            if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+
+    def scan(self, path, now=0):
+        """
+        Watch directory and its subdirectories, and queue for hashing files changed since they were hashed
+        :param path: directory
+        :param now: time of event, files are queued as changed at this time (0 to hash them as soon as possible)
+        :return:
+        """
+        seen = set()
+        dirs = [path]
+        while dirs:
+            dir_path = dirs.pop()
+            # directory is watched before it's listed, so no file created meanwhile is missed
+            try:
+                self.inotify.add_watch(dir_path)
+                entries = list(hashfile.scandir(dir_path))
+            except OSError as exc:
+                print('ERROR: %s %s' % (dir_path, str(exc)), file=sys.stderr)
+                continue
+
+            for entry in entries:
+                if self._excluded(entry.path):
+                    continue
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                except OSError:
+                    continue
+
+                seen.add(entry.path)
+                results = self.entries.get(entry.path)
+                if not results or not self._unchanged(entry.path, results[0]):
+                    self.pending[entry.path] = now
+
+        self.remove(path, keep=seen)
+
+    @staticmethod
+    def _unchanged(path, result):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return result.size == stat.st_size and result.mtime_ns == hashfile._mtime_ns(stat)
+
+    def remove(self, path, keep=()):
+        """
+        Forget file, or all files in directory
+        :param path:
+        :param keep: paths of files which are not forgotten
+        :return:
+        """
+        prefix = os.path.join(path, '')
+        for known in (self.entries, self.pending):
+            removed = [file_path for file_path in known
+                if (file_path == path or file_path.startswith(prefix)) and file_path not in keep]
+            for file_path in removed:
+                del known[file_path]
+            self.changed |= bool(removed) and known is self.entries
+
+    def handle(self, dir_path, mask, name, now):
+        """
+        Handle single inotify event
+        :param dir_path:
+        :param mask:
+        :param name:
+        :param now: time of event
+        :return:
+        """
+        if mask & IN_Q_OVERFLOW:
+            # some events were lost
+            self.scan(self.root, now)
+            return
+        if dir_path is None or not name:
+            return
+
+        path = os.path.join(dir_path, name)
+        if self._excluded(path):
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.remove(path)
+        elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.scan(path, now)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and not mask & IN_ISDIR:
+            self.pending[path] = now
+
+    def hash_pending(self, now):
+        """
+        Hash files without events for debounce seconds
+        :param now:
+        :return:
+        """
+        ready = sorted(path for path, changed in self.pending.items() if now - changed >= self.debounce)
+        if not ready:
+            return
+
+        for path in ready:
+            del self.pending[path]
+
+        by_path = {}
+        for result in hashfile.hash_many(ready, self.algos, jobs=self.jobs, cache=self.cache, **self.options):
+            by_path.setdefault(result.path, []).append(result)
+
+        for path, results in by_path.items():
+            error = results[0].error
+            if error is None:
+                self.entries[path] = results
+            else:
+                if getattr(error, 'errno', None) != errno.ENOENT:
+                    print('ERROR: %s %s' % (path, str(error)), file=sys.stderr)
+                self.entries.pop(path, None)
+        self.changed = True
+
+    def next_timeout(self, now, next_write):
+        """
+        Number of seconds to wait for events: until first pending file can be hashed, or manifest written
+        :param now:
+        :param next_write: time of next write of manifest
+        :return:
+        """
+        timeout = next_write - now if self.changed else None
+        if self.pending:
+            ready = min(self.pending.values()) + self.debounce - now
+            timeout = ready if timeout is None else min(ready, timeout)
+        return None if timeout is None else max(0, timeout)
+
+    def write(self):
+        """
+        Write manifest atomically
+        :return:
+        """
+        tmp_path = '%s.%d.tmp' % (self.manifest, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            for path in sorted(self.entries):
+                for result in self.entries[path]:
+                    fh.write('%s: %s %s\n' % (result.algo, result.digest, result.path))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp_path, self.manifest)
+        self.changed = False
+
+    def run(self):
+        """
+        Hash all files, then keep manifest up to date until SIGTERM or SIGINT
+        :return:
+        """
+        clock = hashfile._clock
+        self.scan(self.root)
+        self.hash_pending(clock())
+        self.write()
+
+        next_write = clock() + self.interval
+        try:
+            while True:
+                readable, _, _ = select.select([self.inotify], [], [], self.next_timeout(clock(), next_write))
+                now = clock()
+                if readable:
+                    for dir_path, mask, name in self.inotify.read_events():
+                        self.handle(dir_path, mask, name, now)
+
+                self.hash_pending(now)
+                if self.changed and now >= next_write:
+                    self.write()
+                    next_write = now + self.interval
+        finally:
+            if self.changed:
+                self.write()
+            self.inotify.close()
+
+
+def mode_watch(args):
+    """
+    Keep manifest (args.manifest) of directory (args.watch) up to date, until SIGTERM or SIGINT
+    :param args:
+    :return:
+    """
+    if not os.path.isdir(args.watch):
+        print('ERROR: %s is not a directory' % args.watch, file=sys.stderr)
+        return hashfile.E_FAIL
+
+    cache = hashfile._open_cache(args)
+    try:
+        watcher = ManifestWatcher(args.watch, args.manifest, args.all_of or args.algorithm[:1],
+            hashfile._cli_hash_options(args), cache=cache, exclude=args.exclude, interval=args.watch_interval,
+            jobs=args.jobs)
+    except OSError as exc:
+        print('ERROR: %s' % exc, file=sys.stderr)
+        return hashfile.E_FAIL
+
+    def _stop(signum, frame):  # pylint: disable=unused-argument
+        raise SystemExit(hashfile.E_OK)
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        watcher.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if cache is not None:
+            cache.close()
+
+    return hashfile.E_OK
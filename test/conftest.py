@@ -0,0 +1,6 @@
+# asyncio front-end (and syntax of its tests) requires Python 3.7+
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_aio.py')
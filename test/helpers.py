@@ -14,7 +14,7 @@ ProcResult = collections.namedtuple('ProcResult', ['code', 'stdout', 'stderr'])
 
 def call_hashfile(*args, **kwargs):
     cmd = list(args)
-    cmd.insert(0, 'hashfile')
+    cmd.insert(0, kwargs.get('program', 'hashfile'))
 
     stdin = kwargs.get('stdin', None)
     if stdin is not None:
@@ -34,7 +34,7 @@ def call_hashfile(*args, **kwargs):
 
 
 def create_calculate_file(data):
-    if data:
+    if hasattr(data, 'encode'):
         data = data.encode()
 
     with tempfile.NamedTemporaryFile(delete=False) as fh:
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+import asyncio
+import hashlib
+import zlib
+
+import hashfile
+from helpers import *
+
+
+def test_async_hashing():
+    data_file = create_calculate_file('asds')
+
+    async def _stream():
+        yield b'as'
+        yield b'ds' * 100000
+
+    async def _run():
+        digest = await hashfile.ahash_file(data_file, 'sha256')
+        results = [result async for result in hashfile.ahash_many([data_file, '/not/exists'], ['md5'], concurrency=1)]
+        hasher = await hashfile.AsyncHasher(['sha1', 'crc32']).consume(_stream())
+        return digest, results, hasher.hexdigests()
+
+    loop = asyncio.new_event_loop()
+    try:
+        digest, results, hexdigests = loop.run_until_complete(_run())
+    finally:
+        loop.close()
+    safe_unlink(data_file)
+
+    assert digest == hashlib.sha256(b'asds').hexdigest()
+    assert results[0] == hashfile.HashResult(data_file, 'md5', hashlib.md5(b'asds').hexdigest(), 4, None)
+    assert results[1].path == '/not/exists' and results[1].error is not None
+    assert hexdigests == {
+        'sha1': hashlib.sha1(b'as' + b'ds' * 100000).hexdigest(),
+        'crc32': '%x' % (zlib.crc32(b'as' + b'ds' * 100000) & 0xffffffff),
+    }
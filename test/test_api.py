@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+import hashlib
+import io
+import os
+import tarfile
+import zlib
+
+import hashfile
+from helpers import *
+
+
+def test_hash_many():
+    data_file1 = create_calculate_file('asds')
+    data_file2 = create_calculate_file('asqwe')
+    results = list(hashfile.hash_many([data_file1, '/not/exists', (data_file2, ['md5'])], ['sha256', 'crc32'], jobs=2))
+    safe_unlink(data_file1)
+    safe_unlink(data_file2)
+
+    assert results[:2] == [
+        hashfile.HashResult(data_file1, 'sha256', hashlib.sha256(b'asds').hexdigest(), 4, None),
+        hashfile.HashResult(data_file1, 'crc32', '%x' % (zlib.crc32(b'asds') & 0xffffffff), 4, None),
+    ]
+    assert [(result.path, result.algo, result.digest) for result in results[2:4]] == [
+        ('/not/exists', 'sha256', None), ('/not/exists', 'crc32', None)]
+    assert isinstance(results[2].error, OSError)
+    assert results[2].error is results[3].error
+    assert results[4:] == [hashfile.HashResult(data_file2, 'md5', hashlib.md5(b'asqwe').hexdigest(), 5, None)]
+
+
+def test_verify_manifest():
+    check_file, data_files = create_check_file({'aaa1': 'sha1', 'bbb1': '!sha1:invalid-checksum'})
+    with open(check_file, 'a') as fh:
+        fh.write('broken line\n')
+
+    results = list(hashfile.verify_manifest([check_file, '/not/exists'], jobs=2))
+
+    assert [(result.path, result.status) for result in results] == [
+        (data_files[0], hashfile.CHECK_OK),
+        (data_files[1], hashfile.CHECK_FAILED),
+        (None, hashfile.CHECK_FORMAT_ERROR),
+        (None, hashfile.CHECK_MANIFEST_ERROR),
+    ]
+    assert results[0].digest == hashlib.sha1(b'aaa1').hexdigest()
+    assert results[1].expected == 'invalid-checksum'
+    assert results[3].manifest == '/not/exists'
+
+
+def test_parse_manifest_line():
+    digest = hashlib.sha256(b'').hexdigest()
+
+    assert hashfile.parse_manifest_line('sha1: abc a file') == ('sha1', 'abc', 'a file')
+    assert hashfile.parse_manifest_line('%s  a file' % digest) == ('sha256', digest, 'a file')
+    assert hashfile.parse_manifest_line('%s *a file' % digest, 'md5') == ('md5', digest, 'a file')
+    assert hashfile.parse_manifest_line('\\%s  a\\nb\\\\c' % digest) == ('sha256', digest, 'a\nb\\c')
+    assert hashfile.parse_manifest_line('SHA256 (a (1)) = %s' % digest) == ('sha256', digest, 'a (1)')
+    assert hashfile.parse_manifest_line('SHA3-256(a)= %s' % digest) == ('sha3_256', digest, 'a')
+    for line in ('broken line', '%s a' % digest, 'abc  a'):
+        try:
+            hashfile.parse_manifest_line(line)
+        except ValueError:
+            pass
+        else:
+            assert False, line
+
+
+def test_verify_archive_members_streaming():
+    from hashfile import archive
+
+    tar_file = create_calculate_file(b'')
+    members = [('m%d' % i, ('data %d' % i).encode()) for i in range(5)]
+    with tarfile.open(tar_file, 'w') as fh:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            fh.addfile(info, io.BytesIO(data))
+
+    read = []
+
+    def _entries():
+        for name, data in members:
+            read.append(name)
+            yield hashfile.CheckResult('manifest', archive.member_path(tar_file, name), 'sha1',
+                hashlib.sha1(data).hexdigest(), None, None, None, None, None)
+
+    results = archive.verify_members(tar_file, _entries(), hashfile._hash_options({}))
+    first = next(results)
+    read_before_first = len(read)
+    results = [first] + list(results)
+    safe_unlink(tar_file)
+
+    # entries are read only as far as needed to find member reached by pass over archive (and one more, to
+    # find all consecutive entries for it)
+    assert read_before_first == 2
+    assert [(result.path, result.status) for result in results] == [
+        (archive.member_path(tar_file, name), hashfile.CHECK_OK) for name, _ in members]
+
+
+def test_checkpoint_saves_failures_with_position():
+    check_file = create_calculate_file('')
+    checkpoint_file = create_calculate_file('')
+    checkpoint = hashfile.Checkpoint(checkpoint_file, [check_file])
+    checkpoint.advance(1, hashfile.E_OK)
+    checkpoint.advance(3, hashfile.E_FAIL, [(False, 'a: FAILED'), (True, 'ERROR: b')])
+    checkpoint.save()
+    loaded = hashfile.Checkpoint(checkpoint_file, [check_file])
+    loaded.load()
+    safe_unlink(check_file)
+    safe_unlink(checkpoint_file)
+
+    assert (loaded.position, loaded.exit_code) == (3, hashfile.E_FAIL)
+    assert loaded.failures == [[False, 'a: FAILED'], [True, 'ERROR: b']]
+
+
+def test_split_files_share_range_threads():
+    import threading
+
+    contents = [os.urandom(10000 + i) for i in range(6)]
+    data_files = [create_calculate_file(content) for content in contents]
+    threads = set()
+    checksum_range = hashfile._checksum_range
+
+    def _checksum_range(*args):
+        threads.add(threading.current_thread().ident)
+        return checksum_range(*args)
+
+    hashfile._checksum_range = _checksum_range
+    try:
+        results = list(hashfile.hash_many(data_files, ['crc32'], jobs=3, split_threshold=1, max_input_read=1000))
+    finally:
+        hashfile._checksum_range = checksum_range
+    for data_file in data_files:
+        safe_unlink(data_file)
+
+    assert [result.digest for result in results] == ['%x' % (zlib.crc32(content) & 0xffffffff) for content in contents]
+    # parts of files are read by one pool of threads, not by pool for every file
+    assert 1 <= len(threads) <= 3
+
+
+def test_tree_leaves_share_range_threads():
+    import threading
+
+    contents = [os.urandom(5000 + i) for i in range(6)] + [b'small']
+    data_files = [create_calculate_file(content) for content in contents]
+    threads = set()
+    read_tree_leaves = hashfile._read_tree_leaves
+
+    def _read_tree_leaves(*args):
+        threads.add(threading.current_thread().ident)
+        return read_tree_leaves(*args)
+
+    hashfile._read_tree_leaves = _read_tree_leaves
+    try:
+        results = list(hashfile.hash_many(data_files[:-1], ['tree-sha256@1024'], jobs=3))
+        threads_before_small = set(threads)
+        threads.clear()
+        small = hashfile.tree_leaves(data_files[-1], 'tree-sha256@1024', jobs=3)
+    finally:
+        hashfile._read_tree_leaves = read_tree_leaves
+    for data_file in data_files:
+        safe_unlink(data_file)
+
+    assert [result.error for result in results] == [None] * (len(contents) - 1)
+    assert 1 <= len(threads_before_small) <= 3
+    # single leaf is read in current thread
+    assert threads == {threading.current_thread().ident}
+    assert small == [hashlib.sha256(b'\x00small').digest()]
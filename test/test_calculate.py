@@ -1,7 +1,15 @@
 #!/usr/bin/env python
 
+import hashlib
+import json
 import os
 import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import zlib
 
 from helpers import *
 
@@ -142,3 +150,326 @@ def test_unallowed_arguments():
         assert ret.code == 2
         assert ret.stdout == ''
         assert re.match(r'^usage: ', ret.stderr)
+
+
+def test_many_files_parallel_keeps_order():
+    contents = ['file-%d' % i for i in range(20)]
+    data_files = [create_calculate_file(content) for content in contents]
+    ret = call_hashfile('-j', '4', '-a', 'md5', *data_files)
+    for data_file in data_files:
+        safe_unlink(data_file)
+
+    assert ret.code == 0
+    assert ret.stdout == ''.join('md5: %s %s\n' % (hashlib.md5(content.encode()).hexdigest(), data_file)
+        for content, data_file in zip(contents, data_files))
+    assert ret.stderr == ''
+
+
+def test_invalid_jobs():
+    ret = call_hashfile('-j', '0', stdin='asd')
+
+    assert ret.code == 2
+    assert ret.stdout == ''
+    assert re.match(r'^usage: ', ret.stderr)
+
+
+def test_all_of_reads_once_prints_every_algo():
+    data_file1 = create_calculate_file('asds')
+    data_file2 = create_calculate_file('asqwe')
+    ret = call_hashfile('--all-of', 'sha256,md5,crc32', data_file1, data_file2)
+    safe_unlink(data_file1)
+    safe_unlink(data_file2)
+
+    expected = ''
+    for content, data_file in ((b'asds', data_file1), (b'asqwe', data_file2)):
+        expected += 'sha256: %s %s\n' % (hashlib.sha256(content).hexdigest(), data_file)
+        expected += 'md5: %s %s\n' % (hashlib.md5(content).hexdigest(), data_file)
+        expected += 'crc32: %x %s\n' % (zlib.crc32(content) & 0xffffffff, data_file)
+
+    assert ret.code == 0
+    assert ret.stdout == expected
+    assert ret.stderr == ''
+
+
+def test_all_of_unknown_algo():
+    ret = call_hashfile('--all-of', 'sha1,nope', stdin='asd')
+
+    assert ret.code == 2
+    assert ret.stdout == ''
+    assert re.match(r'^usage: ', ret.stderr)
+
+
+def test_mmap_same_as_read():
+    data_file1 = create_calculate_file('asds' * 1000)
+    data_file2 = create_calculate_file('')
+    ret_read = call_hashfile('--max-input-read', '1000', '--all-of', 'sha256,adler32', data_file1, data_file2)
+    ret_mmap = call_hashfile('--mmap', '--max-input-read', '1000', '--all-of', 'sha256,adler32', data_file1, data_file2)
+    safe_unlink(data_file1)
+    safe_unlink(data_file2)
+
+    assert ret_mmap.code == 0
+    assert ret_mmap.stdout == ret_read.stdout
+    assert re.match(r'^sha256: %s %s\n' % (hashlib.sha256(b'asds' * 1000).hexdigest(), re.escape(data_file1)),
+        ret_mmap.stdout)
+    assert ret_mmap.stderr == ''
+
+
+def test_mmap_stdin():
+    ret = call_hashfile('--mmap', stdin='asd')
+
+    assert ret.code == 0
+    assert ret.stdout == 'sha1: f10e2821bbbea527ea02200352313bc059445190 -\n'
+    assert ret.stderr == ''
+
+
+def test_cache_used_and_refreshed():
+    cache_file = create_calculate_file('')
+    safe_unlink(cache_file)
+    data_file = create_calculate_file('asds')
+    os.utime(data_file, (1000000000, 1000000000))
+    ret1 = call_hashfile('--cache', '--cache-file', cache_file, '-a', 'sha256', data_file)
+
+    # same size and mtime, so cached digest is used
+    with open(data_file, 'wb') as fh:
+        fh.write(b'xxxx')
+    os.utime(data_file, (1000000000, 1000000000))
+    ret2 = call_hashfile('--cache', '--cache-file', cache_file, '-a', 'sha256', data_file)
+    ret3 = call_hashfile('--refresh-cache', '--cache-file', cache_file, '-a', 'sha256', data_file)
+    ret4 = call_hashfile('--no-cache', '--cache-file', cache_file, '-a', 'sha256', data_file)
+    safe_unlink(data_file)
+    safe_unlink(cache_file)
+
+    assert ret1.code == 0
+    assert ret1.stdout == 'sha256: %s %s\n' % (hashlib.sha256(b'asds').hexdigest(), data_file)
+    assert ret2.stdout == ret1.stdout
+    assert ret3.stdout == 'sha256: %s %s\n' % (hashlib.sha256(b'xxxx').hexdigest(), data_file)
+    assert ret4.stdout == ret3.stdout
+    assert ret2.stderr == ret3.stderr == ''
+
+
+def test_cache_shared_by_processes_and_only_regular_files():
+    root = tempfile.mkdtemp()
+    cache_file = os.path.join(root, 'cache.sqlite')
+    fifo = os.path.join(root, 'fifo')
+    os.mkfifo(fifo)
+    data_file = create_calculate_file('asds')
+    os.utime(data_file, (1000000000, 1000000000))
+
+    # first process waits for data from fifo after caching digest of data_file
+    blocked = subprocess.Popen(['hashfile', '--cache', '--cache-file', cache_file, '-j', '1', data_file, fifo],
+        stdout=subprocess.PIPE)
+    try:
+        for _ in range(100):
+            if os.path.exists(cache_file):
+                break
+            time.sleep(0.05)
+        time.sleep(0.2)
+        ret = call_hashfile('--cache', '--cache-file', cache_file, data_file)
+    finally:
+        with open(fifo, 'w') as fh:
+            fh.write('asd')
+        blocked_stdout = blocked.communicate()[0].decode('utf-8')
+    ret_device = call_hashfile('--cache', '--cache-file', cache_file, os.devnull)
+
+    with sqlite3.connect(cache_file) as db:
+        cached = sorted(row[0] for row in db.execute('SELECT algo FROM digests'))
+    safe_unlink(data_file)
+    shutil.rmtree(root)
+
+    assert ret.code == 0
+    assert ret.stdout == 'sha1: %s %s\n' % (hashlib.sha1(b'asds').hexdigest(), data_file)
+    assert ret.stderr == ''
+    assert blocked_stdout == ret.stdout + 'sha1: %s %s\n' % (hashlib.sha1(b'asd').hexdigest(), fifo)
+    assert ret_device.stdout == 'sha1: %s %s\n' % (hashlib.sha1(b'').hexdigest(), os.devnull)
+    # only digest of regular file is cached
+    assert cached == ['sha1']
+
+
+def test_recursive_sorted_with_exclude():
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, 'b', 'c'))
+    contents = {'a': 'asds', os.path.join('b', 'c', 'd'): 'asqwe', os.path.join('b', 'e'): '111ss', 'f.log': 'x'}
+    for name, content in contents.items():
+        with open(os.path.join(root, name), 'w') as fh:
+            fh.write(content)
+    os.symlink(os.path.join(root, 'a'), os.path.join(root, 'link'))
+
+    ret = call_hashfile('-r', '--sort', '--exclude', '*.log', '-a', 'md5', root)
+    ret_follow = call_hashfile('-r', '--sort', '-L', '--exclude', '*.log', '-a', 'md5', root)
+    shutil.rmtree(root)
+
+    expected = ''.join('md5: %s %s\n' % (hashlib.md5(contents[name].encode()).hexdigest(), os.path.join(root, name))
+        for name in ('a', os.path.join('b', 'c', 'd'), os.path.join('b', 'e')))
+    assert ret.code == 0
+    assert ret.stdout == expected
+    assert ret.stderr == ''
+    assert ret_follow.stdout == expected + 'md5: %s %s\n' % (hashlib.md5(b'asds').hexdigest(),
+        os.path.join(root, 'link'))
+
+
+def test_recursive_options_require_recursive():
+    ret = call_hashfile('--sort', stdin='asd')
+
+    assert ret.code == 2
+    assert ret.stdout == ''
+    assert re.match(r'^usage: ', ret.stderr)
+
+
+def test_checksums_every_read_path():
+    # chunks are views of reused buffers, zlib of Python 2 doesn't accept them as they are
+    content = b'asds' * 1000
+    data_file = create_calculate_file(content)
+    expected = 'crc32: %x %s\nadler32: %x %s\n' % (zlib.crc32(content) & 0xffffffff, data_file,
+        zlib.adler32(content, 0) & 0xffffffff, data_file)
+    rets = [call_hashfile('--max-input-read', '1000', '--all-of', 'crc32,adler32', data_file, *options)
+        for options in ([], ['--mmap'], ['--readahead', '2'], ['--no-cache-pollution'], ['--direct'])]
+    safe_unlink(data_file)
+
+    for ret in rets:
+        assert ret.code == 0
+        assert ret.stdout == expected
+        assert ret.stderr == ''
+
+
+def test_split_checksums_identical():
+    content = os.urandom(100003)
+    data_file = tempfile.NamedTemporaryFile(delete=False)
+    data_file.write(content)
+    data_file.close()
+    ret_crc32 = call_hashfile('-j', '3', '--split-threshold', '1', '--max-input-read', '1000', '-a', 'crc32',
+        data_file.name)
+    ret_adler32 = call_hashfile('-j', '3', '--split-threshold', '1', '--max-input-read', '1000', '-a', 'adler32',
+        data_file.name)
+    safe_unlink(data_file.name)
+
+    assert ret_crc32.code == 0
+    assert ret_crc32.stdout == 'crc32: %x %s\n' % (zlib.crc32(content) & 0xffffffff, data_file.name)
+    assert ret_adler32.code == 0
+    assert ret_adler32.stdout == 'adler32: %x %s\n' % (zlib.adler32(content, 0) & 0xffffffff, data_file.name)
+
+
+def test_readahead_stdin():
+    ret = call_hashfile('--readahead', '2', '--max-input-read', '2', '--all-of', 'sha1,crc32', stdin='asd')
+
+    assert ret.code == 0
+    assert ret.stdout == 'sha1: f10e2821bbbea527ea02200352313bc059445190 -\ncrc32: %x -\n' % (
+        zlib.crc32(b'asd') & 0xffffffff)
+    assert ret.stderr == ''
+
+
+def test_stats():
+    ret = call_hashfile('--stats', '--all-of', 'md5,sha1', stdin='asd')
+    ret_json = call_hashfile('--stats', 'json', '-a', 'md5', stdin='asd')
+
+    assert ret.code == 0
+    assert ret.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e -\nsha1: f10e2821bbbea527ea02200352313bc059445190 -\n'
+    assert re.match(r'^stats: 1 files \(0 failed, 0 cached\)', ret.stderr)
+    assert 'stats: md5: 1 files' in ret.stderr
+    assert ret_json.code == 0
+    file_stats, summary = [json.loads(line) for line in ret_json.stderr.splitlines()]
+    assert file_stats['path'] == '-'
+    assert file_stats['bytes'] == 3
+    assert summary['summary']['algorithms']['md5']['files'] == 1
+
+
+def test_algo_symlink_fast_path():
+    root = tempfile.mkdtemp()
+    program = os.path.join(root, 'md5')
+    os.symlink(shutil.which('hashfile'), program)
+    data_file = create_calculate_file('asd')
+    ret = call_hashfile(data_file, program=program)
+    ret_stdin = call_hashfile(program=program, stdin='asd')
+    ret_missing = call_hashfile(os.path.join(root, 'missing'), program=program)
+    ret_options = call_hashfile('--all-of', 'md5,crc32', data_file, program=program)
+    safe_unlink(data_file)
+    shutil.rmtree(root)
+
+    assert ret.code == 0
+    assert ret.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e %s\n' % data_file
+    assert ret_stdin.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e -\n'
+    assert ret_missing.code == 0
+    assert ret_missing.stdout == ''
+    assert ret_missing.stderr.startswith('ERROR: %s ' % os.path.join(root, 'missing'))
+    assert ret_options.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e %s\ncrc32: %x %s\n' % (
+        data_file, zlib.crc32(b'asd') & 0xffffffff, data_file)
+
+
+def test_schedule_keeps_order():
+    data_files = [create_calculate_file('file %d' % i) for i in range(20)]
+    ret = call_hashfile('-a', 'md5', *data_files)
+    ret_inode = call_hashfile('-a', 'md5', '--schedule', 'inode', '--schedule-window', '7', *data_files)
+    ret_extent = call_hashfile('-a', 'md5', '--schedule', 'extent', '-j', '3', *(data_files + ['/not/exists']))
+    for data_file in data_files:
+        safe_unlink(data_file)
+
+    assert ret.code == 0
+    assert ret_inode.stdout == ret.stdout
+    assert ret_extent.stdout == ret.stdout
+    assert ret_extent.stderr.startswith('ERROR: /not/exists ')
+
+
+def test_page_cache_modes_keep_digests():
+    content = os.urandom(100003)
+    data_file = create_calculate_file(content)
+    expected = 'sha1: %s %s\ncrc32: %x %s\n' % (hashlib.sha1(content).hexdigest(), data_file,
+        zlib.crc32(content) & 0xffffffff, data_file)
+    rets = [call_hashfile(option, '--max-input-read', '10000', '--all-of', 'sha1,crc32', data_file)
+        for option in ('--no-cache-pollution', '--direct')]
+    rets.append(call_hashfile('--direct', '--readahead', '2', '--all-of', 'sha1,crc32', data_file))
+    safe_unlink(data_file)
+
+    for ret in rets:
+        assert ret.code == 0
+        assert ret.stdout == expected
+        assert ret.stderr == ''
+
+
+def test_quick_fingerprint():
+    small_file = create_calculate_file('asd')
+    content = os.urandom(3 * 1024**2 + 5)
+    big_file = create_calculate_file(content)
+    ret = call_hashfile('--quick', small_file)
+    ret_big = call_hashfile('-a', 'quick-md5', '--quick-samples', '2', big_file)
+    # file not bigger than all sampled blocks is hashed whole, read in chunks
+    ret_whole = call_hashfile('-a', 'quick-sha1', '--quick-samples', '100', '--max-input-read', '1000', big_file)
+    safe_unlink(small_file)
+    safe_unlink(big_file)
+
+    # size, head, two evenly spaced blocks (aligned to 4KiB) and tail
+    size = len(content)
+    last = size - 65536
+    expected = hashlib.md5(b'%d\n' % size)
+    for offset in (0, last // 3 // 4096 * 4096, last * 2 // 3 // 4096 * 4096, last):
+        expected.update(content[offset:offset + 65536])
+
+    assert ret.code == 0
+    assert ret.stdout == 'quick-sha1: %s %s\n' % (hashlib.sha1(b'3\nasd').hexdigest(), small_file)
+    assert ret_big.stdout == 'quick-md5@2: %s %s\n' % (expected.hexdigest(), big_file)
+    assert ret_whole.stdout == 'quick-sha1@100: %s %s\n' % (hashlib.sha1(b'%d\n' % size + content).hexdigest(),
+        big_file)
+
+
+def test_shard_and_merge():
+    data_files = [create_calculate_file('file %d' % i) for i in range(20)]
+    ret = call_hashfile('-a', 'md5', *data_files)
+    shards = [call_hashfile('-a', 'md5', '--shard', '%d/3' % i, *data_files) for i in (1, 2, 3)]
+    shard_files = [create_calculate_file(shard.stdout) for shard in shards]
+    ret_merge = call_hashfile('--merge', *reversed(shard_files))
+    ret_missing = call_hashfile('--merge', shard_files[0], shard_files[0])
+    for path in data_files + shard_files:
+        safe_unlink(path)
+
+    entries = [[line for line in shard.stdout.splitlines() if not line.startswith('#')] for shard in shards]
+    assert sorted(sum(entries, [])) == sorted(ret.stdout.splitlines())
+    for i, shard in enumerate(shards):
+        lines = shard.stdout.splitlines()
+        assert lines[0] == '#shard %d/3' % (i + 1)
+        assert lines[-1] == '#shard %d/3 entries=%d' % (i + 1, len(entries[i]))
+
+    assert ret_merge.code == 0
+    assert ret_merge.stderr == ''
+    assert ret_merge.stdout.splitlines() == sorted(ret.stdout.splitlines(), key=lambda line: line.split(' ', 2)[2])
+    assert ret_missing.code == 1
+    assert 'ERROR: shard 1/3 given more than once' in ret_missing.stderr
+    assert 'ERROR: missing shard 2/3' in ret_missing.stderr
+    assert 'ERROR: duplicated entries for ' in ret_missing.stderr
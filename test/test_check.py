@@ -1,6 +1,16 @@
 #!/usr/bin/env python
 
+import hashlib
+import io
+import json
+import os
 import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import zipfile
 
 from helpers import *
 
@@ -92,3 +102,312 @@ def test_file_existent_mixed():
     assert ret.code == 2
     assert re.match(r'^/not/exists: cannot open (.*)\n%s: OK\n%s: OK' % (data_files[0], data_files[1]), ret.stdout)
     assert ret.stderr == ''
+
+
+def test_many_files_parallel_keeps_order():
+    data = dict(('value-%02d' % i, 'sha1' if i % 3 else '!sha1:invalid-checksum') for i in range(20))
+    check_file, data_files = create_check_file(data)
+
+    ret = call_hashfile('-j', '4', '-c', check_file)
+
+    assert ret.code == 0
+    assert ret.stdout == ''.join('%s: %s\n' % (data_file, 'OK' if i % 3 else 'FAILED')
+        for i, data_file in enumerate(data_files))
+    assert ret.stderr == ''
+
+
+def test_status_stops_on_first_failure():
+    check_file, data_files = create_check_file({'aaa1': 'sha1', 'bbb1': '!sha1:invalid-checksum', 'ccc1': 'sha1'})
+
+    ret = call_hashfile('-j', '2', '-c', '--status', check_file)
+
+    assert ret.code == 1
+    assert ret.stdout == ''
+    assert ret.stderr == ''
+
+
+def test_status_valid():
+    check_file, data_files = create_check_file({'aaa1': 'sha1', 'bbb1': 'sha1'})
+
+    ret = call_hashfile('-j', '2', '-c', '--status', check_file)
+
+    assert ret.code == 0
+    assert ret.stdout == ''
+    assert ret.stderr == ''
+
+
+def test_tree_hash_reports_damaged_ranges():
+    data_file = create_calculate_file('a' * 10000)
+    ret_calculate = call_hashfile('-a', 'tree-sha256', '--leaf-size', '1000', '--tree-sidecar', data_file)
+    check_file = create_calculate_file(ret_calculate.stdout)
+    ret_valid = call_hashfile('-c', check_file)
+    with open(data_file, 'r+b') as fh:
+        fh.seek(2500)
+        fh.write(b'b')
+        fh.seek(3999)
+        fh.write(b'b')
+    ret_invalid = call_hashfile('-c', check_file)
+    ret_range_valid = call_hashfile('-c', '--verify-range', '5000-9999', check_file)
+    ret_range_invalid = call_hashfile('-c', '--verify-range', '0-2999', check_file)
+    safe_unlink(data_file)
+    safe_unlink(data_file + '.tree-sha256.leaves')
+    safe_unlink(check_file)
+
+    assert ret_calculate.code == 0
+    assert ret_calculate.stdout.startswith('tree-sha256@1000: ')
+    assert ret_valid.stdout == '%s: OK\n' % data_file
+    assert ret_invalid.code == 0
+    assert ret_invalid.stdout == '%s: FAILED (bytes 2000-3999 differ)\n' % data_file
+    assert ret_range_valid.stdout == '%s: OK\n' % data_file
+    assert ret_range_invalid.stdout == '%s: FAILED (bytes 2000-2999 differ)\n' % data_file
+
+
+def test_gnu_and_bsd_formats():
+    data_file = create_calculate_file('a b')
+    sha256 = hashlib.sha256(b'a b').hexdigest()
+    md5 = hashlib.md5(b'a b').hexdigest()
+    check_file = create_calculate_file('%s  %s\nMD5 (%s) = %s\n%s *%s\n' % (sha256, data_file, data_file, md5,
+        md5.replace(md5[0], 'x' if md5[0] != 'x' else 'y', 1), data_file))
+    ret = call_hashfile('-c', '--warn', check_file)
+    safe_unlink(check_file)
+    safe_unlink(data_file)
+
+    assert ret.code == 0
+    assert ret.stdout == '%s: OK\n%s: OK\n' % (data_file, data_file)
+    assert ret.stderr == 'ERROR: %s Incorrect format\n' % check_file
+
+
+def test_names_with_spaces_and_many_algorithms():
+    data_file = create_calculate_file('asd')
+    os.rename(data_file, data_file + ' a b')
+    data_file += ' a b'
+    ret_calculate = call_hashfile('--all-of', 'md5,sha1,crc32', data_file)
+    check_file = create_calculate_file(ret_calculate.stdout)
+    ret = call_hashfile('-c', check_file, '--stats')
+    safe_unlink(check_file)
+    safe_unlink(data_file)
+
+    assert ret.code == 0
+    assert ret.stdout == '%s: OK\n' % data_file * 3
+    # file is read only once for all algorithms
+    assert 'stats: 1 files' in ret.stderr
+
+
+def test_quick_fingerprint_check():
+    data_file = create_calculate_file(b'a' * 2 * 1024**2)
+    check_file = create_calculate_file(call_hashfile('--quick', data_file).stdout)
+    ret_valid = call_hashfile('-c', check_file)
+    with open(data_file, 'r+b') as fh:
+        fh.write(b'b')
+    ret_invalid = call_hashfile('-c', check_file)
+    safe_unlink(data_file)
+    safe_unlink(check_file)
+
+    assert ret_valid.stdout == '%s: OK\n' % data_file
+    assert ret_invalid.stdout == '%s: FAILED\n' % data_file
+
+
+def test_changed_only():
+    data_file = create_calculate_file('asd')
+    # files modified recently are not stamped, so set modification time in the past
+    os.utime(data_file, (time.time() - 3600, time.time() - 3600))
+    ret_calculate = call_hashfile('--stamp', data_file)
+    check_file = create_calculate_file(ret_calculate.stdout)
+    ret_cached = call_hashfile('-c', '--changed-only', check_file)
+    ret_plain = call_hashfile('-c', check_file)
+    with open(data_file, 'w') as fh:
+        fh.write('qwe')
+    os.utime(data_file, (time.time() - 3600, time.time() - 3600))
+    ret_changed = call_hashfile('-c', '--changed-only', check_file)
+    safe_unlink(data_file)
+    safe_unlink(check_file)
+
+    assert ret_calculate.stdout.startswith('#meta size=3 mtime_ns=')
+    assert ret_cached.stdout == '%s: OK (cached)\n' % data_file
+    assert ret_plain.stdout == '%s: OK\n' % data_file
+    assert ret_changed.code == 0
+    assert ret_changed.stdout == '%s: FAILED\n' % data_file
+
+
+def test_checkpoint_resume():
+    data_files = [create_calculate_file(data) for data in ('asd', 'qwe', 'zxc')]
+    check_file = create_calculate_file(call_hashfile(*data_files).stdout.replace(
+        hashlib.sha1(b'qwe').hexdigest(), hashlib.sha1(b'xxx').hexdigest()))
+    checkpoint = check_file + '.checkpoint'
+    ret_first = call_hashfile('-c', '--quiet', '--checkpoint', checkpoint, check_file)
+    ret_complete = call_hashfile('-c', '--quiet', '--checkpoint', checkpoint, '--resume', check_file)
+
+    # interrupted after second file
+    with open(checkpoint) as fh:
+        saved = json.load(fh)
+    saved.update(position=2, complete=False, exit_code=1)
+    with open(checkpoint, 'w') as fh:
+        json.dump(saved, fh)
+    os.unlink(data_files[0])
+    ret_resumed = call_hashfile('-c', '--quiet', '--checkpoint', checkpoint, '--resume', check_file)
+
+    with open(check_file, 'a') as fh:
+        fh.write('\n')
+    ret_modified = call_hashfile('-c', '--checkpoint', checkpoint, '--resume', check_file)
+    for path in data_files + [check_file, checkpoint]:
+        safe_unlink(path)
+
+    failed = '%s: FAILED\n' % data_files[1]
+    assert (ret_first.code, ret_first.stdout) == (1, failed)
+    assert (ret_complete.code, ret_complete.stdout) == (1, failed)
+    assert (ret_resumed.code, ret_resumed.stdout, ret_resumed.stderr) == (1, failed, '')
+    assert ret_modified.code == 1
+    assert 'checkpoint was saved for other manifests' in ret_modified.stderr
+
+
+def test_archive_members():
+    members = {'a': b'asd', 'dir/b': b'qwe'}
+    tar_file = create_calculate_file(b'')
+    with tarfile.open(tar_file, 'w:gz') as archive:
+        for name, data in sorted(members.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    zip_file = create_calculate_file(b'')
+    with zipfile.ZipFile(zip_file, 'w') as archive:
+        for name, data in sorted(members.items()):
+            archive.writestr(name, data)
+
+    ret_calculate = call_hashfile('--archive', '--all-of', 'md5,sha1', tar_file, zip_file)
+    check_file = create_calculate_file(ret_calculate.stdout.replace(hashlib.sha1(b'qwe').hexdigest(),
+        hashlib.sha1(b'xxx').hexdigest()) + 'md5: %s %s!missing\n' % (hashlib.md5(b'').hexdigest(), tar_file))
+    ret = call_hashfile('-c', check_file)
+    for path in (tar_file, zip_file, check_file):
+        safe_unlink(path)
+
+    expected = ''
+    for archive_file in (tar_file, zip_file):
+        for name, data in sorted(members.items()):
+            expected += 'md5: %s %s!%s\n' % (hashlib.md5(data).hexdigest(), archive_file, name)
+            expected += 'sha1: %s %s!%s\n' % (hashlib.sha1(data).hexdigest(), archive_file, name)
+    assert ret_calculate.stdout == expected
+    assert ret.stdout == ''.join('%s!%s: %s\n' % (archive_file, name, status) for archive_file in (tar_file, zip_file)
+        for name, status in (('a', 'OK'), ('a', 'OK'), ('dir/b', 'OK'), ('dir/b', 'FAILED')))
+    assert ret.stderr == 'ERROR: %s!missing [Errno 2] No such member in archive\n' % tar_file
+
+
+def test_checkpoint_sigterm_and_resume():
+    root = tempfile.mkdtemp()
+    paths = [os.path.join(root, name) for name in ('a', 'b', 'fifo', 'c')]
+    for path in paths:
+        if path.endswith('fifo'):
+            os.mkfifo(path)
+        else:
+            with open(path, 'w') as fh:
+                fh.write(path)
+    check_file = os.path.join(root, 'manifest')
+    with open(check_file, 'w') as fh:
+        for path in paths:
+            fh.write('sha1: %s %s\n' % (hashlib.sha1(path.encode()).hexdigest(), path))
+    checkpoint = os.path.join(root, 'checkpoint')
+
+    # reading from fifo never ends, so verification is stopped in the middle
+    proc = subprocess.Popen(['hashfile', '-c', '-j', '2', '--checkpoint', checkpoint, '--resume', check_file],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    time.sleep(1)
+    started = time.time()
+    proc.terminate()
+    stdout, stderr = proc.communicate()
+    stopped_after = time.time() - started
+    with open(checkpoint) as fh:
+        saved = json.load(fh)
+
+    os.unlink(paths[2])
+    with open(paths[2], 'w') as fh:
+        fh.write(paths[2])
+    ret_resumed = call_hashfile('-c', '--checkpoint', checkpoint, '--resume', check_file)
+    shutil.rmtree(root)
+
+    assert stopped_after < 5
+    assert proc.returncode == 1
+    assert stdout.decode('utf-8') == '%s: OK\n%s: OK\n' % (paths[0], paths[1])
+    assert saved['position'] == 2 and not saved['complete']
+    assert ret_resumed.code == 0
+    assert ret_resumed.stdout == '%s: OK\n%s: OK\n' % (paths[2], paths[3])
+
+
+def test_archive_member_copies():
+    tar_file = create_calculate_file(b'')
+    with tarfile.open(tar_file, 'w') as archive:
+        for name, data in (('a', b'asd'), ('b', b'qwe'), ('a', b'zxc')):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+    ret_calculate = call_hashfile('--archive', '-a', 'sha1', tar_file)
+    check_file = create_calculate_file(ret_calculate.stdout)
+    ret = call_hashfile('-c', check_file)
+    safe_unlink(tar_file)
+    safe_unlink(check_file)
+
+    assert ret_calculate.stdout == ''.join('sha1: %s %s!%s\n' % (hashlib.sha1(data).hexdigest(), tar_file, name)
+        for name, data in (('a', b'asd'), ('b', b'qwe'), ('a', b'zxc')))
+    # every copy of member is verified against its own entry
+    assert ret.stdout == ''.join('%s!%s: OK\n' % (tar_file, name) for name in ('a', 'b', 'a'))
+
+
+def test_status_stops_without_waiting_for_files_being_read():
+    root = tempfile.mkdtemp()
+    data_file = os.path.join(root, 'data')
+    with open(data_file, 'w') as fh:
+        fh.write('asd')
+    fifo = os.path.join(root, 'fifo')
+    os.mkfifo(fifo)
+    check_file = os.path.join(root, 'manifest')
+    with open(check_file, 'w') as fh:
+        fh.write('sha1: %s %s\n' % (hashlib.sha1(b'qwe').hexdigest(), data_file))
+        fh.write('sha1: %s %s\n' % (hashlib.sha1(b'').hexdigest(), fifo))
+
+    # reading from fifo never ends
+    proc = subprocess.Popen(['hashfile', '-c', '--status', '-j', '2', check_file], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    for _ in range(100):
+        if proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    else:
+        proc.kill()
+    stdout, stderr = proc.communicate()
+    shutil.rmtree(root)
+
+    assert proc.returncode == 1
+    assert stdout == b''
+    assert stderr == b''
+
+
+def test_archive_unreadable_members():
+    members = [('a', b'asd'), ('encrypted', b'qwe'), ('compressed', b'zxc'), ('b', b'rty')]
+    zip_data = io.BytesIO()
+    with zipfile.ZipFile(zip_data, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    zip_data = bytearray(zip_data.getvalue())
+    # mark member as encrypted, and another one as compressed with unknown method, in local headers and in
+    # central directory
+    for signature, flags_offset in ((b'PK\x03\x04', 6), (b'PK\x01\x02', 8)):
+        headers = [match.start() for match in re.finditer(re.escape(signature), bytes(zip_data))]
+        zip_data[headers[1] + flags_offset] |= 1
+        zip_data[headers[2] + flags_offset + 2] = 99
+    zip_file = create_calculate_file(bytes(zip_data))
+
+    ret_calculate = call_hashfile('--archive', '-a', 'sha1', zip_file)
+    check_file = create_calculate_file(''.join('sha1: %s %s!%s\n' % (hashlib.sha1(data).hexdigest(), zip_file, name)
+        for name, data in members))
+    ret = call_hashfile('-c', check_file)
+    safe_unlink(zip_file)
+    safe_unlink(check_file)
+
+    # unreadable member is reported, and the rest of archive is processed
+    assert ret_calculate.code == 0
+    assert ret_calculate.stdout == ''.join('sha1: %s %s!%s\n' % (hashlib.sha1(data).hexdigest(), zip_file, name)
+        for name, data in (members[0], members[3]))
+    assert re.match(r'ERROR: %s!encrypted .*\nERROR: %s!compressed .*\n$' % (re.escape(zip_file), re.escape(zip_file)),
+        ret_calculate.stderr)
+    assert ret.stdout == '%s!a: OK\n%s!b: OK\n' % (zip_file, zip_file)
+    assert re.match(r'ERROR: %s!encrypted .*\nERROR: %s!compressed .*\n$' % (re.escape(zip_file), re.escape(zip_file)),
+        ret.stderr)
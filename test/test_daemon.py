@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from helpers import *
+
+
+def test_batch():
+    data_file = create_calculate_file('asd')
+    ret = call_hashfile('--batch', '-a', 'md5', stdin='%s\0/nonexistent\0%s' % (data_file, data_file))
+    safe_unlink(data_file)
+
+    assert ret.code == 0
+    assert ret.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e %s\n' % data_file * 2
+    assert ret.stderr.startswith('ERROR: /nonexistent ')
+
+
+def test_batch_rejects_files():
+    ret = call_hashfile('--batch', 'file')
+
+    assert ret.code == 2
+    assert ret.stdout == ''
+
+
+def test_serve_client():
+    root = tempfile.mkdtemp()
+    sock = os.path.join(root, 'hashfile.sock')
+    data_file = create_calculate_file('asd')
+    server = subprocess.Popen(['hashfile', '--serve', sock, '-j', '2'])
+    try:
+        for _ in range(100):
+            if os.path.exists(sock):
+                break
+            time.sleep(0.05)
+
+        ret = call_hashfile('--client', sock, '--all-of', 'md5,sha1', data_file, os.path.join(root, 'missing'))
+        ret_algos = call_hashfile('--client', sock, '-a', 'md5', '-a', 'crc32', data_file, data_file)
+    finally:
+        server.terminate()
+        server.wait()
+        safe_unlink(data_file)
+
+    assert not os.path.exists(sock)
+    shutil.rmtree(root)
+
+    assert ret.code == 0
+    assert ret.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e %s\nsha1: %s %s\n' % (
+        data_file, hashlib.sha1(b'asd').hexdigest(), data_file)
+    assert ret.stderr.startswith('ERROR: %s ' % os.path.join(root, 'missing'))
+    assert ret.stderr.count('\n') == 1
+    assert ret_algos.stdout == 'md5: 7815696ecbf1c96e6894b779456d330e %s\ncrc32: f899f771 %s\n' % (
+        data_file, data_file)
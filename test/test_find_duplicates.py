@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from helpers import *
+
+
+def create_tree(contents):
+    root = tempfile.mkdtemp()
+    for name, content in contents.items():
+        path = os.path.join(root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as fh:
+            fh.write(content)
+
+    return root
+
+
+def test_duplicates_grouped():
+    big = os.urandom(100000)
+    root = create_tree({
+        'a': big,
+        os.path.join('sub', 'b'): big,
+        'middle': big[:50000] + b'x' + big[50001:],
+        'small1': b'asd',
+        'small2': b'asd',
+        'unique': b'asdf',
+        'empty1': b'',
+        'empty2': b'',
+    })
+    os.link(os.path.join(root, 'a'), os.path.join(root, 'hardlink'))
+
+    ret = call_hashfile('--find-duplicates', '--sort', '-a', 'md5', root)
+    shutil.rmtree(root)
+
+    big_hash = hashlib.md5(big).hexdigest()
+    small_hash = hashlib.md5(b'asd').hexdigest()
+    assert ret.code == 0
+    assert ret.stdout == '''md5: %s %s
+md5: %s %s
+md5: %s %s
+
+md5: %s %s
+md5: %s %s
+''' % (big_hash, os.path.join(root, 'a'), big_hash, os.path.join(root, 'hardlink'),
+       big_hash, os.path.join(root, 'sub', 'b'),
+       small_hash, os.path.join(root, 'small1'), small_hash, os.path.join(root, 'small2'))
+    assert ret.stderr == ''
+
+
+def test_only_hardlinks_are_not_duplicates():
+    root = create_tree({'a': b'asd'})
+    os.link(os.path.join(root, 'a'), os.path.join(root, 'b'))
+
+    ret = call_hashfile('--find-duplicates', root)
+    shutil.rmtree(root)
+
+    assert ret.code == 0
+    assert ret.stdout == ''
+    assert ret.stderr == ''
+
+
+def test_tree_algorithm_and_invalid_input():
+    big = b'x' * 20000
+    root = create_tree({'a': big, 'b': big})
+
+    ret = call_hashfile('--find-duplicates', '--sort', '-a', 'tree-sha1', root)
+    ret_quick = call_hashfile('--find-duplicates', '-a', 'quick-sha1', root)
+    ret_stdin = call_hashfile('--find-duplicates')
+    shutil.rmtree(root)
+
+    assert ret.code == 0
+    assert [line.split(' ', 2)[2] for line in ret.stdout.splitlines()] == [
+        os.path.join(root, 'a'), os.path.join(root, 'b')]
+    assert ret.stderr == ''
+    assert ret_quick.code == 2
+    assert 'quick-* algorithms' in ret_quick.stderr
+    assert ret_stdin.code == 2
+    assert 'STDIN is not supported' in ret_stdin.stderr
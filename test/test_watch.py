@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from helpers import *
+
+
+def test_watch():
+    root = tempfile.mkdtemp()
+    manifest = os.path.join(root, 'manifest.sum')
+    os.mkdir(os.path.join(root, 'sub'))
+    for name, data in (('a', 'asd'), ('sub/b', 'qwe')):
+        with open(os.path.join(root, name), 'w') as fh:
+            fh.write(data)
+
+    def _wait_for(expected):
+        content = None
+        for _ in range(100):
+            if os.path.exists(manifest):
+                with open(manifest) as fh:
+                    content = fh.read()
+                if content == expected:
+                    return content
+            time.sleep(0.05)
+        return content
+
+    def _entries(*files):
+        return ''.join('md5: %s %s\n' % (hashlib.md5(data).hexdigest(), os.path.join(root, name))
+            for name, data in files)
+
+    watcher = subprocess.Popen(['hashfile', '--watch', root, '--manifest', manifest, '-a', 'md5',
+        '--watch-interval', '0.1', '--exclude', '*.tmp'])
+    try:
+        initial = _wait_for(_entries(('a', b'asd'), ('sub/b', b'qwe')))
+        with open(os.path.join(root, 'a'), 'w') as fh:
+            fh.write('zxc')
+        os.rename(os.path.join(root, 'sub/b'), os.path.join(root, 'c'))
+        with open(os.path.join(root, 'd.tmp'), 'w') as fh:
+            fh.write('excluded')
+        updated = _wait_for(_entries(('a', b'zxc'), ('c', b'qwe')))
+    finally:
+        watcher.terminate()
+        watcher.wait()
+        shutil.rmtree(root)
+
+    assert initial == _entries(('a', b'asd'), ('sub/b', b'qwe'))
+    assert updated == _entries(('a', b'zxc'), ('c', b'qwe'))
+    assert watcher.returncode == 0
+
+
+def test_watch_invalid_options():
+    ret_symlinks = call_hashfile('--watch', '.', '--manifest', 'manifest.sum', '--follow-symlinks')
+    ret_sort = call_hashfile('--watch', '.', '--manifest', 'manifest.sum', '--sort')
+
+    assert ret_symlinks.code == 2
+    assert '--follow-symlinks and --sort options are not available with --watch option' in ret_symlinks.stderr
+    assert ret_sort.code == 2
+    assert '--follow-symlinks and --sort options are not available with --watch option' in ret_sort.stderr